@@ -0,0 +1,9 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# AdamW with flat moment buffers per hyperparameter set
+optimizer = dict(
+    type='FlatAdamW', lr=0.00006, betas=(0.9, 0.999), weight_decay=0.01)
+optimizer_config = dict()
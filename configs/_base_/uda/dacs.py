@@ -19,5 +19,10 @@ uda = dict(
     color_jitter_probability=0.20,
     debug_img_interval=1000,
     print_grad_magnitude=False,
+    proto_update_interval=1,
+    # e.g. dict(update_interval=1) for pseudo-labels of an EMA teacher
+    ema_teacher=None,
 )
 use_ddp_wrapper = True
+# only sync the gradients of the student once per step
+use_student_ddp = False
@@ -2,14 +2,16 @@
 # Modifications:
 # - Override palette, classes, and state dict keys
 
-import matplotlib.pyplot as plt
+import json
+
 import mmcv
 import torch
 from mmcv.parallel import collate, scatter
 from mmcv.runner import load_checkpoint
 
 from mmseg.datasets.pipelines import Compose
-from mmseg.models import build_segmentor
+from mmseg.models import BaseSegmentor, build_segmentor
+from mmseg.ops import resize
 
 
 def init_segmentor(config,
@@ -54,6 +56,112 @@ def init_segmentor(config,
     return model
 
 
+class ExportedSegmentor:
+    """Segmentor that runs a model exported by ``tools/export.py``.
+
+    The artifact is a TorchScript (``.pt``) or ONNX (``.onnx``) file with a
+    json sidecar (``<artifact>.json``) written by the export tool. Inputs
+    are resized to the fixed input shape of the artifact and the logits are
+    resized back. It can be used with :func:`inference_segmentor` and
+    :func:`show_result_pyplot` like a regular segmentor.
+
+    Args:
+        config (:obj:`mmcv.Config`): Config of the exported model.
+        artifact (str): Path of the exported model.
+        device (str): CPU/CUDA device option for TorchScript. ONNX models
+            run with onnxruntime on CPU. Default: 'cpu'.
+        warmup (int): Number of warm-up runs. Default: 3.
+    """
+
+    show_result = BaseSegmentor.show_result
+
+    def __init__(self, config, artifact, device='cpu', warmup=3):
+        with open(artifact + '.json', 'r') as f:
+            meta = json.load(f)
+        self.cfg = config
+        self.input_shape = tuple(meta['input_shape'])
+        self.align_corners = meta['align_corners']
+        self.CLASSES = meta['CLASSES']
+        self.PALETTE = meta['PALETTE']
+        if artifact.endswith('.onnx'):
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise ImportError('Please run "pip install onnxruntime" to '
+                                  'install onnxruntime first.')
+            self.device = torch.device('cpu')
+            self.session = ort.InferenceSession(
+                artifact, providers=['CPUExecutionProvider'])
+            self.script_module = None
+        else:
+            self.device = torch.device(device)
+            self.session = None
+            self.script_module = torch.jit.load(
+                artifact, map_location=self.device)
+            self.script_module.eval()
+        dummy = torch.zeros((1, 3, *self.input_shape), device=self.device)
+        for _ in range(warmup):
+            self.run(dummy)
+
+    def run(self, img):
+        """Compute the logits of an image with the fixed input shape."""
+        if self.session is not None:
+            seg_logit = self.session.run(None, {'input': img.cpu().numpy()})
+            return torch.from_numpy(seg_logit[0])
+        with torch.no_grad():
+            return self.script_module(img)
+
+    def __call__(self, img, img_metas, return_loss=False, rescale=True):
+        assert not return_loss
+        assert len(img) == 1, 'test-time augmentation is not supported'
+        img, img_meta = img[0].to(self.device), img_metas[0]
+        h, w = img.shape[2:]
+        if (h, w) != self.input_shape:
+            img = resize(
+                img,
+                size=self.input_shape,
+                mode='bilinear',
+                align_corners=self.align_corners,
+                warning=False)
+        seg_logit = self.run(img)
+        seg_logit = resize(
+            seg_logit,
+            size=img_meta[0]['ori_shape'][:2] if rescale else (h, w),
+            mode='bilinear',
+            align_corners=self.align_corners,
+            warning=False)
+        if img_meta[0]['flip']:
+            flip_direction = img_meta[0]['flip_direction']
+            assert flip_direction in ['horizontal', 'vertical']
+            if flip_direction == 'horizontal':
+                seg_logit = seg_logit.flip(dims=(3, ))
+            else:
+                seg_logit = seg_logit.flip(dims=(2, ))
+        seg_pred = seg_logit.argmax(dim=1).cpu().numpy()
+        # unravel batch dim
+        return list(seg_pred)
+
+
+def init_exported_segmentor(config, artifact, device='cpu', warmup=3):
+    """Initialize a segmentor from a model exported by ``tools/export.py``.
+
+    Args:
+        config (str or :obj:`mmcv.Config`): Config file path or the config
+            object.
+        artifact (str): TorchScript (.pt) or ONNX (.onnx) file.
+        device (str, optional) CPU/CUDA device option. Default 'cpu'.
+        warmup (int): Number of warm-up runs. Default: 3.
+    Returns:
+        :obj:`ExportedSegmentor`: The warmed-up exported segmentor.
+    """
+    if isinstance(config, str):
+        config = mmcv.Config.fromfile(config)
+    elif not isinstance(config, mmcv.Config):
+        raise TypeError('config must be a filename or Config object, '
+                        'but got {}'.format(type(config)))
+    return ExportedSegmentor(config, artifact, device=device, warmup=warmup)
+
+
 class LoadImage:
     """A simple pipeline to load image."""
 
@@ -93,7 +201,10 @@ def inference_segmentor(model, img):
         (list[Tensor]): The segmentation result.
     """
     cfg = model.cfg
-    device = next(model.parameters()).device  # model device
+    if isinstance(model, ExportedSegmentor):
+        device = model.device
+    else:
+        device = next(model.parameters()).device  # model device
     # build the data pipeline
     test_pipeline = [LoadImage()] + cfg.data.test.pipeline[1:]
     test_pipeline = Compose(test_pipeline)
@@ -101,7 +212,7 @@ def inference_segmentor(model, img):
     data = dict(img=img)
     data = test_pipeline(data)
     data = collate([data], samples_per_gpu=1)
-    if next(model.parameters()).is_cuda:
+    if device.type == 'cuda':
         # scatter to specified GPU
         data = scatter(data, [device])[0]
     else:
@@ -143,6 +254,7 @@ def show_result_pyplot(model,
         model = model.module
     img = model.show_result(
         img, result, palette=palette, show=False, opacity=opacity)
+    import matplotlib.pyplot as plt
     plt.figure(figsize=fig_size)
     plt.imshow(mmcv.bgr2rgb(img))
     plt.title(title)
@@ -1,5 +1,6 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
+import math
 import os.path as osp
 import tempfile
 
@@ -10,6 +11,9 @@ from mmcv.engine import collect_results_cpu, collect_results_gpu
 from mmcv.image import tensor2imgs
 from mmcv.runner import get_dist_info
 
+from mmseg.core.evaluation.spill import PredictionSpillWriter, SpilledResults
+from mmseg.models.utils.visualization import ImageWriterPool
+
 
 def np2tmp(array, temp_file_name=None, tmpdir=None):
     """Save ndarray to local numpy file.
@@ -32,12 +36,72 @@ def np2tmp(array, temp_file_name=None, tmpdir=None):
     return temp_file_name
 
 
+def restore_order(data_loader, results):
+    """Put per-sample results back into sampler order if the data loader
+    batches by shape.
+
+    Args:
+        data_loader (utils.data.Dataloader): Pytorch data loader.
+        results (list): Per-sample results in batch order.
+
+    Returns:
+        list: The results in the order of the dataset (or of the
+            distributed sampler of the current rank).
+    """
+    batch_sampler = data_loader.batch_sampler
+    if hasattr(batch_sampler, 'restore_order'):
+        return batch_sampler.restore_order(results)
+    return results
+
+
+def get_padded_index(num_samples, rank, world_size):
+    """Get the dataset index that a non-shuffling :obj:`DistributedSampler`
+    appends to the samples of ``rank`` for padding, or None."""
+    samples_per_rank = int(math.ceil(num_samples / world_size))
+    position = (samples_per_rank - 1) * world_size + rank
+    if position >= num_samples:
+        return position - num_samples
+    return None
+
+
+def update_evaluator(evaluator,
+                     dataset,
+                     batch_indices,
+                     result,
+                     skip_index=None,
+                     confidences=None):
+    """Add the predictions of a batch to a :obj:`StreamingEvaluator`.
+
+    Returns:
+        int | None: ``skip_index`` if it was not skipped in this batch.
+    """
+    if confidences is None:
+        confidences = [None] * len(result)
+    for idx, pred, confidence in zip(batch_indices, result, confidences):
+        if idx == skip_index:
+            skip_index = None
+            continue
+        evaluator.update(pred, dataset.get_gt_seg_map(idx), confidence)
+    return skip_index
+
+
+def split_confidences(result, return_confidence):
+    """Split the (prediction, confidence) pairs returned by the model with
+    ``return_confidence=True``."""
+    if not return_confidence:
+        return result, None
+    preds, confidences = zip(*result)
+    return list(preds), list(confidences)
+
+
 def single_gpu_test(model,
                     data_loader,
                     show=False,
                     out_dir=None,
                     efficient_test=False,
-                    opacity=0.5):
+                    opacity=0.5,
+                    evaluator=None,
+                    show_nproc=4):
     """Test with single GPU.
 
     Args:
@@ -46,24 +110,42 @@ def single_gpu_test(model,
         show (bool): Whether show results during inference. Default: False.
         out_dir (str, optional): If specified, the results will be dumped into
             the directory to save output results.
-        efficient_test (bool): Whether save the results as local numpy files to
-            save CPU memory during evaluation. Default: False.
+        efficient_test (bool): Whether to spill the results into a compressed
+            shard in ``.efficient_test`` to save CPU memory during
+            evaluation. The results are then returned as lazily decoded
+            :obj:`SpilledResults`. Default: False.
         opacity(float): Opacity of painted segmentation map.
             Default 0.5.
             Must be in (0, 1] range.
+        evaluator (:obj:`StreamingEvaluator`, optional): If specified, the
+            predictions are added to the evaluator and discarded instead of
+            being collected. If its calibration statistics are enabled, the
+            model also returns the confidences. Default: None.
+        show_nproc (int): Number of threads that render and write the
+            images to ``out_dir`` off the inference loop, if ``show`` is
+            False. Default: 4.
     Returns:
-        list: The prediction results.
+        list | :obj:`StreamingEvaluator`: The prediction results or the
+            updated evaluator.
     """
 
     model.eval()
     results = []
     dataset = data_loader.dataset
+    sample_indices = iter(data_loader.batch_sampler)
     prog_bar = mmcv.ProgressBar(len(dataset))
+    spill = None
     if efficient_test:
-        mmcv.mkdir_or_exist('.efficient_test')
+        spill = PredictionSpillWriter('.efficient_test')
+    writer = None
+    if out_dir and not show and show_nproc > 0:
+        writer = ImageWriterPool(show_nproc)
+    return_confidence = bool(getattr(evaluator, 'calibration_bins', 0))
+    test_kwargs = dict(return_confidence=True) if return_confidence else {}
     for i, data in enumerate(data_loader):
         with torch.no_grad():
-            result = model(return_loss=False, **data)
+            result = model(return_loss=False, **test_kwargs, **data)
+        result, confidences = split_confidences(result, return_confidence)
 
         if show or out_dir:
             img_tensor = data['img'][0]
@@ -71,7 +153,7 @@ def single_gpu_test(model,
             imgs = tensor2imgs(img_tensor, **img_metas[0]['img_norm_cfg'])
             assert len(imgs) == len(img_metas)
 
-            for img, img_meta in zip(imgs, img_metas):
+            for j, (img, img_meta) in enumerate(zip(imgs, img_metas)):
                 h, w, _ = img_meta['img_shape']
                 img_show = img[:h, :w, :]
 
@@ -83,26 +165,44 @@ def single_gpu_test(model,
                 else:
                     out_file = None
 
-                model.module.show_result(
-                    img_show,
-                    result,
+                show_kwargs = dict(
                     palette=dataset.PALETTE,
                     show=show,
                     out_file=out_file,
                     opacity=opacity)
+                if writer is not None:
+                    writer.submit(model.module.show_result, img_show,
+                                  result[j:j + 1], **show_kwargs)
+                else:
+                    model.module.show_result(img_show, result[j:j + 1],
+                                             **show_kwargs)
 
-        if isinstance(result, list):
-            if efficient_test:
-                result = [np2tmp(_, tmpdir='.efficient_test') for _ in result]
+        if evaluator is not None:
+            update_evaluator(
+                evaluator,
+                dataset,
+                next(sample_indices),
+                result,
+                confidences=confidences)
+        elif spill is not None:
+            preds = result if isinstance(result, list) else [result]
+            results.extend(spill.append(pred) for pred in preds)
+        elif isinstance(result, list):
             results.extend(result)
         else:
-            if efficient_test:
-                result = np2tmp(result, tmpdir='.efficient_test')
             results.append(result)
 
         batch_size = len(result)
         for _ in range(batch_size):
             prog_bar.update()
+    if writer is not None:
+        writer.close()
+    if evaluator is not None:
+        return evaluator
+    results = restore_order(data_loader, results)
+    if spill is not None:
+        spill.close()
+        results = SpilledResults(results)
     return results
 
 
@@ -110,7 +210,8 @@ def multi_gpu_test(model,
                    data_loader,
                    tmpdir=None,
                    gpu_collect=False,
-                   efficient_test=False):
+                   efficient_test=False,
+                   evaluator=None):
     """Test model with multiple gpus.
 
     This method tests model with multiple gpus and collects the results
@@ -126,32 +227,50 @@ def multi_gpu_test(model,
             different gpus under cpu mode. The same path is used for efficient
             test.
         gpu_collect (bool): Option to use either gpu or cpu to collect results.
-        efficient_test (bool): Whether save the results as local numpy files to
-            save CPU memory during evaluation. Default: False.
+        efficient_test (bool): Whether to spill the results into a compressed
+            shard in ``.efficient_test`` to save CPU memory during
+            evaluation. The results are then returned as lazily decoded
+            :obj:`SpilledResults`. Default: False.
+        evaluator (:obj:`StreamingEvaluator`, optional): If specified, the
+            predictions are added to the evaluator and discarded. Only the
+            confusion matrices (and calibration histograms) are all-reduced.
+            Default: None.
 
     Returns:
-        list: The prediction results.
+        list | :obj:`StreamingEvaluator`: The prediction results or the
+            evaluator updated with the predictions of all ranks.
     """
 
     model.eval()
     results = []
     dataset = data_loader.dataset
+    sample_indices = iter(data_loader.batch_sampler)
     rank, world_size = get_dist_info()
+    # the distributed sampler repeats samples to balance the ranks
+    skip_index = get_padded_index(len(dataset), rank, world_size)
     if rank == 0:
         prog_bar = mmcv.ProgressBar(len(dataset))
+    spill = None
     if efficient_test:
-        mmcv.mkdir_or_exist('.efficient_test')
+        spill = PredictionSpillWriter('.efficient_test')
+    return_confidence = bool(getattr(evaluator, 'calibration_bins', 0))
+    test_kwargs = dict(return_confidence=True) if return_confidence else {}
     for i, data in enumerate(data_loader):
         with torch.no_grad():
-            result = model(return_loss=False, rescale=True, **data)
+            result = model(
+                return_loss=False, rescale=True, **test_kwargs, **data)
+        result, confidences = split_confidences(result, return_confidence)
 
-        if isinstance(result, list):
-            if efficient_test:
-                result = [np2tmp(_, tmpdir='.efficient_test') for _ in result]
+        if evaluator is not None:
+            skip_index = update_evaluator(evaluator, dataset,
+                                          next(sample_indices), result,
+                                          skip_index, confidences)
+        elif spill is not None:
+            preds = result if isinstance(result, list) else [result]
+            results.extend(spill.append(pred) for pred in preds)
+        elif isinstance(result, list):
             results.extend(result)
         else:
-            if efficient_test:
-                result = np2tmp(result, tmpdir='.efficient_test')
             results.append(result)
 
         if rank == 0:
@@ -159,9 +278,18 @@ def multi_gpu_test(model,
             for _ in range(batch_size * world_size):
                 prog_bar.update()
 
+    if evaluator is not None:
+        evaluator.all_reduce()
+        return evaluator
+    results = restore_order(data_loader, results)
+    if spill is not None:
+        # only the index entries of the shards are collected
+        spill.close()
     # collect results from all ranks
     if gpu_collect:
         results = collect_results_gpu(results, len(dataset))
     else:
         results = collect_results_cpu(results, len(dataset), tmpdir)
+    if spill is not None and results is not None:
+        results = SpilledResults(results)
     return results
@@ -11,11 +11,12 @@ import torch
 from mmcv.parallel import MMDataParallel, MMDistributedDataParallel
 from mmcv.runner import build_optimizer, build_runner
 
-from mmseg.core import DistEvalHook, EvalHook
-from mmseg.core.ddp_wrapper import DistributedDataParallelWrapper
+from mmseg.core import (DistEvalHook, EvalHook, LogVarsReduceHook,
+                        UDACheckpointHook, resume_uda_checkpoint)
+from mmseg.core.ddp_wrapper import (DistributedDataParallelWrapper,
+                                    StudentDistributedDataParallel)
 from mmseg.datasets import build_dataloader, build_dataset
 from mmseg.utils import get_root_logger
-from mmseg.models.uda import DACS
 import time
 
 
@@ -68,7 +69,13 @@ def train_segmentor(model,
         use_ddp_wrapper = cfg.get('use_ddp_wrapper', False)
         # Sets the `find_unused_parameters` parameter in
         # torch.nn.parallel.DistributedDataParallel
-        if use_ddp_wrapper:
+        if cfg.get('use_student_ddp', False):
+            mmcv.print_log('Use student DDP.', 'mmseg')
+            model = StudentDistributedDataParallel(
+                model.cuda(),
+                device_ids=[torch.cuda.current_device()],
+                broadcast_buffers=False)
+        elif use_ddp_wrapper:
             mmcv.print_log('Use DDP Wrapper.', 'mmseg')
             model = DistributedDataParallelWrapper(
                 model.cuda(),
@@ -109,6 +116,12 @@ def train_segmentor(model,
                                    cfg.checkpoint_config, cfg.log_config,
                                    cfg.get('momentum_config', None))
 
+    # reduce the log variables only on logging iterations instead of
+    # synchronizing with the device in every step
+    if cfg.get('defer_log_vars', True) and cfg.log_config is not None:
+        runner.register_hook(
+            LogVarsReduceHook(cfg.log_config['interval']), priority='HIGH')
+
     # an ugly walkaround to make the .log and .log.json filenames the same
     runner.timestamp = timestamp
 
@@ -127,7 +140,10 @@ def train_segmentor(model,
         runner.register_hook(eval_hook(val_dataloader, **eval_cfg))
 
     if cfg.resume_from:
-        runner.resume(cfg.resume_from)
+        if any(isinstance(hook, UDACheckpointHook) for hook in runner.hooks):
+            resume_uda_checkpoint(runner, cfg.resume_from, data_loaders)
+        else:
+            runner.resume(cfg.resume_from)
     elif cfg.load_from:
         runner.load_checkpoint(cfg.load_from)
 
@@ -1,9 +1,13 @@
 # Obtained from: https://github.com/open-mmlab/mmgeneration
 # Copyright (c) OpenMMLab. All rights reserved.
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 from mmcv.parallel import MODULE_WRAPPERS, MMDistributedDataParallel
 from mmcv.parallel.scatter_gather import scatter_kwargs
+from mmcv.runner import allreduce_grads
+from torch._utils import (_flatten_dense_tensors, _take_tensors,
+                          _unflatten_dense_tensors)
 from torch.cuda._utils import _get_device_index
 
 
@@ -135,3 +139,123 @@ class DistributedDataParallelWrapper(nn.Module):
                                       [torch.cuda.current_device()])
         output = self.module.val_step(*inputs[0], **kwargs[0])
         return output
+
+
+def broadcast_coalesced(tensors, src=0, bucket_size_mb=25):
+    """Broadcast tensors from rank ``src`` in flattened buckets.
+
+    Args:
+        tensors (list[Tensor]): Tensors that are updated in place.
+        src (int): Source rank. Default: 0.
+        bucket_size_mb (int): Size of the buckets in MB. Default: 25.
+    """
+    bucket_size_bytes = bucket_size_mb * 1024 * 1024
+    for bucket in _take_tensors(tensors, bucket_size_bytes):
+        flat_tensors = _flatten_dense_tensors(bucket)
+        dist.broadcast(flat_tensors, src)
+        for tensor, synced in zip(
+                bucket, _unflatten_dense_tensors(flat_tensors, bucket)):
+            tensor.copy_(synced)
+
+
+@MODULE_WRAPPERS.register_module('mmseg.StudentDDP')
+class StudentDistributedDataParallel(nn.Module):
+    """A data parallel wrapper for UDA models that only syncs the student.
+
+    ``DistributedDataParallelWrapper`` wraps every submodule with
+    parameters, so that the frozen teacher and ImageNet models take part in
+    the gradient bookkeeping of DDP, which requires
+    ``find_unused_parameters``. Moreover, the reducer of DDP expects one
+    backward pass per forward pass, while UDA methods such as DACS call
+    ``backward()`` several times per step, partly through shared graphs.
+
+    This wrapper does not install any gradient hooks. The weights and
+    buffers of the whole model are broadcast from rank 0 once, so the frozen
+    models stay plain replicated modules. The gradients of the student
+    (``get_model()``) are accumulated locally over all backward passes of a
+    step and averaged in flattened buckets by :meth:`reduce_grads`, which
+    is passed to the ``train_step`` of the UDA model and called once right
+    before its optimizer step.
+
+    Args:
+        module (nn.Module): UDA model that needs to be wrapped.
+        device_ids (list[int | `torch.device`] | None): The CUDA device of
+            this process, or None to train on the CPU, e.g. with the gloo
+            backend.
+        dim (int, optional): Same as that in the official scatter function in
+            pytorch. Defaults to 0.
+        broadcast_buffers (bool): Whether to broadcast the buffers of the
+            student from rank 0 before each step. Defaults to False.
+        bucket_size_mb (int): Size of the gradient buckets in MB.
+            Defaults to 25.
+    """
+
+    def __init__(self,
+                 module,
+                 device_ids=None,
+                 dim=0,
+                 broadcast_buffers=False,
+                 bucket_size_mb=25,
+                 **kwargs):
+        super().__init__()
+        assert hasattr(module, 'get_model'), (
+            'StudentDistributedDataParallel only supports UDA models.')
+        assert device_ids is None or len(device_ids) == 1, (
+            'Currently, StudentDistributedDataParallel only supports one '
+            'single CUDA device for each process.'
+            f'The length of device_ids must be 1, but got {len(device_ids)}.')
+        if device_ids is not None:
+            module = module.cuda(device_ids[0])
+            self.output_device = _get_device_index(device_ids[0], True)
+        self.module = module
+        self.device_ids = device_ids
+        self.dim = dim
+        self.broadcast_buffers = broadcast_buffers
+        self.bucket_size_mb = bucket_size_mb
+        module_states = list(module.state_dict().values())
+        broadcast_coalesced(module_states, bucket_size_mb=bucket_size_mb)
+
+    def reduce_grads(self):
+        """Average the gradients of the student over all ranks."""
+        allreduce_grads(
+            list(self.module.get_model().parameters()),
+            coalesce=True,
+            bucket_size_mb=self.bucket_size_mb)
+
+    def scatter(self, inputs, kwargs, device_ids):
+        """Scatter function.
+
+        Args:
+            inputs (Tensor): Input Tensor.
+            kwargs (dict): Args for
+                ``mmcv.parallel.scatter_gather.scatter_kwargs``.
+            device_ids (int): Device id.
+        """
+        return scatter_kwargs(inputs, kwargs, device_ids, dim=self.dim)
+
+    def _scatter(self, inputs, kwargs):
+        if self.device_ids is None:
+            return self.scatter(inputs, kwargs, [-1])
+        return self.scatter(inputs, kwargs, [torch.cuda.current_device()])
+
+    def forward(self, *inputs, **kwargs):
+        inputs, kwargs = self._scatter(inputs, kwargs)
+        return self.module(*inputs[0], **kwargs[0])
+
+    def train_step(self, *inputs, **kwargs):
+        """Train step function.
+
+        The optimizer step of UDA models is part of their ``train_step``,
+        which calls the passed :meth:`reduce_grads` before it.
+        """
+        if self.broadcast_buffers:
+            broadcast_coalesced(
+                list(self.module.get_model().buffers()),
+                bucket_size_mb=self.bucket_size_mb)
+        inputs, kwargs = self._scatter(inputs, kwargs)
+        return self.module.train_step(
+            *inputs[0], reduce_grads=self.reduce_grads, **kwargs[0])
+
+    def val_step(self, *inputs, **kwargs):
+        inputs, kwargs = self._scatter(inputs, kwargs)
+        return self.module.val_step(*inputs[0], **kwargs[0])
@@ -1,10 +1,18 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
+from .async_eval import AsyncEvaluator
+from .cityscapes_eval import CityscapesEvaluator
 from .class_names import get_classes, get_palette
 from .eval_hooks import DistEvalHook, EvalHook
-from .metrics import eval_metrics, mean_dice, mean_fscore, mean_iou
+from .metrics import (calibration_histogram, confusion_matrix, eval_metrics,
+                      mean_dice, mean_fscore, mean_iou, total_area_to_metrics)
+from .spill import PredictionSpillWriter, SpilledResults
+from .streaming import StreamingEvaluator
 
 __all__ = [
     'EvalHook', 'DistEvalHook', 'mean_dice', 'mean_iou', 'mean_fscore',
-    'eval_metrics', 'get_classes', 'get_palette'
+    'eval_metrics', 'get_classes', 'get_palette', 'total_area_to_metrics',
+    'StreamingEvaluator', 'confusion_matrix', 'AsyncEvaluator',
+    'PredictionSpillWriter', 'SpilledResults', 'CityscapesEvaluator',
+    'calibration_histogram'
 ]
@@ -0,0 +1,306 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import copy
+import os
+import os.path as osp
+import queue
+import sys
+import traceback
+from collections import OrderedDict
+
+import mmcv
+import torch
+import torch.multiprocessing as mp
+from mmcv.parallel import MMDataParallel
+
+
+def get_eval_model(model):
+    """Get the segmentor that performs the inference of ``model``.
+
+    For UDA models, this is the student network returned by ``get_model()``.
+
+    Returns:
+        tuple[str, nn.Module]: The prefix of the segmentor parameters in the
+            state dict of ``model`` and the segmentor.
+    """
+    if hasattr(model, 'module'):
+        model = model.module
+    if not hasattr(model, 'get_model'):
+        return '', model
+    eval_model = model.get_model()
+    for name, module in model.named_modules():
+        if module is eval_model:
+            return name + '.', eval_model
+    raise ValueError('The evaluation model is not a submodule.')
+
+
+def async_eval_worker(model, dataset, job_queue, result_queue, device,
+                      eval_kwargs, gt_cache_dir, streaming, efficient_test):
+    """Evaluate the weights from ``job_queue`` until a None job arrives."""
+    from mmseg.apis import single_gpu_test
+    from mmseg.datasets import build_dataloader
+
+    # keep the progress bars out of the training log
+    sys.stdout = open(os.devnull, 'w')
+    torch.cuda.set_device(device)
+    model = MMDataParallel(model.cuda(device), device_ids=[device])
+    # a daemon process cannot start dataloader workers
+    dataloader = build_dataloader(
+        dataset, samples_per_gpu=1, workers_per_gpu=0, dist=False,
+        shuffle=False)
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        job_id, state_dict = job
+        try:
+            model.module.load_state_dict(state_dict)
+            evaluator = None
+            if streaming:
+                evaluator = dataset.get_streaming_evaluator()
+            results = single_gpu_test(
+                model,
+                dataloader,
+                efficient_test=efficient_test,
+                evaluator=evaluator)
+            if gt_cache_dir is not None and not streaming:
+                dataset.get_gt_seg_map_store(
+                    eval_kwargs.get('nproc', 4), cache_dir=gt_cache_dir)
+            eval_res = dataset.evaluate(
+                results, logger='silent', **eval_kwargs)
+            result_queue.put((job_id, eval_res, None))
+        except Exception:
+            result_queue.put((job_id, None, traceback.format_exc()))
+        # release the shared memory of the snapshot
+        del job, state_dict
+
+
+class AsyncEvaluator(object):
+    """Evaluate weight snapshots in side processes while training continues.
+
+    Each evaluation snapshots the weights of the evaluation model into
+    shared CPU memory and queues them for one of ``max_concurrent`` spawned
+    worker processes, which hold a copy of the model and their own
+    dataloader. At most ``max_concurrent`` evaluations are pending at a
+    time; otherwise, :meth:`submit` waits until one of them finishes.
+
+    Args:
+        dataset (Dataset): The evaluation dataset.
+        eval_kwargs (dict): Arguments of ``dataset.evaluate``.
+        max_concurrent (int): Number of worker processes and pending
+            evaluations. Default: 1.
+        device (int, optional): GPU of the workers. If not specified, the
+            current device of the training process is used. Default: None.
+        gt_cache_dir (str, optional): Directory of the ground truth cache.
+            Default: None.
+        streaming (bool): Whether to use streaming evaluation.
+            Default: False.
+        efficient_test (bool): Whether to spill the results into a compressed
+            shard. Default: False.
+    """
+
+    def __init__(self,
+                 dataset,
+                 eval_kwargs,
+                 max_concurrent=1,
+                 device=None,
+                 gt_cache_dir=None,
+                 streaming=False,
+                 efficient_test=False):
+        self.dataset = dataset
+        self.eval_kwargs = eval_kwargs
+        self.max_concurrent = max_concurrent
+        self.device = device
+        self.gt_cache_dir = gt_cache_dir
+        self.streaming = streaming
+        self.efficient_test = efficient_test
+        self.workers = []
+        self.pending = OrderedDict()
+        self._next_job_id = 0
+
+    def _start_workers(self, eval_model):
+        ctx = mp.get_context('spawn')
+        self.job_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        device = self.device
+        if device is None:
+            device = torch.cuda.current_device()
+        template = copy.deepcopy(eval_model).cpu()
+        for _ in range(self.max_concurrent):
+            worker = ctx.Process(
+                target=async_eval_worker,
+                args=(template, self.dataset, self.job_queue,
+                      self.result_queue, device, self.eval_kwargs,
+                      self.gt_cache_dir, self.streaming,
+                      self.efficient_test),
+                daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, model, tag):
+        """Snapshot the weights of ``model`` and queue their evaluation.
+
+        Args:
+            model (nn.Module): The (wrapped) model of the runner.
+            tag (dict): Information returned with the results, e.g. the
+                iteration of the snapshot.
+
+        Returns:
+            list[tuple]: Evaluations that finished while waiting for a free
+                slot, see :meth:`collect`.
+        """
+        prefix, eval_model = get_eval_model(model)
+        if not self.workers:
+            self._start_workers(eval_model)
+        finished = []
+        while len(self.pending) >= self.max_concurrent:
+            finished.extend(self.collect(block=True))
+        state_dict = OrderedDict(
+            (k, v.detach().to('cpu', copy=True).share_memory_())
+            for k, v in eval_model.state_dict().items())
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        self.pending[job_id] = dict(
+            tag=tag, prefix=prefix, state_dict=state_dict)
+        self.job_queue.put((job_id, state_dict))
+        return finished
+
+    def collect(self, block=False):
+        """Get the finished evaluations.
+
+        Args:
+            block (bool): Whether to wait for a pending evaluation to
+                finish if none has finished yet. Default: False.
+
+        Returns:
+            list[tuple]: The job info (``tag``, ``prefix`` and
+                ``state_dict`` of the snapshot), the evaluation results and
+                the traceback if the evaluation failed.
+        """
+        finished = []
+        while self.pending:
+            try:
+                job_id, eval_res, error = self.result_queue.get(
+                    block=block and not finished, timeout=60)
+            except queue.Empty:
+                if not block or finished:
+                    break
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('An async evaluation worker died.')
+                continue
+            finished.append((self.pending.pop(job_id), eval_res, error))
+        return finished
+
+    def shutdown(self):
+        """Wait for the pending evaluations and stop the workers.
+
+        Returns:
+            list[tuple]: The remaining evaluations, see :meth:`collect`.
+        """
+        finished = []
+        while self.pending:
+            finished.extend(self.collect(block=True))
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        return finished
+
+
+def save_async_best(hook, runner, key_score, job):
+    """Save the snapshot of an async evaluation if it has the best score.
+
+    Unlike ``EvalHook._save_ckpt``, the evaluated snapshot is saved instead
+    of the current weights of the runner.
+    """
+    hook_msgs = runner.meta.setdefault('hook_msgs', dict())
+    best_score = hook_msgs.get('best_score', hook.init_value_map[hook.rule])
+    if not hook.compare_func(key_score, best_score):
+        return
+    hook_msgs['best_score'] = key_score
+    best_ckpt_path = getattr(hook, 'best_ckpt_path', None)
+    if best_ckpt_path and osp.isfile(best_ckpt_path):
+        os.remove(best_ckpt_path)
+    progress = job['tag']['progress']
+    out_dir = getattr(hook, 'out_dir', None) or runner.work_dir
+    hook.best_ckpt_path = osp.join(
+        out_dir, f'best_{hook.key_indicator}_{progress}.pth')
+    hook_msgs['best_ckpt'] = hook.best_ckpt_path
+    state_dict = OrderedDict((job['prefix'] + k, v)
+                             for k, v in job['state_dict'].items())
+    meta = dict(runner.meta, **job['tag'])
+    mmcv.mkdir_or_exist(out_dir)
+    torch.save(dict(meta=meta, state_dict=state_dict), hook.best_ckpt_path)
+    runner.logger.info(f'Now best checkpoint is saved as '
+                       f'{osp.basename(hook.best_ckpt_path)}.')
+    runner.logger.info(f'Best {hook.key_indicator} is {key_score:0.4f} '
+                       f'at {progress} {job["tag"]["unit"]}.')
+
+
+def submit_async_eval(hook, runner):
+    """Queue the async evaluation of the current weights of the runner."""
+    if hook._async_evaluator is None:
+        gt_cache_dir = None
+        if hook.eval_kwargs.get('gt_cache', True):
+            gt_cache_dir = hook.gt_cache_dir
+            if gt_cache_dir is None:
+                gt_cache_dir = osp.join(runner.work_dir, '.gt_cache')
+        hook._async_evaluator = AsyncEvaluator(
+            hook.dataloader.dataset,
+            hook.eval_kwargs,
+            gt_cache_dir=gt_cache_dir,
+            streaming=hook.streaming,
+            efficient_test=hook.efficient_test,
+            **hook.async_eval)
+    if hook.by_epoch:
+        tag = dict(unit='epoch', progress=runner.epoch + 1)
+    else:
+        tag = dict(unit='iter', progress=runner.iter + 1)
+    log_async_results(hook, runner,
+                      hook._async_evaluator.submit(runner.model, tag))
+
+
+def collect_async_eval(hook, runner, shutdown=False):
+    """Log the async evaluations that finished since the last call.
+
+    Args:
+        shutdown (bool): Whether to wait for all pending evaluations and
+            stop the workers. Default: False.
+    """
+    if hook._async_evaluator is None:
+        return
+    if shutdown:
+        finished = hook._async_evaluator.shutdown()
+        hook._async_evaluator = None
+    else:
+        finished = hook._async_evaluator.collect()
+    log_async_results(hook, runner, finished)
+
+
+def log_async_results(hook, runner, finished):
+    """Log finished async evaluations and update the best checkpoint."""
+    for job, eval_res, error in finished:
+        tag = job['tag']
+        if error is not None:
+            runner.logger.error(
+                f'Async evaluation at {tag["unit"]} {tag["progress"]} '
+                f'failed:\n{error}')
+            continue
+        runner.logger.info(
+            f'Async evaluation at {tag["unit"]} {tag["progress"]}: ' +
+            ', '.join(f'{k}: {v:.4f}' for k, v in eval_res.items()
+                      if '.' not in k and isinstance(v, (int, float))))
+        for name, val in eval_res.items():
+            runner.log_buffer.output[name] = val
+        runner.log_buffer.output['eval_progress'] = tag['progress']
+        runner.log_buffer.ready = True
+        if hook.save_best is not None:
+            if hook.key_indicator == 'auto':
+                hook._init_rule(hook.rule, list(eval_res.keys())[0])
+            key_score = eval_res.get(hook.key_indicator, None)
+            if key_score is not None:
+                save_async_best(hook, runner, key_score, job)
@@ -0,0 +1,247 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import math
+
+import numpy as np
+
+
+def _import_cityscapes_labels():
+    try:
+        import cityscapesscripts.helpers.labels as CSLabels
+    except ImportError:
+        raise ImportError('Please run "pip install cityscapesscripts" to '
+                          'install cityscapesscripts first.')
+    return CSLabels
+
+
+class CityscapesEvaluator(object):
+    """Pixel-level Cityscapes evaluation of in-memory predictions.
+
+    This computes the same results as ``evaluateImgLists`` of
+    cityscapesscripts with ``evalInstLevelScore`` and ``evalPixelAccuracy``
+    enabled, but takes the label id predictions as arrays, so they do not
+    have to be written to and read back from png files. The confusion matrix
+    of each image is computed with a single bincount and the instance
+    statistics with bincounts over the instances.
+
+    Args:
+        avg_class_size (dict[str, float]): Average instance size of each
+            class, i.e. ``args.avgClassSize`` of cityscapesscripts.
+    """
+
+    def __init__(self, avg_class_size):
+        CSLabels = _import_cityscapes_labels()
+        self.id2label = CSLabels.id2label
+        self.category2labels = CSLabels.category2labels
+        self.avg_class_size = avg_class_size
+        self.eval_labels = [
+            label.id for label in CSLabels.labels if label.id >= 0
+        ]
+        self.num_ids = max(self.eval_labels) + 1
+        self.conf_matrix = np.zeros((self.num_ids, self.num_ids),
+                                    dtype=np.int64)
+        self.not_ignored = [
+            label_id for label_id in self.eval_labels
+            if not self.id2label[label_id].ignoreInEval
+        ]
+
+        self.inst_stats = dict(classes=dict(), categories=dict())
+        for label in CSLabels.labels:
+            if label.hasInstances and not label.ignoreInEval:
+                self.inst_stats['classes'][label.name] = dict(
+                    tp=0.0, tpWeighted=0.0, fn=0.0, fnWeighted=0.0)
+        for category, labels in self.category2labels.items():
+            label_ids = [label.id for label in labels if label.id >= 0]
+            if all(label.hasInstances for label in labels
+                   if label.id >= 0):
+                self.inst_stats['categories'][category] = dict(
+                    tp=0.0,
+                    tpWeighted=0.0,
+                    fn=0.0,
+                    fnWeighted=0.0,
+                    labelIds=label_ids)
+        # membership of the label ids in the instance categories, where the
+        # last row of ``in_category`` is for labels without such a category
+        categories = list(self.inst_stats['categories'])
+        self.category_index = np.full(self.num_ids, -1, dtype=np.int64)
+        self.in_category = np.zeros((len(categories) + 1, self.num_ids),
+                                    dtype=bool)
+        for i, category in enumerate(categories):
+            label_ids = self.inst_stats['categories'][category]['labelIds']
+            self.in_category[i, label_ids] = True
+            self.category_index[label_ids] = i
+        self.not_ignored_mask = np.zeros(self.num_ids, dtype=bool)
+        self.not_ignored_mask[self.not_ignored] = True
+        self.per_image_stats = dict()
+
+    def process(self, pred, gt, instances=None):
+        """Compute the statistics of one image.
+
+        This only reads the arrays and can run in parallel threads. The
+        statistics are accumulated by :meth:`update`.
+
+        Args:
+            pred (ndarray): Predicted label ids.
+            gt (ndarray): Ground truth label ids (``*_gtFine_labelIds.png``).
+            instances (ndarray, optional): Ground truth instance ids
+                (``*_gtFine_instanceIds.png``). Default: None.
+
+        Returns:
+            tuple: The confusion matrix, the (label id, size, tp, category
+                tp) of each instance and the pixel accuracy statistics.
+        """
+        if pred.shape != gt.shape:
+            raise ValueError(f'The prediction shape {pred.shape} does not '
+                             f'match the ground truth shape {gt.shape}.')
+        gt = gt.astype(np.int64).reshape(-1)
+        pred = pred.astype(np.int64).reshape(-1)
+        if gt.min() < 0 or gt.max() >= self.num_ids:
+            raise ValueError('Unknown ground truth label id.')
+        if pred.min() < 0 or pred.max() >= self.num_ids:
+            raise ValueError('Unknown predicted label id.')
+        conf_matrix = np.bincount(
+            gt * self.num_ids + pred,
+            minlength=self.num_ids**2).reshape(self.num_ids, self.num_ids)
+
+        inst_records = []
+        if instances is not None:
+            instances = instances.reshape(-1)
+            selected = instances > 1000
+            inst_ids, inverse = np.unique(
+                instances[selected], return_inverse=True)
+            inst_labels = inst_ids // 1000
+            pixel_labels = inst_labels[inverse]
+            inst_pred = pred[selected]
+            sizes = np.bincount(inverse, minlength=len(inst_ids))
+            tps = np.bincount(
+                inverse,
+                weights=inst_pred == pixel_labels,
+                minlength=len(inst_ids))
+            cat_tps = np.bincount(
+                inverse,
+                weights=self.in_category[self.category_index[pixel_labels],
+                                         inst_pred],
+                minlength=len(inst_ids))
+            for label_id, size, tp, cat_tp in zip(inst_labels, sizes, tps,
+                                                  cat_tps):
+                inst_records.append(
+                    (int(label_id), int(size), int(tp), int(cat_tp)))
+
+        # cityscapesscripts inverts the masks of the per image statistics,
+        # which is kept here to report the same numbers
+        ignored = ~self.not_ignored_mask[gt]
+        pixel_stats = dict(
+            nbNotIgnoredPixels=int(np.count_nonzero(ignored)),
+            nbCorrectPixels=int(np.count_nonzero(ignored & (pred != gt))))
+        return conf_matrix, inst_records, pixel_stats
+
+    def update(self, name, stats):
+        """Accumulate the statistics of :meth:`process` for image ``name``."""
+        conf_matrix, inst_records, pixel_stats = stats
+        self.conf_matrix += conf_matrix
+        for label_id, size, tp, cat_tp in inst_records:
+            label = self.id2label[label_id]
+            if label.ignoreInEval:
+                continue
+            weight = self.avg_class_size[label.name] / float(size)
+            class_stats = self.inst_stats['classes'][label.name]
+            class_stats['tp'] += tp
+            class_stats['fn'] += size - tp
+            class_stats['tpWeighted'] += float(tp) * weight
+            class_stats['fnWeighted'] += float(size - tp) * weight
+            cat_stats = self.inst_stats['categories'].get(label.category)
+            if cat_stats is not None:
+                cat_stats['tp'] += cat_tp
+                cat_stats['fn'] += size - cat_tp
+                cat_stats['tpWeighted'] += float(cat_tp) * weight
+                cat_stats['fnWeighted'] += float(size - cat_tp) * weight
+        self.per_image_stats[name] = pixel_stats
+
+    def _iou(self, tp, fn, fp):
+        denom = tp + fp + fn
+        if denom == 0:
+            return float('nan')
+        return float(tp) / denom
+
+    def _fp(self, label_ids, rows):
+        return int(self.conf_matrix[rows, :][:, label_ids].sum())
+
+    @staticmethod
+    def _average(scores):
+        valid = [score for score in scores.values() if not math.isnan(score)]
+        if len(valid) == 0:
+            return float('nan')
+        return sum(valid) / len(valid)
+
+    def results(self):
+        """Compute the scores as ``evaluateImgLists`` of cityscapesscripts.
+
+        Returns:
+            dict: The confusion matrix, the priors, class and category
+                (instance) IoUs and their averages and the per image
+                statistics.
+        """
+        conf_matrix = self.conf_matrix
+        class_scores, class_inst_scores = dict(), dict()
+        for label_id in self.eval_labels:
+            label = self.id2label[label_id]
+            class_scores[label.name] = float('nan')
+            class_inst_scores[label.name] = float('nan')
+            if label.ignoreInEval:
+                continue
+            rows = [i for i in self.not_ignored if i != label_id]
+            fp = self._fp([label_id], rows)
+            tp = int(conf_matrix[label_id, label_id])
+            fn = int(conf_matrix[label_id].sum()) - tp
+            class_scores[label.name] = self._iou(tp, fn, fp)
+            inst_stats = self.inst_stats['classes'].get(label.name)
+            if inst_stats is not None:
+                class_inst_scores[label.name] = self._iou(
+                    inst_stats['tpWeighted'], inst_stats['fnWeighted'], fp)
+
+        category_scores, category_inst_scores = dict(), dict()
+        for category, labels in self.category2labels.items():
+            rows = [
+                i for i in self.not_ignored
+                if self.id2label[i].category != category
+            ]
+            label_ids = [
+                label.id for label in labels
+                if not label.ignoreInEval and label.id in self.eval_labels
+            ]
+            category_scores[category] = float('nan')
+            if label_ids:
+                tp = int(conf_matrix[label_ids, :][:, label_ids].sum())
+                fn = int(conf_matrix[label_ids, :].sum()) - tp
+                category_scores[category] = self._iou(
+                    tp, fn, self._fp(label_ids, rows))
+            category_inst_scores[category] = float('nan')
+            inst_stats = self.inst_stats['categories'].get(category)
+            if inst_stats is not None:
+                category_inst_scores[category] = self._iou(
+                    inst_stats['tpWeighted'], inst_stats['fnWeighted'],
+                    self._fp(inst_stats['labelIds'], rows))
+
+        total = conf_matrix.sum()
+        results = dict(
+            confMatrix=conf_matrix.tolist(),
+            priors={
+                self.id2label[i].name: float(conf_matrix[i].sum()) / total
+                for i in self.eval_labels
+            },
+            labels={self.id2label[i].name: i
+                    for i in self.eval_labels},
+            classScores=class_scores,
+            classInstScores=class_inst_scores,
+            categoryScores=category_scores,
+            categoryInstScores=category_inst_scores,
+            averageScoreClasses=self._average(class_scores),
+            averageScoreInstClasses=self._average(class_inst_scores),
+            averageScoreCategories=self._average(category_scores),
+            averageScoreInstCategories=self._average(category_inst_scores))
+        if self.per_image_stats:
+            results['perImageScores'] = self.per_image_stats
+        return results
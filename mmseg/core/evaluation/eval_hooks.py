@@ -1,67 +1,382 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
+import os
 import os.path as osp
 
+import mmcv
+import numpy as np
+import torch
 import torch.distributed as dist
 from mmcv.runner import DistEvalHook as _DistEvalHook
 from mmcv.runner import EvalHook as _EvalHook
+from mmcv.utils import print_log
 from torch.nn.modules.batchnorm import _BatchNorm
+from torch.utils.data import Subset
 
+from .async_eval import collect_async_eval, submit_async_eval
+from .fast_eval import (bootstrap_miou, override_test_cfg,
+                        select_stratified_subset)
+from .metrics import intersect_and_union
 
-class EvalHook(_EvalHook):
-    """Single GPU EvalHook, with efficient test support.
+
+def prepare_gt_cache(hook, runner):
+    """Load the packed ground truth cache of the evaluation dataset.
+
+    The cache is built by the first evaluation and only checked for modified
+    label files by the later ones, which then read the labels without
+    decoding them.
+    """
+    dataset = hook.dataloader.dataset
+    if not hook.eval_kwargs.get('gt_cache', True) or \
+            not hasattr(dataset, 'get_gt_seg_map_store'):
+        return
+    cache_dir = hook.gt_cache_dir
+    if cache_dir is None:
+        cache_dir = osp.join(runner.work_dir, '.gt_cache')
+    dataset.get_gt_seg_map_store(
+        hook.eval_kwargs.get('nproc', 4), cache_dir=cache_dir)
+
+
+def run_full_eval(hook, runner):
+    """Whether the full validation set has to be evaluated in fast mode.
+
+    This is the case at the last iteration/epoch, every
+    ``fast_eval.full_interval`` iterations/epochs and on demand, either by
+    :meth:`request_full_eval` or by creating the file ``work_dir/FULL_EVAL``.
+    """
+    if hook.fast_eval is None:
+        return True
+    full = hook._full_eval_requested
+    trigger_file = osp.join(runner.work_dir, 'FULL_EVAL')
+    if runner.rank == 0 and osp.isfile(trigger_file):
+        os.remove(trigger_file)
+        full = True
+    if hook.by_epoch:
+        full = full or hook.is_last_epoch(runner)
+    else:
+        full = full or hook.is_last_iter(runner)
+    full_interval = hook.fast_eval.get('full_interval', None)
+    if full_interval:
+        if hook.by_epoch:
+            full = full or hook.every_n_epochs(runner, full_interval)
+        else:
+            full = full or hook.every_n_iters(runner, full_interval)
+    if dist.is_available() and dist.is_initialized():
+        # the trigger file is only checked on rank 0
+        device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+        flag = torch.tensor([int(full)], device=device)
+        dist.broadcast(flag, 0)
+        full = bool(flag.item())
+    hook._full_eval_requested = False
+    return full
+
+
+def get_fast_eval_indices(hook, runner):
+    """Get the fixed stratified subset of the validation set.
+
+    Rank 0 selects the subset from the class statistics of the ground truth
+    and saves it to ``work_dir/fast_eval_subset.json``, from where all ranks
+    load it. It has to be called on all ranks.
+    """
+    if hook._fast_eval_indices is not None:
+        return hook._fast_eval_indices
+    subset_file = osp.join(runner.work_dir, 'fast_eval_subset.json')
+    if runner.rank == 0:
+        dataset = hook.dataloader.dataset
+        prepare_gt_cache(hook, runner)
+        class_pixels = dataset.get_class_pixels(
+            hook.eval_kwargs.get('nproc', 4))
+        indices = select_stratified_subset(
+            class_pixels,
+            hook.fast_eval.get('num_samples', 100),
+            hook.fast_eval.get('min_samples_per_class', 3),
+            hook.fast_eval.get('seed', 0))
+        mmcv.dump(indices, subset_file)
+        print_log(
+            f'Fast evaluation on {len(indices)} of {len(dataset)} images',
+            logger=runner.logger)
+    if dist.is_available() and dist.is_initialized():
+        dist.barrier()
+    hook._fast_eval_indices = mmcv.load(subset_file)
+    return hook._fast_eval_indices
+
+
+def get_fast_eval_dataloader(hook, runner, distributed=False):
+    """Build the dataloader of the fast evaluation subset."""
+    if hook._fast_eval_dataloader is None:
+        from mmseg.datasets import build_dataloader
+        hook._fast_eval_dataloader = build_dataloader(
+            Subset(hook.dataloader.dataset,
+                   get_fast_eval_indices(hook, runner)),
+            samples_per_gpu=1,
+            workers_per_gpu=hook.dataloader.num_workers,
+            dist=distributed,
+            shuffle=False)
+    return hook._fast_eval_dataloader
+
+
+def fast_evaluate(hook, runner, results):
+    """Estimate the mIoU and its confidence interval on the fast evaluation
+    subset.
+
+    Args:
+        results (list[ndarray]): Predictions of the subset images.
+
+    Returns:
+        dict[str, float]: ``fast.mIoU`` and the bounds ``fast.mIoU_low`` and
+            ``fast.mIoU_high`` of its confidence interval.
+    """
+    dataset = hook.dataloader.dataset
+    indices = get_fast_eval_indices(hook, runner)
+    assert len(results) == len(indices)
+    num_classes = len(dataset.CLASSES)
+    store = None
+    if hook.eval_kwargs.get('gt_cache', True):
+        store = dataset.get_gt_seg_map_store(hook.eval_kwargs.get('nproc', 4))
+    areas = np.zeros((len(indices), 2, num_classes))
+    for i, (idx, result) in enumerate(zip(indices, results)):
+        if store is not None:
+            # the store contains the mapped labels
+            gt_seg_map, label_map, reduce_zero_label = store[idx], None, False
+        else:
+            gt_seg_map = dataset.get_gt_seg_map(idx)
+            label_map = dataset.label_map
+            reduce_zero_label = dataset.reduce_zero_label
+        area_intersect, area_union, _, _ = intersect_and_union(
+            result, gt_seg_map, num_classes, dataset.ignore_index, label_map,
+            reduce_zero_label)
+        areas[i, 0] = area_intersect.numpy()
+        areas[i, 1] = area_union.numpy()
+    ci = hook.fast_eval.get('ci', 0.95)
+    miou, low, high = bootstrap_miou(
+        areas,
+        hook.fast_eval.get('num_bootstrap', 1000),
+        ci,
+        seed=hook.fast_eval.get('seed', 0))
+    print_log(
+        f'Fast mIoU on {len(indices)} images: {miou * 100:.2f} '
+        f'({ci * 100:.0f}% CI: {low * 100:.2f} - {high * 100:.2f})',
+        logger=runner.logger)
+    return {'fast.mIoU': miou, 'fast.mIoU_low': low, 'fast.mIoU_high': high}
+
+
+def evaluate_and_log(hook, runner, results, fast_results=None):
+    """Evaluate the results and log the metrics.
+
+    Args:
+        results (list | :obj:`StreamingEvaluator` | None): Results of the
+            full validation set or None if only the subset was evaluated.
+        fast_results (list[ndarray], optional): Predictions of the fast
+            evaluation subset with the ``test_cfg`` overrides.
+
+    Returns:
+        float | None: The score of ``save_best`` if it was evaluated.
+    """
+    eval_res = {}
+    if results is not None:
+        eval_res = hook.dataloader.dataset.evaluate(
+            results, logger=runner.logger, **hook.eval_kwargs)
+        if hook.calibration_bins:
+            dump_calibration(hook, runner, results)
+    if fast_results is not None:
+        eval_res.update(fast_evaluate(hook, runner, fast_results))
+    for name, val in eval_res.items():
+        runner.log_buffer.output[name] = val
+    runner.log_buffer.ready = True
+    if hook.save_best is None:
+        return None
+    if hook.key_indicator == 'auto':
+        hook._init_rule(hook.rule, list(eval_res.keys())[0])
+    return eval_res.get(hook.key_indicator, None)
+
+
+def dump_calibration(hook, runner, evaluator):
+    """Write the calibration statistics of a streaming evaluation to
+    ``work_dir/calibration_{iter|epoch}_{progress}.json``."""
+    if hook.by_epoch:
+        name = f'calibration_epoch_{runner.epoch + 1}.json'
+    else:
+        name = f'calibration_iter_{runner.iter + 1}.json'
+    filename = osp.join(runner.work_dir, name)
+    evaluator.dump_calibration(filename, hook.dataloader.dataset.CLASSES)
+    runner.logger.info(f'Calibration statistics are saved to {filename}.')
+
+
+class EvalHookMixin(object):
+    """Evaluation shared by :class:`EvalHook` and :class:`DistEvalHook`.
 
     Args:
         by_epoch (bool): Determine perform evaluation by epoch or by iteration.
             If set to True, it will perform by epoch. Otherwise, by iteration.
             Default: False.
-        efficient_test (bool): Whether save the results as local numpy files to
-            save CPU memory during evaluation. Default: False.
-    Returns:
-        list: The prediction results.
+        efficient_test (bool): Whether to spill the results into a compressed
+            shard to save CPU memory during evaluation. Default: False.
+        streaming (bool): Whether to accumulate a confusion matrix during
+            testing instead of keeping the predictions. Default: False.
+        gt_cache_dir (str, optional): Directory of the packed ground truth
+            cache, which is built once and reused by all evaluations. If not
+            specified, ``work_dir/.gt_cache`` is used. Default: None.
+        fast_eval (dict, optional): If specified, periodic evaluations only
+            run on a fixed subset of ``num_samples`` (default: 100) images
+            that covers each class with ``min_samples_per_class`` (default:
+            3) images, using the ``test_cfg`` overrides (e.g.
+            ``dict(input_scale=0.5)``), and report ``fast.mIoU`` with a
+            bootstrapped ``ci`` (default: 0.95) confidence interval. The full
+            set is evaluated at the end, every ``full_interval`` and on
+            demand. The subset is evaluated with the same overrides at
+            every evaluation, so that ``save_best='fast.mIoU'`` compares
+            the same score. Default: None.
+        async_eval (dict, optional): If specified, the weights are evaluated
+            in side processes while training continues, see
+            :class:`AsyncEvaluator` for the options (e.g.
+            ``dict(max_concurrent=1, device=1)``). The metrics are logged
+            when they are available and ``save_best`` saves the evaluated
+            weights. Default: None.
+        calibration_bins (int): If positive, the streaming evaluation also
+            accumulates per-class confidence histograms with this number of
+            bins and writes the calibration statistics of each evaluation
+            to ``work_dir``, see :meth:`StreamingEvaluator.get_calibration`.
+            Default: 0.
     """
 
-    greater_keys = ['mIoU', 'mAcc', 'aAcc']
+    greater_keys = ['mIoU', 'mAcc', 'aAcc', 'fast.mIoU']
+    distributed = False
 
-    def __init__(self, *args, by_epoch=False, efficient_test=False, **kwargs):
+    def __init__(self,
+                 *args,
+                 by_epoch=False,
+                 efficient_test=False,
+                 streaming=False,
+                 gt_cache_dir=None,
+                 fast_eval=None,
+                 async_eval=None,
+                 calibration_bins=0,
+                 **kwargs):
+        if async_eval is not None and fast_eval is not None:
+            raise ValueError('async_eval and fast_eval cannot be combined.')
+        if calibration_bins and (not streaming or async_eval is not None):
+            raise ValueError('calibration_bins requires streaming and does '
+                             'not support async_eval.')
         super().__init__(*args, by_epoch=by_epoch, **kwargs)
+        # the ground truth is decoded once for all evaluations of a run
+        self.eval_kwargs.setdefault('gt_cache', True)
         self.efficient_test = efficient_test
+        self.streaming = streaming
+        self.gt_cache_dir = gt_cache_dir
+        self.fast_eval = fast_eval
+        self._full_eval_requested = False
+        self._fast_eval_indices = None
+        self._fast_eval_dataloader = None
+        self.async_eval = async_eval
+        self._async_evaluator = None
+        self.calibration_bins = calibration_bins
+
+    def request_full_eval(self):
+        """Evaluate the full validation set at the next evaluation."""
+        self._full_eval_requested = True
+
+    def _is_last(self, runner):
+        if self.by_epoch:
+            return self.is_last_epoch(runner)
+        return self.is_last_iter(runner)
+
+    def after_train_iter(self, runner):
+        super().after_train_iter(runner)
+        if runner.rank == 0:
+            collect_async_eval(self, runner)
+
+    def after_train_epoch(self, runner):
+        super().after_train_epoch(runner)
+        if runner.rank == 0:
+            collect_async_eval(self, runner)
+
+    def after_run(self, runner):
+        if runner.rank == 0:
+            collect_async_eval(self, runner, shutdown=True)
+
+    def _get_evaluator(self):
+        if not self.streaming:
+            return None
+        return self.dataloader.dataset.get_streaming_evaluator(
+            self.calibration_bins)
+
+    def _test(self, runner, dataloader, **kwargs):
+        """Predict the results of a dataloader."""
+        raise NotImplementedError
 
     def _do_evaluate(self, runner):
         """perform evaluation and save ckpt."""
         if not self._should_evaluate(runner):
+            # always finish with a full evaluation in fast mode
+            if self.fast_eval is None or not self._is_last(runner):
+                return
+
+        if self.async_eval is not None:
+            if runner.rank == 0:
+                submit_async_eval(self, runner)
             return
 
+        results, fast_results = None, None
+        if self.fast_eval is not None:
+            # select the subset on all ranks before only rank 0 evaluates
+            get_fast_eval_indices(self, runner)
+        full = run_full_eval(self, runner)
+        if self.fast_eval is not None:
+            # also on full evaluations, so that fast.mIoU is comparable
+            dataloader = get_fast_eval_dataloader(self, runner,
+                                                  self.distributed)
+            with override_test_cfg(runner.model,
+                                   self.fast_eval.get('test_cfg', {})):
+                fast_results = self._test(runner, dataloader)
+        if full:
+            dataloader = self.dataloader
+            results = self._test(
+                runner,
+                dataloader,
+                efficient_test=self.efficient_test,
+                evaluator=self._get_evaluator())
+        if runner.rank == 0:
+            if self.distributed:
+                print('\n')
+            runner.log_buffer.output['eval_iter_num'] = len(dataloader)
+            if not self.streaming or self.fast_eval is not None:
+                prepare_gt_cache(self, runner)
+            key_score = evaluate_and_log(self, runner, results, fast_results)
+
+            if self.save_best and key_score is not None:
+                self._save_ckpt(runner, key_score)
+
+
+class EvalHook(EvalHookMixin, _EvalHook):
+    """Single GPU EvalHook, with efficient test support.
+
+    See :class:`EvalHookMixin` for the arguments.
+    """
+
+    def _test(self, runner, dataloader, **kwargs):
         from mmseg.apis import single_gpu_test
-        results = single_gpu_test(
-            runner.model,
-            self.dataloader,
-            show=False,
-            efficient_test=self.efficient_test)
-        runner.log_buffer.output['eval_iter_num'] = len(self.dataloader)
-        key_score = self.evaluate(runner, results)
-        if self.save_best:
-            self._save_ckpt(runner, key_score)
+        return single_gpu_test(runner.model, dataloader, **kwargs)
 
 
-class DistEvalHook(_DistEvalHook):
+class DistEvalHook(EvalHookMixin, _DistEvalHook):
     """Distributed EvalHook, with efficient test support.
 
-    Args:
-        by_epoch (bool): Determine perform evaluation by epoch or by iteration.
-            If set to True, it will perform by epoch. Otherwise, by iteration.
-            Default: False.
-        efficient_test (bool): Whether save the results as local numpy files to
-            save CPU memory during evaluation. Default: False.
-    Returns:
-        list: The prediction results.
+    See :class:`EvalHookMixin` for the arguments.
     """
 
-    greater_keys = ['mIoU', 'mAcc', 'aAcc']
+    distributed = True
 
-    def __init__(self, *args, by_epoch=False, efficient_test=False, **kwargs):
-        super().__init__(*args, by_epoch=by_epoch, **kwargs)
-        self.efficient_test = efficient_test
+    def _test(self, runner, dataloader, **kwargs):
+        from mmseg.apis import multi_gpu_test
+        tmpdir = self.tmpdir
+        if tmpdir is None:
+            tmpdir = osp.join(runner.work_dir, '.eval_hook')
+        return multi_gpu_test(
+            runner.model,
+            dataloader,
+            tmpdir=tmpdir,
+            gpu_collect=self.gpu_collect,
+            **kwargs)
 
     def _do_evaluate(self, runner):
         """perform evaluation and save ckpt."""
@@ -77,25 +392,4 @@ class DistEvalHook(_DistEvalHook):
                               _BatchNorm) and module.track_running_stats:
                     dist.broadcast(module.running_var, 0)
                     dist.broadcast(module.running_mean, 0)
-
-        if not self._should_evaluate(runner):
-            return
-
-        tmpdir = self.tmpdir
-        if tmpdir is None:
-            tmpdir = osp.join(runner.work_dir, '.eval_hook')
-
-        from mmseg.apis import multi_gpu_test
-        results = multi_gpu_test(
-            runner.model,
-            self.dataloader,
-            tmpdir=tmpdir,
-            gpu_collect=self.gpu_collect,
-            efficient_test=self.efficient_test)
-        if runner.rank == 0:
-            print('\n')
-            runner.log_buffer.output['eval_iter_num'] = len(self.dataloader)
-            key_score = self.evaluate(runner, results)
-
-            if self.save_best:
-                self._save_ckpt(runner, key_score)
+        super()._do_evaluate(runner)
@@ -0,0 +1,127 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import copy
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def select_stratified_subset(class_pixels,
+                             num_samples,
+                             min_samples_per_class=3,
+                             seed=0):
+    """Select a fixed subset of images that covers all classes.
+
+    The classes are visited from the rarest to the most frequent one, as for
+    rare class sampling, and images containing the class are added until it
+    appears in ``min_samples_per_class`` selected images. The remaining
+    budget is filled by stratified sampling, where each image belongs to the
+    stratum of its rarest class.
+
+    Args:
+        class_pixels (ndarray): Number of pixels of each class in each image
+            with shape (num_images, num_classes).
+        num_samples (int): Number of images to select. It is exceeded if the
+            class coverage requires more images.
+        min_samples_per_class (int): Minimum number of selected images that
+            contain each class. Default: 3.
+        seed (int): Random seed of the selection. Default: 0.
+
+    Returns:
+        list[int]: Sorted indices of the selected images.
+    """
+    rng = np.random.RandomState(seed)
+    num_images = class_pixels.shape[0]
+    present = class_pixels > 0
+    class_order = np.argsort(class_pixels.sum(0), kind='stable')
+    selected = np.zeros(num_images, dtype=bool)
+    for c in class_order:
+        missing = min_samples_per_class - int(present[selected, c].sum())
+        candidates = np.flatnonzero(present[:, c] & ~selected)
+        if missing > 0 and len(candidates) > 0:
+            picked = rng.choice(
+                candidates, min(missing, len(candidates)), replace=False)
+            selected[picked] = True
+
+    remaining = np.flatnonzero(~selected)
+    num_fill = min(num_samples - int(selected.sum()), len(remaining))
+    if num_fill > 0:
+        rank = np.empty_like(class_order)
+        rank[class_order] = np.arange(len(class_order))
+        # images without any valid pixels form their own stratum
+        rarest = np.where(present[remaining],
+                          rank[None, :], len(class_order)).min(1)
+        strata, sizes = np.unique(rarest, return_counts=True)
+        quota = sizes * num_fill / len(remaining)
+        counts = np.floor(quota).astype(np.int64)
+        # largest remainder apportionment of the rest
+        order = np.argsort(-(quota - counts), kind='stable')
+        counts[order[:num_fill - counts.sum()]] += 1
+        for stratum, count in zip(strata, counts):
+            if count > 0:
+                members = remaining[rarest == stratum]
+                selected[rng.choice(members, count, replace=False)] = True
+    return np.flatnonzero(selected).tolist()
+
+
+def bootstrap_miou(areas, num_bootstrap=1000, ci=0.95, seed=0):
+    """Estimate the mIoU and its confidence interval from per-image areas.
+
+    The images are resampled with replacement and the mIoU is recomputed
+    from the summed areas of each resample.
+
+    Args:
+        areas (ndarray): Intersection and union of each image with shape
+            (num_images, 2, num_classes).
+        num_bootstrap (int): Number of resamples. Default: 1000.
+        ci (float): Coverage of the confidence interval. Default: 0.95.
+        seed (int): Random seed of the resampling. Default: 0.
+
+    Returns:
+        tuple[float]: The mIoU and the lower and upper bound of its
+            confidence interval.
+    """
+
+    def _miou(total):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iou = total[..., 0, :] / total[..., 1, :]
+        return np.nanmean(iou, axis=-1)
+
+    num_images = len(areas)
+    miou = float(_miou(areas.sum(0)))
+    rng = np.random.RandomState(seed)
+    resamples = rng.randint(0, num_images, (num_bootstrap, num_images))
+    # multiplicity of each image in each resample
+    weights = np.zeros((num_bootstrap, num_images))
+    np.add.at(weights, (np.arange(num_bootstrap)[:, None], resamples), 1)
+    boot_totals = weights @ areas.reshape(num_images, -1)
+    boot_miou = _miou(boot_totals.reshape(num_bootstrap, *areas.shape[1:]))
+    alpha = (1 - ci) / 2
+    low, high = np.nanquantile(boot_miou, [alpha, 1 - alpha])
+    return miou, float(low), float(high)
+
+
+@contextmanager
+def override_test_cfg(model, test_cfg):
+    """Temporarily update the ``test_cfg`` of all modules of ``model``.
+
+    Args:
+        model (nn.Module): The (wrapped) segmentor.
+        test_cfg (dict): Keys to override, e.g. ``dict(input_scale=0.5)``.
+    """
+    saved = []
+    for module in model.modules():
+        cfg = getattr(module, 'test_cfg', None)
+        if isinstance(cfg, dict):
+            saved.append((module, cfg))
+            new_cfg = copy.deepcopy(cfg)
+            new_cfg.update(test_cfg)
+            module.test_cfg = new_cfg
+    try:
+        yield
+    finally:
+        for module, cfg in saved:
+            module.test_cfg = cfg
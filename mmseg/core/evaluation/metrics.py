@@ -1,6 +1,8 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import mmcv
 import numpy as np
@@ -24,6 +26,144 @@ def f_score(precision, recall, beta=1):
     return score
 
 
+@lru_cache(maxsize=32)
+def _label_lut(num_classes, ignore_index, label_map, reduce_zero_label,
+               min_label, max_label, is_uint8):
+    """Build the lookup table from raw label values in
+    ``[min_label, max_label]`` to row offsets of the confusion matrix.
+
+    Labels in ``[0, num_classes)`` after ``label_map`` and
+    ``reduce_zero_label`` are mapped to ``label * num_classes``, all other
+    labels to row ``num_classes`` and ``ignore_index`` to row
+    ``num_classes + 1``. For uint8 labels, mapped ids wrap around like an
+    in-place assignment to the label map would (e.g. -1 becomes 255).
+    """
+    lut = torch.arange(min_label, max_label + 1, dtype=torch.int64)
+    # apply the mapping in order, like the former masked assignments
+    for old_id, new_id in label_map:
+        lut[lut == old_id] = new_id % 256 if is_uint8 else new_id
+    if reduce_zero_label:
+        reduced = lut - 1
+        reduced[(lut == 0) | (lut == 255)] = 255
+        lut = reduced
+    rows = lut.clone()
+    rows[(lut < 0) | (lut >= num_classes)] = num_classes
+    rows[lut == ignore_index] = num_classes + 1
+    return rows * num_classes
+
+
+def _label_rows(label, num_classes, ignore_index, label_map,
+                reduce_zero_label):
+    """Map a ground truth label tensor to row offsets with
+    :func:`_label_lut`."""
+    is_uint8 = label.dtype == torch.uint8
+    if is_uint8:
+        min_label, max_label = 0, 255
+    else:
+        min_label = min(int(label.min()), 0)
+        max_label = max(int(label.max()), 255)
+    lut = _label_lut(num_classes, ignore_index,
+                     tuple((label_map or {}).items()), reduce_zero_label,
+                     min_label, max_label, is_uint8).to(label.device)
+    label = label.long()
+    if min_label != 0:
+        label = label - min_label
+    return lut[label]
+
+
+def confusion_matrix(pred_label,
+                     label,
+                     num_classes,
+                     ignore_index,
+                     label_map=dict(),
+                     reduce_zero_label=False):
+    """Calculate the confusion matrix of a prediction.
+
+    The label mapping is applied by a single lookup table gather and the
+    matrix is counted by a single ``bincount(gt * C + pred)``.
+
+    Args:
+        pred_label (ndarray | torch.Tensor): Prediction segmentation map
+            with values in ``[0, num_classes)``.
+        label (ndarray | torch.Tensor): Ground truth segmentation map.
+        num_classes (int): Number of categories.
+        ignore_index (int): Index that will be ignored in evaluation.
+        label_map (dict): Mapping old labels to new labels. Default: dict().
+        reduce_zero_label (bool): Wether ignore zero label. Default: False.
+
+    Returns:
+        torch.Tensor: The confusion matrix of shape
+            (num_classes + 1, num_classes), indexed by ground truth and
+            prediction. The last row counts the predictions of pixels whose
+            label is neither ignored nor in ``[0, num_classes)``.
+    """
+    if isinstance(pred_label, np.ndarray):
+        pred_label = torch.from_numpy(pred_label)
+    if isinstance(label, np.ndarray):
+        label = torch.from_numpy(label)
+    index = _label_rows(label, num_classes, ignore_index, label_map,
+                        reduce_zero_label)
+    index += pred_label.to(index.device)
+    conf_mat = torch.bincount(
+        index.view(-1), minlength=(num_classes + 2) * num_classes)
+    return conf_mat.view(num_classes + 2, num_classes)[:num_classes + 1]
+
+
+def calibration_histogram(pred_label,
+                          confidence,
+                          label,
+                          num_classes,
+                          ignore_index,
+                          num_bins,
+                          label_map=dict(),
+                          reduce_zero_label=False):
+    """Calculate per-class confidence histograms of a prediction.
+
+    Only pixels with a ground truth label in ``[0, num_classes)`` after the
+    label mapping are counted. The confidences are binned into ``num_bins``
+    equal-width bins in [0, 1].
+
+    Args:
+        pred_label (ndarray | torch.Tensor): Prediction segmentation map
+            with values in ``[0, num_classes)``.
+        confidence (ndarray | torch.Tensor): Confidence (maximum softmax
+            probability) of each pixel.
+        label (ndarray | torch.Tensor): Ground truth segmentation map.
+        num_classes (int): Number of categories.
+        ignore_index (int): Index that will be ignored in evaluation.
+        num_bins (int): Number of confidence bins.
+        label_map (dict): Mapping old labels to new labels. Default: dict().
+        reduce_zero_label (bool): Wether ignore zero label. Default: False.
+
+    Returns:
+        torch.Tensor: float64 tensor of shape (3, num_classes, num_bins)
+            with the number of pixels, the number of correct pixels and the
+            sum of the confidences in each bin, indexed by the predicted
+            class.
+    """
+    if isinstance(pred_label, np.ndarray):
+        pred_label = torch.from_numpy(pred_label)
+    if isinstance(confidence, np.ndarray):
+        confidence = torch.from_numpy(confidence)
+    if isinstance(label, np.ndarray):
+        label = torch.from_numpy(label)
+    rows = _label_rows(label, num_classes, ignore_index, label_map,
+                       reduce_zero_label).view(-1)
+    valid = rows < num_classes * num_classes
+    pred_label = pred_label.to(rows.device).long().view(-1)[valid]
+    confidence = confidence.to(rows.device).double().view(-1)[valid]
+    correct = (rows[valid] == pred_label * num_classes).double()
+    bins = (confidence * num_bins).long().clamp_(0, num_bins - 1)
+    index = pred_label * num_bins + bins
+    size = num_classes * num_bins
+    hist = torch.stack([
+        torch.bincount(index, minlength=size).double(),
+        torch.bincount(index, weights=correct, minlength=size),
+        torch.bincount(index, weights=confidence, minlength=size)
+    ])
+    return hist.view(3, num_classes, num_bins)
+
+
 def intersect_and_union(pred_label,
                         label,
                         num_classes,
@@ -54,35 +194,16 @@ def intersect_and_union(pred_label,
     """
 
     if isinstance(pred_label, str):
-        pred_label = torch.from_numpy(np.load(pred_label))
-    else:
-        pred_label = torch.from_numpy((pred_label))
+        pred_label = np.load(pred_label)
 
     if isinstance(label, str):
-        label = torch.from_numpy(
-            mmcv.imread(label, flag='unchanged', backend='pillow'))
-    else:
-        label = torch.from_numpy(label)
+        label = mmcv.imread(label, flag='unchanged', backend='pillow')
 
-    if label_map is not None:
-        for old_id, new_id in label_map.items():
-            label[label == old_id] = new_id
-    if reduce_zero_label:
-        label[label == 0] = 255
-        label = label - 1
-        label[label == 254] = 255
-
-    mask = (label != ignore_index)
-    pred_label = pred_label[mask]
-    label = label[mask]
-
-    intersect = pred_label[pred_label == label]
-    area_intersect = torch.histc(
-        intersect.float(), bins=(num_classes), min=0, max=num_classes - 1)
-    area_pred_label = torch.histc(
-        pred_label.float(), bins=(num_classes), min=0, max=num_classes - 1)
-    area_label = torch.histc(
-        label.float(), bins=(num_classes), min=0, max=num_classes - 1)
+    conf_mat = confusion_matrix(pred_label, label, num_classes, ignore_index,
+                                label_map, reduce_zero_label).float()
+    area_intersect = torch.diagonal(conf_mat[:num_classes])
+    area_pred_label = conf_mat.sum(0)
+    area_label = conf_mat[:num_classes].sum(1)
     area_union = area_pred_label + area_label - area_intersect
     return area_intersect, area_union, area_pred_label, area_label
 
@@ -92,18 +213,22 @@ def total_intersect_and_union(results,
                               num_classes,
                               ignore_index,
                               label_map=dict(),
-                              reduce_zero_label=False):
+                              reduce_zero_label=False,
+                              nproc=1):
     """Calculate Total Intersection and Union.
 
     Args:
         results (list[ndarray] | list[str]): List of prediction segmentation
             maps or list of prediction result filenames.
-        gt_seg_maps (list[ndarray] | list[str]): list of ground truth
-            segmentation maps or list of label filenames.
+        gt_seg_maps (Sequence[ndarray] | list[str]): list of ground truth
+            segmentation maps or list of label filenames. Lazy sequences are
+            indexed in the worker threads.
         num_classes (int): Number of categories.
         ignore_index (int): Index that will be ignored in evaluation.
         label_map (dict): Mapping old labels to new labels. Default: dict().
         reduce_zero_label (bool): Wether ignore zero label. Default: False.
+        nproc (int): Number of threads that load and evaluate the images.
+            Default: 1.
 
      Returns:
          ndarray: The intersection of prediction and ground truth histogram
@@ -119,15 +244,25 @@ def total_intersect_and_union(results,
     total_area_union = torch.zeros((num_classes, ), dtype=torch.float64)
     total_area_pred_label = torch.zeros((num_classes, ), dtype=torch.float64)
     total_area_label = torch.zeros((num_classes, ), dtype=torch.float64)
-    for i in range(num_imgs):
-        area_intersect, area_union, area_pred_label, area_label = \
-            intersect_and_union(
-                results[i], gt_seg_maps[i], num_classes, ignore_index,
-                label_map, reduce_zero_label)
+
+    def _intersect_and_union(i):
+        return intersect_and_union(results[i], gt_seg_maps[i], num_classes,
+                                   ignore_index, label_map, reduce_zero_label)
+
+    if nproc > 1:
+        # the tasks only hold indices, so at most nproc maps are loaded
+        executor = ThreadPoolExecutor(nproc)
+        areas = executor.map(_intersect_and_union, range(num_imgs))
+    else:
+        executor = None
+        areas = map(_intersect_and_union, range(num_imgs))
+    for area_intersect, area_union, area_pred_label, area_label in areas:
         total_area_intersect += area_intersect
         total_area_union += area_union
         total_area_pred_label += area_pred_label
         total_area_label += area_label
+    if executor is not None:
+        executor.shutdown()
     return total_area_intersect, total_area_union, total_area_pred_label, \
         total_area_label
 
@@ -264,7 +399,8 @@ def eval_metrics(results,
                  nan_to_num=None,
                  label_map=dict(),
                  reduce_zero_label=False,
-                 beta=1):
+                 beta=1,
+                 nproc=1):
     """Calculate evaluation metrics
     Args:
         results (list[ndarray] | list[str]): List of prediction segmentation
@@ -278,6 +414,8 @@ def eval_metrics(results,
             by the numbers defined by the user. Default: None.
         label_map (dict): Mapping old labels to new labels. Default: dict().
         reduce_zero_label (bool): Wether ignore zero label. Default: False.
+        nproc (int): Number of threads that load and evaluate the images.
+            Default: 1.
      Returns:
         float: Overall accuracy on all images.
         ndarray: Per category accuracy, shape (num_classes, ).
@@ -292,7 +430,46 @@ def eval_metrics(results,
     total_area_intersect, total_area_union, total_area_pred_label, \
         total_area_label = total_intersect_and_union(
             results, gt_seg_maps, num_classes, ignore_index, label_map,
-            reduce_zero_label)
+            reduce_zero_label, nproc)
+    return total_area_to_metrics(total_area_intersect, total_area_union,
+                                 total_area_pred_label, total_area_label,
+                                 metrics, nan_to_num, beta)
+
+
+def total_area_to_metrics(total_area_intersect,
+                          total_area_union,
+                          total_area_pred_label,
+                          total_area_label,
+                          metrics=['mIoU'],
+                          nan_to_num=None,
+                          beta=1):
+    """Calculate evaluation metrics from the total areas.
+
+    Args:
+        total_area_intersect (torch.Tensor): The intersection of prediction
+            and ground truth histogram on all classes.
+        total_area_union (torch.Tensor): The union of prediction and ground
+            truth histogram on all classes.
+        total_area_pred_label (torch.Tensor): The prediction histogram on all
+            classes.
+        total_area_label (torch.Tensor): The ground truth histogram on all
+            classes.
+        metrics (list[str] | str): Metrics to be evaluated, 'mIoU' and 'mDice'.
+        nan_to_num (int, optional): If specified, NaN values will be replaced
+            by the numbers defined by the user. Default: None.
+        beta (int): Determines the weight of recall in the combined score.
+            Default: 1.
+     Returns:
+        float: Overall accuracy on all images.
+        ndarray: Per category accuracy, shape (num_classes, ).
+        ndarray: Per category evaluation metrics, shape (num_classes, ).
+    """
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    allowed_metrics = ['mIoU', 'mDice', 'mFscore']
+    if not set(metrics).issubset(set(allowed_metrics)):
+        raise KeyError('metrics {} is not supported'.format(metrics))
+
     all_acc = total_area_intersect.sum() / total_area_label.sum()
     ret_metrics = OrderedDict({'aAcc': all_acc})
     for metric in metrics:
@@ -0,0 +1,116 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import os
+import os.path as osp
+import tempfile
+import threading
+import zlib
+from collections.abc import Sequence
+
+import mmcv
+import numpy as np
+
+
+class PredictionSpillWriter(object):
+    """Append predictions to a single compressed shard file.
+
+    Each prediction is stored as uint8 if possible (uint16 otherwise),
+    optionally compressed with zlib, and appended to the shard. Instead of
+    the array, :meth:`append` returns a small index entry, which can be
+    collected from other ranks and read back by :class:`SpilledResults`.
+
+    Args:
+        tmpdir (str): Directory of the shard, which must be shared between
+            the ranks for distributed testing.
+        compress (bool): Whether to compress the predictions with zlib.
+            Default: True.
+    """
+
+    def __init__(self, tmpdir, compress=True):
+        mmcv.mkdir_or_exist(tmpdir)
+        fd, self.filename = tempfile.mkstemp(suffix='.shard', dir=tmpdir)
+        self.file = os.fdopen(fd, 'wb')
+        self.compress = compress
+        self.offset = 0
+
+    def append(self, pred):
+        """Append a prediction.
+
+        Args:
+            pred (ndarray): Segmentation map with values in [0, 65535].
+
+        Returns:
+            tuple: The index entry (filename, offset, length, shape, dtype,
+                compressed) of the prediction.
+        """
+        dtype = np.uint8 if pred.max(initial=0) < 256 else np.uint16
+        data = np.ascontiguousarray(pred, dtype=dtype).tobytes()
+        if self.compress:
+            data = zlib.compress(data, 1)
+        self.file.write(data)
+        entry = (self.filename, self.offset, len(data), tuple(pred.shape),
+                 np.dtype(dtype).str, self.compress)
+        self.offset += len(data)
+        return entry
+
+    def close(self):
+        """Flush the shard so that other processes can read it."""
+        self.file.close()
+
+
+class SpilledResults(Sequence):
+    """Lazily decoded predictions of :class:`PredictionSpillWriter` shards.
+
+    Indexing reads and decodes only the requested prediction, so it can be
+    used in place of the list of results for evaluation.
+
+    Args:
+        entries (list[tuple]): Index entries in dataset order.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._fds = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get_fd(self, filename):
+        with self._lock:
+            if filename not in self._fds:
+                self._fds[filename] = os.open(filename, os.O_RDONLY)
+            return self._fds[filename]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return SpilledResults(self.entries[idx])
+        filename, offset, length, shape, dtype, compressed = \
+            self.entries[idx]
+        data = os.pread(self._get_fd(filename), length, offset)
+        if compressed:
+            data = zlib.decompress(data)
+        # a writable buffer, as the results are expected to be writable
+        return np.frombuffer(bytearray(data), dtype=dtype).reshape(shape)
+
+    def __getstate__(self):
+        return dict(entries=self.entries)
+
+    def __setstate__(self, state):
+        self.__init__(state['entries'])
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+    def cleanup(self):
+        """Close and remove the shard files."""
+        self.close()
+        for filename in set(entry[0] for entry in self.entries):
+            if osp.isfile(filename):
+                os.remove(filename)
@@ -0,0 +1,167 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import mmcv
+import torch
+import torch.distributed as dist
+
+from .metrics import (calibration_histogram, confusion_matrix,
+                      total_area_to_metrics)
+
+
+def _to_list(tensor):
+    """Convert a tensor to a JSON serializable list with None for NaN."""
+    return [None if x != x else x for x in tensor.tolist()]
+
+
+class StreamingEvaluator(object):
+    """Online evaluator that accumulates a confusion matrix.
+
+    Each prediction is folded into the confusion matrix by
+    :func:`confusion_matrix` and can be discarded afterwards, so the
+    memory is O(C^2) independent of the dataset size. The matrix has an
+    additional row for ground truth labels outside of ``[0, C)`` that are
+    not ``ignore_index`` (e.g. classes removed by ``label_map``), which only
+    count towards the prediction area as in :func:`intersect_and_union`.
+
+    Optionally, per-class confidence histograms with ``calibration_bins``
+    bins are accumulated as well (O(C * bins) memory), from which
+    :meth:`get_calibration` derives reliability diagrams, the expected
+    calibration error (ECE) and precision-vs-threshold curves.
+
+    Args:
+        num_classes (int): Number of categories.
+        ignore_index (int): Index that will be ignored in evaluation.
+            Default: 255.
+        label_map (dict | None): Mapping old labels to new labels.
+            Default: None.
+        reduce_zero_label (bool): Wether ignore zero label. Default: False.
+        calibration_bins (int): Number of confidence bins of the calibration
+            statistics. 0 disables them. Default: 0.
+    """
+
+    def __init__(self,
+                 num_classes,
+                 ignore_index=255,
+                 label_map=None,
+                 reduce_zero_label=False,
+                 calibration_bins=0):
+        self.num_classes = num_classes
+        self.ignore_index = ignore_index
+        self.label_map = label_map
+        self.reduce_zero_label = reduce_zero_label
+        self.conf_mat = torch.zeros((num_classes + 1, num_classes),
+                                    dtype=torch.int64)
+        self.calibration_bins = calibration_bins
+        self.calibration_hist = None
+        if calibration_bins:
+            self.calibration_hist = torch.zeros(
+                (3, num_classes, calibration_bins), dtype=torch.float64)
+
+    def update(self, pred_label, label, confidence=None):
+        """Add a prediction and its ground truth to the confusion matrix.
+
+        Args:
+            pred_label (ndarray | torch.Tensor): Prediction segmentation map.
+            label (ndarray | torch.Tensor): Ground truth segmentation map.
+            confidence (ndarray | torch.Tensor, optional): Confidence of the
+                prediction, which is added to the calibration statistics if
+                they are enabled. Default: None.
+        """
+        self.conf_mat += confusion_matrix(pred_label, label,
+                                          self.num_classes,
+                                          self.ignore_index, self.label_map,
+                                          self.reduce_zero_label).cpu()
+        if self.calibration_hist is not None and confidence is not None:
+            self.calibration_hist += calibration_histogram(
+                pred_label, confidence, label, self.num_classes,
+                self.ignore_index, self.calibration_bins, self.label_map,
+                self.reduce_zero_label).cpu()
+
+    def all_reduce(self):
+        """Sum the confusion matrices of all ranks."""
+        if dist.is_available() and dist.is_initialized():
+            conf_mat = self.conf_mat.clone()
+            if dist.get_backend() == 'nccl':
+                conf_mat = conf_mat.cuda()
+            dist.all_reduce(conf_mat)
+            self.conf_mat = conf_mat.cpu()
+            if self.calibration_hist is not None:
+                hist = self.calibration_hist.to(conf_mat.device)
+                dist.all_reduce(hist)
+                self.calibration_hist = hist.cpu()
+
+    def get_total_areas(self):
+        """Get the total areas as returned by
+        :func:`total_intersect_and_union`."""
+        conf_mat = self.conf_mat.double()
+        total_area_intersect = torch.diagonal(conf_mat[:self.num_classes])
+        total_area_pred_label = conf_mat.sum(0)
+        total_area_label = conf_mat[:self.num_classes].sum(1)
+        total_area_union = total_area_pred_label + total_area_label - \
+            total_area_intersect
+        return total_area_intersect, total_area_union, \
+            total_area_pred_label, total_area_label
+
+    def evaluate(self, metrics=['mIoU'], nan_to_num=None, beta=1):
+        """Calculate the evaluation metrics like :func:`eval_metrics`."""
+        return total_area_to_metrics(*self.get_total_areas(), metrics,
+                                     nan_to_num, beta)
+
+    def get_calibration(self, class_names=None):
+        """Derive the calibration statistics from the histograms.
+
+        For each predicted class and for all pixels together, this reports
+        per bin the number of pixels, their accuracy and mean confidence,
+        the ECE and, for thresholds at the lower bin edges, the precision,
+        the coverage (fraction of the predicted pixels that are kept) and
+        the recall of the pixels with a confidence above the threshold.
+
+        Args:
+            class_names (list[str], optional): Names of the classes.
+                Default: None.
+
+        Returns:
+            dict: The statistics, with None for undefined values.
+        """
+        assert self.calibration_hist is not None, \
+            'the calibration statistics are not enabled'
+        if class_names is None:
+            class_names = [str(i) for i in range(self.num_classes)]
+        num_bins = self.calibration_bins
+        gt_pixels = self.conf_mat[:self.num_classes].sum(1).double()
+
+        def _stats(count, correct, conf_sum, num_gt):
+            # cumulative sums from the highest bin down
+            count_above = count.flip(0).cumsum(0).flip(0)
+            correct_above = correct.flip(0).cumsum(0).flip(0)
+            total = count.sum()
+            return dict(
+                count=count.long().tolist(),
+                accuracy=_to_list(correct / count),
+                confidence=_to_list(conf_sum / count),
+                ece=float((correct - conf_sum).abs().sum() / total)
+                if total > 0 else None,
+                precision=_to_list(correct_above / count_above),
+                coverage=_to_list(count_above / total),
+                recall=_to_list(correct_above / num_gt))
+
+        count, correct, conf_sum = self.calibration_hist
+        calibration = dict(
+            num_bins=num_bins,
+            thresholds=[i / num_bins for i in range(num_bins)],
+            overall=_stats(
+                count.sum(0), correct.sum(0), conf_sum.sum(0),
+                gt_pixels.sum()),
+            classes=dict())
+        for i, name in enumerate(class_names):
+            calibration['classes'][name] = _stats(count[i], correct[i],
+                                                  conf_sum[i], gt_pixels[i])
+        return calibration
+
+    def dump_calibration(self, filename, class_names=None):
+        """Write :meth:`get_calibration` to a JSON file."""
+        mmcv.dump(
+            self.get_calibration(class_names), filename, file_format='json')
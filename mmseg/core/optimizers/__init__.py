@@ -0,0 +1,3 @@
+from .flat_adamw import FlatAdamW
+
+__all__ = ['FlatAdamW']
@@ -0,0 +1,203 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import math
+
+import torch
+from mmcv.runner import OPTIMIZERS
+from torch.optim import Optimizer
+
+
+def _foreach_mul_(tensors, scalar):
+    if hasattr(torch, '_foreach_mul_'):
+        torch._foreach_mul_(tensors, scalar)
+    else:
+        for tensor in tensors:
+            tensor.mul_(scalar)
+
+
+def _foreach_add_(tensors, others, alpha):
+    if hasattr(torch, '_foreach_add_'):
+        torch._foreach_add_(tensors, others, alpha=alpha)
+    else:
+        for tensor, other in zip(tensors, others):
+            tensor.add_(other, alpha=alpha)
+
+
+@OPTIMIZERS.register_module()
+class FlatAdamW(Optimizer):
+    """AdamW with the moments of parameters with equal hyperparameters in
+    flat buffers.
+
+    ``paramwise_cfg`` results in one param group per parameter. Before each
+    step, the parameters with gradients are bucketed by their
+    hyperparameters, step count, dtype and device. The moments of a bucket
+    are views into one contiguous buffer, so that the moment and update
+    computation of a bucket are a few kernels on the flat buffers. The
+    weight decay and the update of the parameters are a single
+    ``torch._foreach_*`` call per bucket. The parameters themselves stay in
+    place, as they are referenced by DDP and the EMA teacher.
+
+    The param groups and the state are the ones of ``torch.optim.AdamW``, so
+    that checkpoints can be exchanged between both optimizers. The flat
+    buffers are rebuilt after ``load_state_dict`` and whenever the
+    parameters of a bucket change.
+
+    Args:
+        params (iterable): Parameters or dicts defining param groups.
+        lr (float): Learning rate. Default: 1e-3.
+        betas (tuple[float]): Coefficients of the running averages of the
+            gradient and its square. Default: (0.9, 0.999).
+        eps (float): Term added to the denominator. Default: 1e-8.
+        weight_decay (float): Decoupled weight decay. Default: 1e-2.
+        amsgrad (bool): Whether to use the AMSGrad variant.
+            Default: False.
+    """
+
+    def __init__(self,
+                 params,
+                 lr=1e-3,
+                 betas=(0.9, 0.999),
+                 eps=1e-8,
+                 weight_decay=1e-2,
+                 amsgrad=False):
+        if not 0.0 <= lr:
+            raise ValueError(f'Invalid learning rate: {lr}')
+        if not 0.0 <= eps:
+            raise ValueError(f'Invalid epsilon value: {eps}')
+        if not 0.0 <= betas[0] < 1.0:
+            raise ValueError(f'Invalid beta parameter at index 0: {betas[0]}')
+        if not 0.0 <= betas[1] < 1.0:
+            raise ValueError(f'Invalid beta parameter at index 1: {betas[1]}')
+        if not 0.0 <= weight_decay:
+            raise ValueError(f'Invalid weight_decay value: {weight_decay}')
+        defaults = dict(
+            lr=lr,
+            betas=betas,
+            eps=eps,
+            weight_decay=weight_decay,
+            amsgrad=amsgrad)
+        super(FlatAdamW, self).__init__(params, defaults)
+        self._buckets = {}
+        self._param_buckets = {}
+
+    def __setstate__(self, state):
+        super(FlatAdamW, self).__setstate__(state)
+        for group in self.param_groups:
+            group.setdefault('amsgrad', False)
+        self._buckets = {}
+        self._param_buckets = {}
+
+    def load_state_dict(self, state_dict):
+        super(FlatAdamW, self).load_state_dict(state_dict)
+        # torch.optim.AdamW >= 1.12 stores the step as a tensor
+        for state in self.state.values():
+            if torch.is_tensor(state.get('step')):
+                state['step'] = int(state['step'].item())
+
+    def _moment_names(self, amsgrad):
+        names = ['exp_avg', 'exp_avg_sq']
+        if amsgrad:
+            names.append('max_exp_avg_sq')
+        return names
+
+    def _get_bucket(self, params, amsgrad):
+        """Flat moment buffers of ``params``.
+
+        Returns:
+            list[Tensor]: The flat buffers in the order of ``_moment_names``.
+        """
+        key = tuple(id(p) for p in params)
+        bucket = self._buckets.get(key)
+        if bucket is not None and len(bucket) == len(
+                self._moment_names(amsgrad)):
+            return bucket
+        # The moments of a parameter are in at most one bucket. Otherwise,
+        # the buffers of an older bucket would miss later updates.
+        for p in params:
+            old_key = self._param_buckets.get(id(p))
+            if old_key is not None:
+                self._buckets.pop(old_key, None)
+        bucket = []
+        for name in self._moment_names(amsgrad):
+            flat = torch.cat([
+                self.state[p].get(name, torch.zeros_like(p)).reshape(-1)
+                for p in params
+            ])
+            offset = 0
+            for p in params:
+                numel = p.numel()
+                self.state[p][name] = flat[offset:offset + numel].view_as(p)
+                offset += numel
+            bucket.append(flat)
+        for p in params:
+            self.state[p].setdefault('step', 0)
+            self._param_buckets[id(p)] = key
+        self._buckets[key] = bucket
+        return bucket
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step.
+
+        Args:
+            closure (callable, optional): A closure that reevaluates the
+                model and returns the loss.
+        """
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        buckets = {}
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if p.grad.is_sparse:
+                    raise RuntimeError(
+                        'FlatAdamW does not support sparse gradients')
+                hyper_params = (group['lr'], tuple(group['betas']),
+                                group['eps'], group['weight_decay'],
+                                group['amsgrad'])
+                key = (hyper_params, self.state[p].get('step', 0), p.dtype,
+                       p.device)
+                buckets.setdefault(key, []).append(p)
+
+        for (hyper_params, step, _, _), params in buckets.items():
+            self._bucket_step(params, step + 1, *hyper_params)
+        return loss
+
+    def _bucket_step(self, params, step, lr, betas, eps, weight_decay,
+                     amsgrad):
+        beta1, beta2 = betas
+        flats = self._get_bucket(params, amsgrad)
+        exp_avg, exp_avg_sq = flats[:2]
+        grad = torch.cat([p.grad.reshape(-1) for p in params])
+
+        if weight_decay != 0:
+            _foreach_mul_(params, 1 - lr * weight_decay)
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        if amsgrad:
+            max_exp_avg_sq = flats[2]
+            torch.max(max_exp_avg_sq, exp_avg_sq, out=max_exp_avg_sq)
+            exp_avg_sq = max_exp_avg_sq
+        bias_correction1 = 1 - beta1**step
+        bias_correction2 = 1 - beta2**step
+        # the gradient buffer is reused for the denominator and the update
+        torch.sqrt(exp_avg_sq, out=grad)
+        grad.div_(math.sqrt(bias_correction2)).add_(eps)
+        torch.div(exp_avg, grad, out=grad)
+
+        updates = []
+        offset = 0
+        for p in params:
+            numel = p.numel()
+            updates.append(grad[offset:offset + numel].view_as(p))
+            offset += numel
+        _foreach_add_(params, updates, alpha=-lr / bias_correction1)
+        for p in params:
+            self.state[p]['step'] = step
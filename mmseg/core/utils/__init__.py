@@ -1,5 +1,13 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
+from .checkpoint import (UDACheckpointHook, get_rng_state,
+                         load_uda_checkpoint, resume_uda_checkpoint,
+                         set_rng_state)
+from .log_vars import LogVarsReduceHook, reduce_log_vars, reduce_tensors
 from .misc import add_prefix
 
-__all__ = ['add_prefix']
+__all__ = [
+    'add_prefix', 'LogVarsReduceHook', 'reduce_log_vars', 'reduce_tensors',
+    'UDACheckpointHook', 'get_rng_state', 'set_rng_state',
+    'load_uda_checkpoint', 'resume_uda_checkpoint'
+]
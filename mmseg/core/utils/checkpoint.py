@@ -0,0 +1,369 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import copy
+import glob
+import os
+import os.path as osp
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mmcv
+import numpy as np
+import torch
+import torch.distributed as dist
+from mmcv.runner import HOOKS, CheckpointHook, get_dist_info
+from mmcv.runner.checkpoint import get_state_dict, load_state_dict
+
+
+def get_rng_state():
+    """Get the states of the python, numpy and torch random generators."""
+    state = dict(
+        python=random.getstate(),
+        numpy=np.random.get_state(),
+        torch=torch.get_rng_state())
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state()
+    return state
+
+
+def set_rng_state(state):
+    """Restore the random generator states of :func:`get_rng_state`."""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state['cuda'])
+
+
+def _gather_objects(obj):
+    _, world_size = get_dist_info()
+    if world_size == 1:
+        return [obj]
+    objects = [None] * world_size
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def snapshot_to_host(obj, buffers=None, prefix=''):
+    """Copy the tensors of a nested state to host memory.
+
+    Device tensors are copied asynchronously into pinned buffers, which are
+    reused for the same ``prefix`` and shape in later snapshots, so the copy
+    only stalls for the device to host transfer. Host tensors are cloned and
+    other objects deep copied, so that training can modify the original
+    state while the snapshot is written.
+
+    Args:
+        obj: Nested dicts, lists and tuples of tensors and other objects.
+        buffers (dict, optional): Pinned buffers of previous snapshots.
+            Default: None.
+        prefix (str): Key of ``obj`` in ``buffers``. Default: ''.
+
+    Returns:
+        The snapshot, which is only complete after the current CUDA stream
+        is synchronized.
+    """
+    if isinstance(obj, torch.Tensor):
+        obj = obj.detach()
+        if not obj.is_cuda:
+            return obj.clone()
+        buffer = None if buffers is None else buffers.get(prefix)
+        if buffer is None or buffer.shape != obj.shape or \
+                buffer.dtype != obj.dtype:
+            buffer = torch.empty(
+                obj.shape, dtype=obj.dtype, device='cpu', pin_memory=True)
+            if buffers is not None:
+                buffers[prefix] = buffer
+        return buffer.copy_(obj, non_blocking=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot_to_host(v, buffers, f'{prefix}.{k}'))
+                         for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(
+            snapshot_to_host(v, buffers, f'{prefix}.{i}')
+            for i, v in enumerate(obj))
+    return copy.deepcopy(obj)
+
+
+def _optimizer_states(optimizer_state):
+    """Map the names of the optimizers to their state dicts."""
+    if 'state' in optimizer_state and 'param_groups' in optimizer_state:
+        return {None: optimizer_state}
+    return optimizer_state
+
+
+def shard_checkpoint(checkpoint, num_shards):
+    """Split the weights and optimizer states of a checkpoint into shards.
+
+    The model weights and the per-parameter optimizer states are assigned
+    to the shards balanced by their size. The first shard keeps all other
+    entries, e.g. the meta data and the parameter groups.
+
+    Args:
+        checkpoint (dict): Checkpoint with ``state_dict`` and optionally
+            ``optimizer``.
+        num_shards (int): Number of shards.
+
+    Returns:
+        list[dict]: The shards, which :func:`merge_checkpoint_shards`
+            combines into the checkpoint.
+    """
+
+    def _size(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, dict):
+            return sum(_size(v) for v in value.values())
+        return 0
+
+    entries = [('state_dict', None, k, v)
+               for k, v in checkpoint['state_dict'].items()]
+    optimizers = _optimizer_states(checkpoint.get('optimizer', {}))
+    for name, optimizer_state in optimizers.items():
+        entries.extend(('optimizer', name, k, v)
+                       for k, v in optimizer_state['state'].items())
+    shards = [dict(state_dict=type(checkpoint['state_dict'])())]
+    shards += [dict(state_dict=dict()) for _ in range(num_shards - 1)]
+    for key, value in checkpoint.items():
+        if key not in ('state_dict', 'optimizer'):
+            shards[0][key] = value
+    if optimizers:
+        for shard_id, shard in enumerate(shards):
+            shard['optimizer'] = {
+                name: dict(
+                    state=dict(),
+                    param_groups=state['param_groups']
+                    if shard_id == 0 else [])
+                for name, state in optimizers.items()
+            }
+    # the assignment only depends on the keys and sizes, so that it is the
+    # same on all ranks
+    loads = [0] * num_shards
+    for entry in sorted(
+            entries, key=lambda e: (-_size(e[3]), e[0], str(e[1]), str(
+                e[2]))):
+        shard_id = loads.index(min(loads))
+        loads[shard_id] += _size(entry[3])
+        group, name, key, value = entry
+        if group == 'state_dict':
+            shards[shard_id]['state_dict'][key] = value
+        else:
+            shards[shard_id]['optimizer'][name]['state'][key] = value
+    if None in optimizers:
+        for shard in shards:
+            shard['optimizer'] = shard['optimizer'][None]
+    return shards
+
+
+def merge_checkpoint_shards(shards):
+    """Combine the shards of :func:`shard_checkpoint`."""
+    checkpoint = shards[0]
+    for shard in shards[1:]:
+        checkpoint['state_dict'].update(shard['state_dict'])
+        if 'optimizer' in checkpoint:
+            optimizers = _optimizer_states(checkpoint['optimizer'])
+            shard_optimizers = _optimizer_states(shard['optimizer'])
+            for name, optimizer_state in optimizers.items():
+                optimizer_state['state'].update(
+                    shard_optimizers[name]['state'])
+    return checkpoint
+
+
+def shard_filename(filename, shard_id):
+    return f'{filename}.shard{shard_id}'
+
+
+def load_uda_checkpoint(filename, map_location='cpu'):
+    """Load a checkpoint of :class:`UDACheckpointHook`.
+
+    The shards of a sharded checkpoint are merged, so that the result can be
+    used like a regular checkpoint.
+    """
+    checkpoint = torch.load(filename, map_location=map_location)
+    num_shards = checkpoint.get('meta', {}).get('num_shards', 1)
+    if num_shards > 1:
+        shards = [checkpoint] + [
+            torch.load(shard_filename(filename, i), map_location=map_location)
+            for i in range(1, num_shards)
+        ]
+        checkpoint = merge_checkpoint_shards(shards)
+    return checkpoint
+
+
+def resume_uda_checkpoint(runner, filename, data_loaders=None):
+    """Resume the training state of :class:`UDACheckpointHook`.
+
+    In addition to ``runner.resume``, this restores the UDA state of the
+    model, the random generator states of this rank and the position of the
+    :obj:`RareClassSampler` of the training data loaders.
+
+    Args:
+        runner (:obj:`IterBasedRunner`): The runner.
+        filename (str): The checkpoint.
+        data_loaders (list[DataLoader], optional): The training data
+            loaders. Default: None.
+    """
+    checkpoint = load_uda_checkpoint(filename)
+    load_state_dict(
+        runner.model, checkpoint['state_dict'], logger=runner.logger)
+    meta = checkpoint['meta']
+    runner._epoch = meta['epoch']
+    runner._iter = meta['iter']
+    runner._inner_iter = meta['iter']
+    if 'optimizer' in checkpoint:
+        if isinstance(runner.optimizer, dict):
+            for name, optimizer in runner.optimizer.items():
+                optimizer.load_state_dict(checkpoint['optimizer'][name])
+        else:
+            runner.optimizer.load_state_dict(checkpoint['optimizer'])
+
+    model = runner.model
+    if hasattr(model, 'module'):
+        model = model.module
+    if 'uda_state' in checkpoint and hasattr(model, 'load_uda_state_dict'):
+        model.load_uda_state_dict(checkpoint['uda_state'])
+    rank, world_size = get_dist_info()
+    rng_states = checkpoint.get('rng_states', [])
+    if len(rng_states) == world_size:
+        set_rng_state(rng_states[rank])
+    else:
+        runner.logger.warning(
+            f'The checkpoint has the random states of {len(rng_states)} '
+            f'ranks, but {world_size} are used. They are not restored.')
+    for data_loader in data_loaders or []:
+        sampler = getattr(data_loader, 'sampler', None)
+        if hasattr(sampler, 'start'):
+            sampler.start = meta['iter'] * data_loader.batch_size
+        elif getattr(data_loader.dataset, 'rcs_enabled', False):
+            runner.logger.warning(
+                'The rare class sampling is not resumed, which requires '
+                'data.train.resumable_sampling=True.')
+    runner.logger.info(f'resumed from epoch: {runner.epoch}, '
+                       f'iter {runner.iter}')
+
+
+@HOOKS.register_module()
+class UDACheckpointHook(CheckpointHook):
+    """Save resumable checkpoints in a background thread.
+
+    The checkpoints additionally contain the UDA state of the model (see
+    ``UDADecorator.uda_state_dict``) and the random generator states of all
+    ranks, which :func:`resume_uda_checkpoint` restores. The state is copied
+    into pinned host memory and written by a background thread, so that
+    training only stalls for the device to host copy. A new checkpoint
+    waits for the previous write, as the pinned buffers are reused.
+
+    With ``shard=True``, each rank copies and writes a part of the weights
+    and optimizer states, which is balanced by size, to
+    ``<checkpoint>.shard<rank>``. The file of rank 0 has the meta data and is
+    loaded with :func:`load_uda_checkpoint`.
+
+    Args:
+        shard (bool): Whether to shard the checkpoint over the ranks.
+            Default: False.
+        kwargs: Arguments of :obj:`CheckpointHook`.
+    """
+
+    def __init__(self, shard=False, **kwargs):
+        super(UDACheckpointHook, self).__init__(**kwargs)
+        self.shard = shard
+        self._buffers = dict()
+        self._executor = ThreadPoolExecutor(1)
+        self._pending = None
+
+    def _wait(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def after_run(self, runner):
+        self._wait()
+        self._executor.shutdown()
+
+    def _write(self, checkpoint, filepath, progress=None):
+        tmp_path = f'{filepath}.{os.getpid()}.tmp'
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, filepath)
+        if progress is None:
+            return
+        if self.args.get('create_symlink', True):
+            latest = osp.join(self.out_dir, 'latest.pth')
+            mmcv.symlink(osp.basename(filepath), latest + '.tmp')
+            os.replace(latest + '.tmp', latest)
+        self._remove_old_checkpoints(progress)
+
+    def _remove_old_checkpoints(self, progress):
+        if self.max_keep_ckpts <= 0:
+            return
+        for step in range(progress - self.max_keep_ckpts * self.interval, 0,
+                          -self.interval):
+            ckpt_path = osp.join(self.out_dir,
+                                 self._filename_tmpl().format(step))
+            if not osp.exists(ckpt_path):
+                break
+            os.remove(ckpt_path)
+            for shard_path in glob.glob(shard_filename(ckpt_path, '*')):
+                os.remove(shard_path)
+
+    def _filename_tmpl(self):
+        default = 'epoch_{}.pth' if self.by_epoch else 'iter_{}.pth'
+        return self.args.get('filename_tmpl', default)
+
+    def _save_checkpoint(self, runner):
+        rank, world_size = get_dist_info()
+        rng_states = _gather_objects(get_rng_state())
+        num_shards = world_size if self.shard else 1
+        if rank >= num_shards:
+            return
+        self._wait()
+
+        progress = runner.epoch + 1 if self.by_epoch else runner.iter + 1
+        filepath = osp.join(self.out_dir,
+                            self._filename_tmpl().format(progress))
+        model = runner.model
+        if hasattr(model, 'module'):
+            model = model.module
+        # the same meta data as runner.save_checkpoint
+        meta = copy.deepcopy(self.args.get('meta', dict()))
+        meta.update(
+            mmcv_version=mmcv.__version__,
+            time=time.asctime(),
+            epoch=runner.epoch + 1,
+            iter=runner.iter + 1,
+            num_shards=num_shards)
+        if runner.meta is not None:
+            meta.update(copy.deepcopy(runner.meta))
+            meta['hook_msgs'] = dict(
+                meta.get('hook_msgs', {}), last_ckpt=filepath)
+            runner.meta.setdefault('hook_msgs', dict())
+            runner.meta['hook_msgs']['last_ckpt'] = filepath
+        if hasattr(model, 'CLASSES') and model.CLASSES is not None:
+            meta['CLASSES'] = model.CLASSES
+        checkpoint = dict(meta=meta, state_dict=get_state_dict(model))
+        if self.save_optimizer and runner.optimizer is not None:
+            if isinstance(runner.optimizer, dict):
+                checkpoint['optimizer'] = {
+                    name: optimizer.state_dict()
+                    for name, optimizer in runner.optimizer.items()
+                }
+            else:
+                checkpoint['optimizer'] = runner.optimizer.state_dict()
+        if hasattr(model, 'uda_state_dict'):
+            checkpoint['uda_state'] = model.uda_state_dict()
+        checkpoint['rng_states'] = rng_states
+        if num_shards > 1:
+            checkpoint = shard_checkpoint(checkpoint, num_shards)[rank]
+
+        checkpoint = snapshot_to_host(checkpoint, self._buffers)
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()
+        if rank == 0:
+            self._pending = self._executor.submit(self._write, checkpoint,
+                                                  filepath, progress)
+        else:
+            self._pending = self._executor.submit(
+                self._write, checkpoint, shard_filename(filepath, rank))
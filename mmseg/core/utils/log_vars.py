@@ -0,0 +1,111 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import torch
+import torch.distributed as dist
+from mmcv.runner import HOOKS, Hook, LoggerHook
+
+
+def reduce_tensors(values):
+    """Average scalar tensors over all ranks and copy them to the host.
+
+    The values are stacked into one tensor, so that a single all-reduce and a
+    single device to host copy are needed regardless of their number.
+
+    Args:
+        values (list[Tensor]): Scalar tensors.
+
+    Returns:
+        list[float]: The averaged values.
+    """
+    if len(values) == 0:
+        return []
+    device = values[0].device
+    stacked = torch.stack(
+        [v.detach().float().reshape(()).to(device) for v in values])
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(stacked.div_(dist.get_world_size()))
+    return stacked.tolist()
+
+
+def reduce_log_vars(log_vars):
+    """Replace the tensors in ``log_vars`` by their average over all ranks.
+
+    Args:
+        log_vars (dict): Log variables, where the tensor values are reduced
+            and the other values are kept.
+
+    Returns:
+        dict: ``log_vars``, which is updated in place.
+    """
+    keys = [k for k, v in log_vars.items() if isinstance(v, torch.Tensor)]
+    for key, value in zip(keys, reduce_tensors([log_vars[k] for k in keys])):
+        log_vars[key] = value
+    return log_vars
+
+
+@HOOKS.register_module()
+class LogVarsReduceHook(Hook):
+    """Reduce the log variables only on logging iterations.
+
+    Reducing the log variables in every ``train_step`` requires an
+    all-reduce and a host synchronization per step, although the logger only
+    reads them every ``interval`` iterations. This hook lets the model keep
+    the log variables as tensors on the device (``defer_log_vars``) and
+    reduces all pending values in the log buffer at once right before the
+    logger hook averages them.
+
+    Args:
+        interval (int, optional): Reduction interval. If not specified, the
+            smallest interval of the registered logger hooks is used.
+            Default: None.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+
+    @staticmethod
+    def _get_model(runner):
+        model = runner.model
+        if hasattr(model, 'module'):
+            model = model.module
+        return model
+
+    def before_run(self, runner):
+        if self.interval is None:
+            intervals = [
+                hook.interval for hook in runner.hooks
+                if isinstance(hook, LoggerHook)
+            ]
+            self.interval = min(intervals, default=1)
+        self._get_model(runner).defer_log_vars = True
+
+    def after_run(self, runner):
+        self.reduce(runner)
+        self._get_model(runner).defer_log_vars = False
+
+    def after_train_iter(self, runner):
+        # reduce whenever a logger hook may average the history
+        if self.every_n_iters(runner, self.interval) or \
+                self.every_n_inner_iters(runner, self.interval) or \
+                self.end_of_epoch(runner):
+            self.reduce(runner)
+
+    def after_train_epoch(self, runner):
+        self.reduce(runner)
+
+    def reduce(self, runner):
+        """Reduce the pending tensors in the history of the log buffer."""
+        pending = []
+        for key, history in runner.log_buffer.val_history.items():
+            # the reduced values precede the pending ones
+            i = len(history)
+            while i > 0 and isinstance(history[i - 1], torch.Tensor):
+                i -= 1
+            pending.extend((key, j) for j in range(i, len(history)))
+        values = reduce_tensors(
+            [runner.log_buffer.val_history[k][j] for k, j in pending])
+        for (key, j), value in zip(pending, values):
+            runner.log_buffer.val_history[key][j] = value
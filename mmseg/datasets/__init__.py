@@ -8,6 +8,8 @@ from .custom import CustomDataset
 from .dark_zurich import DarkZurichDataset
 from .dataset_wrappers import ConcatDataset, RepeatDataset
 from .gta import GTADataset
+from .samplers import GroupByShapeBatchSampler, RareClassSampler
+from .seg_map_store import SegMapStore
 from .synthia import SynthiaDataset
 from .uda_dataset import UDADataset
 
@@ -25,4 +27,7 @@ __all__ = [
     'UDADataset',
     'ACDCDataset',
     'DarkZurichDataset',
+    'GroupByShapeBatchSampler',
+    'RareClassSampler',
+    'SegMapStore',
 ]
@@ -14,6 +14,8 @@ from mmcv.runner import get_dist_info
 from mmcv.utils import Registry, build_from_cfg
 from torch.utils.data import DataLoader, DistributedSampler
 
+from .samplers import GroupByShapeBatchSampler, RareClassSampler
+
 if platform.system() != 'Windows':
     # https://github.com/pytorch/pytorch/issues/973
     import resource
@@ -96,6 +98,7 @@ def build_dataloader(dataset,
                      drop_last=False,
                      pin_memory=True,
                      persistent_workers=True,
+                     group_by_shape=False,
                      **kwargs):
     """Build PyTorch DataLoader.
 
@@ -122,12 +125,20 @@ def build_dataloader(dataset,
             This allows to maintain the workers Dataset instances alive.
             The argument also has effect in PyTorch>=1.7.0.
             Default: True
+        group_by_shape (bool): Whether to only batch images of the same
+            shape using :obj:`GroupByShapeBatchSampler`. The per-sample
+            results have to be reordered with its ``restore_order``. Only
+            supported without shuffling. Default: False
         kwargs: any keyword argument to be used to initialize DataLoader
 
     Returns:
         DataLoader: A PyTorch dataloader.
     """
     rank, world_size = get_dist_info()
+    # the rare class samples are drawn by the dataset, which can be made
+    # resumable by the sample numbers of the sampler
+    rare_class_sampling = shuffle and getattr(dataset, 'resumable_sampling',
+                                              False)
     if dist:
         sampler = DistributedSampler(
             dataset, world_size, rank, shuffle=shuffle)
@@ -138,6 +149,23 @@ def build_dataloader(dataset,
         sampler = None
         batch_size = num_gpus * samples_per_gpu
         num_workers = num_gpus * workers_per_gpu
+    if rare_class_sampling:
+        if dist:
+            sampler = RareClassSampler(dataset, world_size, rank, seed or 0)
+        else:
+            sampler = RareClassSampler(dataset, seed=seed or 0)
+        shuffle = False
+
+    batch_sampler = None
+    if group_by_shape:
+        assert not shuffle, 'group_by_shape does not support shuffling'
+        if dist:
+            batch_sampler = GroupByShapeBatchSampler(dataset, batch_size,
+                                                     world_size, rank)
+        else:
+            batch_sampler = GroupByShapeBatchSampler(dataset, batch_size)
+        # batch_sampler is mutually exclusive with these options
+        sampler, batch_size, shuffle, drop_last = None, 1, False, False
 
     init_fn = partial(
         worker_init_fn, num_workers=num_workers, rank=rank,
@@ -148,6 +176,7 @@ def build_dataloader(dataset,
             dataset,
             batch_size=batch_size,
             sampler=sampler,
+            batch_sampler=batch_sampler,
             num_workers=num_workers,
             collate_fn=partial(collate, samples_per_gpu=samples_per_gpu),
             pin_memory=pin_memory,
@@ -161,6 +190,7 @@ def build_dataloader(dataset,
             dataset,
             batch_size=batch_size,
             sampler=sampler,
+            batch_sampler=batch_sampler,
             num_workers=num_workers,
             collate_fn=partial(collate, samples_per_gpu=samples_per_gpu),
             pin_memory=pin_memory,
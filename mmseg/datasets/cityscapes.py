@@ -2,16 +2,30 @@
 
 import os.path as osp
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import mmcv
 import numpy as np
 from mmcv.utils import print_log
 from PIL import Image
 
+from mmseg.core import CityscapesEvaluator, SpilledResults, StreamingEvaluator
 from .builder import DATASETS
 from .custom import CustomDataset
 
 
+@lru_cache()
+def _train_id_to_label_id_lut():
+    """Lookup table that converts the trainIds [0, 255] to label ids."""
+    import cityscapesscripts.helpers.labels as CSLabels
+    lut = np.arange(256, dtype=np.int64)
+    for train_id, label in CSLabels.trainId2label.items():
+        if 0 <= train_id < 256:
+            lut[train_id] = label.id
+    return lut
+
+
 @DATASETS.register_module()
 class CityscapesDataset(CustomDataset):
     """Cityscapes dataset.
@@ -43,14 +57,9 @@ class CityscapesDataset(CustomDataset):
         """Convert trainId to id for cityscapes."""
         if isinstance(result, str):
             result = np.load(result)
-        import cityscapesscripts.helpers.labels as CSLabels
-        result_copy = result.copy()
-        for trainId, label in CSLabels.trainId2label.items():
-            result_copy[result == trainId] = label.id
+        return _train_id_to_label_id_lut()[result].astype(result.dtype)
 
-        return result_copy
-
-    def results2img(self, results, imgfile_prefix, to_label_id):
+    def results2img(self, results, imgfile_prefix, to_label_id, nproc=8):
         """Write the segmentation results to images.
 
         Args:
@@ -61,16 +70,26 @@ class CityscapesDataset(CustomDataset):
                 the png files will be named "somepath/xxx.png".
             to_label_id (bool): whether convert output to label_id for
                 submission
+            nproc (int): Number of threads that convert and encode the
+                results. Default: 8.
 
         Returns:
             list[str: str]: result txt files which contains corresponding
             semantic segmentation images.
         """
         mmcv.mkdir_or_exist(imgfile_prefix)
-        result_files = []
-        prog_bar = mmcv.ProgressBar(len(self))
-        for idx in range(len(self)):
+        if to_label_id:
+            import cityscapesscripts.helpers.labels as CSLabels
+            palette = np.zeros((len(CSLabels.id2label), 3), dtype=np.uint8)
+            for label_id, label in CSLabels.id2label.items():
+                palette[label_id] = label.color
+        else:
+            palette = np.array(self.PALETTE, dtype=np.uint8)
+
+        def _write(idx):
             result = results[idx]
+            if isinstance(result, str):
+                result = np.load(result)
             if to_label_id:
                 result = self._convert_to_label_id(result)
             filename = self.img_infos[idx]['filename']
@@ -79,22 +98,26 @@ class CityscapesDataset(CustomDataset):
             png_filename = osp.join(imgfile_prefix, f'{basename}.png')
 
             output = Image.fromarray(result.astype(np.uint8)).convert('P')
-            import cityscapesscripts.helpers.labels as CSLabels
-            palette = np.zeros((len(CSLabels.id2label), 3), dtype=np.uint8)
-            if to_label_id:
-                for label_id, label in CSLabels.id2label.items():
-                    palette[label_id] = label.color
-            else:
-                palette = np.array(self.PALETTE, dtype=np.uint8)
-
             output.putpalette(palette)
             output.save(png_filename)
-            result_files.append(png_filename)
-            prog_bar.update()
+            return png_filename
+
+        # PIL releases the GIL while encoding, so the threads write in
+        # parallel, and each task holds at most one result in memory
+        result_files = []
+        prog_bar = mmcv.ProgressBar(len(self))
+        with ThreadPoolExecutor(max(nproc, 1)) as executor:
+            for png_filename in executor.map(_write, range(len(self))):
+                result_files.append(png_filename)
+                prog_bar.update()
 
         return result_files
 
-    def format_results(self, results, imgfile_prefix=None, to_label_id=True):
+    def format_results(self,
+                       results,
+                       imgfile_prefix=None,
+                       to_label_id=True,
+                       nproc=8):
         """Format the results into dir (standard format for Cityscapes
         evaluation).
 
@@ -106,6 +129,8 @@ class CityscapesDataset(CustomDataset):
                 Default: None.
             to_label_id (bool): whether convert output to label_id for
                 submission. Default: False
+            nproc (int): Number of threads that write the images.
+                Default: 8.
 
         Returns:
             tuple: (result_files, tmp_dir), result_files is a list containing
@@ -113,7 +138,8 @@ class CityscapesDataset(CustomDataset):
                 for saving json/png files when img_prefix is not specified.
         """
 
-        assert isinstance(results, list), 'results must be a list'
+        assert isinstance(results, (list, SpilledResults)), \
+            'results must be a list'
         assert len(results) == len(self), (
             'The length of results is not equal to the dataset len: '
             f'{len(results)} != {len(self)}')
@@ -123,7 +149,8 @@ class CityscapesDataset(CustomDataset):
             imgfile_prefix = tmp_dir.name
         else:
             tmp_dir = None
-        result_files = self.results2img(results, imgfile_prefix, to_label_id)
+        result_files = self.results2img(results, imgfile_prefix, to_label_id,
+                                        nproc)
 
         return result_files, tmp_dir
 
@@ -132,7 +159,8 @@ class CityscapesDataset(CustomDataset):
                  metric='mIoU',
                  logger=None,
                  imgfile_prefix=None,
-                 efficient_test=False):
+                 efficient_test=False,
+                 **kwargs):
         """Evaluation in Cityscapes/default protocol.
 
         Args:
@@ -146,9 +174,10 @@ class CityscapesDataset(CustomDataset):
                 If results are evaluated with cityscapes protocol, it would be
                 the prefix of output png files. The output files would be
                 png images under folder "a/b/prefix/xxx.png", where "xxx" is
-                the image name of cityscapes. If not specified, a temp file
-                will be created for evaluation.
+                the image name of cityscapes. If not specified, the results
+                are evaluated in memory without writing png files.
                 Default: None.
+            kwargs: Further arguments of :meth:`CustomDataset.evaluate`.
 
         Returns:
             dict[str, float]: Cityscapes/default metrics.
@@ -157,24 +186,37 @@ class CityscapesDataset(CustomDataset):
         eval_results = dict()
         metrics = metric.copy() if isinstance(metric, list) else [metric]
         if 'cityscapes' in metrics:
+            if isinstance(results, StreamingEvaluator):
+                raise ValueError('The cityscapes metric requires the '
+                                 'predictions and does not support '
+                                 'streaming evaluation.')
             eval_results.update(
-                self._evaluate_cityscapes(results, logger, imgfile_prefix))
+                self._evaluate_cityscapes(results, logger, imgfile_prefix,
+                                          kwargs.get('nproc', 4)))
             metrics.remove('cityscapes')
         if len(metrics) > 0:
             eval_results.update(
                 super(CityscapesDataset,
-                      self).evaluate(results, metrics, logger, efficient_test))
+                      self).evaluate(results, metrics, logger, efficient_test,
+                                     **kwargs))
 
         return eval_results
 
-    def _evaluate_cityscapes(self, results, logger, imgfile_prefix):
+    def _evaluate_cityscapes(self,
+                             results,
+                             logger,
+                             imgfile_prefix,
+                             nproc=4):
         """Evaluation in Cityscapes protocol.
 
         Args:
             results (list): Testing results of the dataset.
             logger (logging.Logger | str | None): Logger used for printing
                 related information during evaluation. Default: None.
-            imgfile_prefix (str | None): The prefix of output image file
+            imgfile_prefix (str | None): The prefix of output image file. If
+                not specified, the results are evaluated in memory by
+                :class:`CityscapesEvaluator`.
+            nproc (int): Number of threads. Default: 4.
 
         Returns:
             dict[str: float]: Cityscapes evaluation results.
@@ -189,7 +231,11 @@ class CityscapesDataset(CustomDataset):
             msg = '\n' + msg
         print_log(msg, logger=logger)
 
-        result_files, tmp_dir = self.format_results(results, imgfile_prefix)
+        if imgfile_prefix is None:
+            return self._evaluate_cityscapes_in_memory(results, CSEval, nproc)
+
+        result_files, tmp_dir = self.format_results(
+            results, imgfile_prefix, nproc=nproc)
 
         if tmp_dir is None:
             result_dir = imgfile_prefix
@@ -221,3 +267,82 @@ class CityscapesDataset(CustomDataset):
             tmp_dir.cleanup()
 
         return eval_results
+
+    def _evaluate_cityscapes_in_memory(self, results, CSEval, nproc):
+        """Evaluate the results in Cityscapes protocol without png files.
+
+        The ground truth label ids and instance ids are read from the
+        ``*_gtFine_labelIds.png`` and ``*_gtFine_instanceIds.png`` files next
+        to the label maps of the dataset. The summary is printed and the per
+        image scores are keyed as by ``CSEval.evaluateImgLists``, with the
+        prediction paths the png files would have in
+        ``CSEval.args.predictionPath`` or else in the temporary directory.
+
+        Returns:
+            dict: Cityscapes evaluation results.
+        """
+        assert isinstance(results, (list, SpilledResults)), \
+            'results must be a list'
+        assert len(results) == len(self), (
+            'The length of results is not equal to the dataset len: '
+            f'{len(results)} != {len(self)}')
+        args = CSEval.args
+        prediction_dir = osp.abspath(args.predictionPath
+                                     or tempfile.gettempdir())
+        evaluator = CityscapesEvaluator(args.avgClassSize)
+
+        def _process(idx):
+            seg_map = osp.join(self.ann_dir,
+                               self.img_infos[idx]['ann']['seg_map'])
+            assert seg_map.endswith(self.seg_map_suffix)
+            prefix = seg_map[:-len(self.seg_map_suffix)]
+            gt = np.array(Image.open(prefix + '_gtFine_labelIds.png'))
+            instances = np.array(
+                Image.open(prefix + '_gtFine_instanceIds.png'))
+            pred = self._convert_to_label_id(results[idx]).astype(np.uint8)
+            return evaluator.process(pred, gt, instances)
+
+        if not args.quiet:
+            print(f'Evaluating {len(self)} pairs of images...')
+        prog_bar = mmcv.ProgressBar(len(self))
+        with ThreadPoolExecutor(max(nproc, 1)) as executor:
+            for idx, stats in enumerate(
+                    executor.map(_process, range(len(self)))):
+                filename = self.img_infos[idx]['filename']
+                basename = osp.splitext(osp.basename(filename))[0]
+                evaluator.update(
+                    osp.join(prediction_dir, f'{basename}.png'), stats)
+                prog_bar.update()
+
+        eval_results = evaluator.results()
+        if not args.quiet:
+            print('\n')
+            CSEval.printConfMatrix(evaluator.conf_matrix, args)
+            print('\n')
+            CSEval.printClassScores(eval_results['classScores'],
+                                    eval_results['classInstScores'], args)
+            self._print_cityscapes_average(CSEval,
+                                           eval_results['classScores'],
+                                           eval_results['classInstScores'])
+            print('')
+            CSEval.printCategoryScores(eval_results['categoryScores'],
+                                       eval_results['categoryInstScores'],
+                                       args)
+            self._print_cityscapes_average(
+                CSEval, eval_results['categoryScores'],
+                eval_results['categoryInstScores'])
+        return eval_results
+
+    @staticmethod
+    def _print_cityscapes_average(CSEval, scores, inst_scores):
+        """Print the average scores as ``CSEval.evaluateImgLists``."""
+        args = CSEval.args
+        averages = []
+        for score_list in (scores, inst_scores):
+            avg = CSEval.getScoreAverage(score_list, args)
+            averages.append(
+                f'{CSEval.getColorEntry(avg, args)}{avg:5.3f}{args.nocol}')
+        print('--------------------------------')
+        print('Score Average : ' + '    '.join(averages))
+        print('--------------------------------')
+        print('')
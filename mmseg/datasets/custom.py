@@ -10,13 +10,17 @@ from functools import reduce
 import mmcv
 import numpy as np
 from mmcv.utils import print_log
+from PIL import Image
 from prettytable import PrettyTable
 from torch.utils.data import Dataset
 
-from mmseg.core import eval_metrics
+from mmseg.core import SpilledResults, StreamingEvaluator, eval_metrics
+from mmseg.core.evaluation.metrics import intersect_and_union
 from mmseg.utils import get_root_logger
 from .builder import DATASETS
+from .file_index import scandir_cached
 from .pipelines import Compose
+from .seg_map_store import SegMapStore
 
 
 @DATASETS.register_module()
@@ -70,6 +74,9 @@ class CustomDataset(Dataset):
             The palette of segmentation map. If None is given, and
             self.PALETTE is None, random palette will be generated.
             Default: None
+        index_cache_dir (str, optional): If specified, the listing of
+            ``img_dir`` is cached in this directory and shared with other
+            runs. It is only used without ``split``. Default: None.
     """
 
     CLASSES = None
@@ -88,7 +95,8 @@ class CustomDataset(Dataset):
                  ignore_index=255,
                  reduce_zero_label=False,
                  classes=None,
-                 palette=None):
+                 palette=None,
+                 index_cache_dir=None):
         self.pipeline = Compose(pipeline)
         self.img_dir = img_dir
         self.img_suffix = img_suffix
@@ -100,6 +108,9 @@ class CustomDataset(Dataset):
         self.ignore_index = ignore_index
         self.reduce_zero_label = reduce_zero_label
         self.label_map = None
+        self.index_cache_dir = index_cache_dir
+        self._img_shapes = None
+        self._gt_seg_map_store = None
         self.CLASSES, self.PALETTE = self.get_classes_and_palette(
             classes, palette)
 
@@ -121,6 +132,12 @@ class CustomDataset(Dataset):
         """Total number of samples of data."""
         return len(self.img_infos)
 
+    def __getstate__(self):
+        # do not pickle the memmap of the ground truth store
+        state = self.__dict__.copy()
+        state['_gt_seg_map_store'] = None
+        return state
+
     def load_annotations(self, img_dir, img_suffix, ann_dir, seg_map_suffix,
                          split):
         """Load annotation from directory.
@@ -149,7 +166,12 @@ class CustomDataset(Dataset):
                         img_info['ann'] = dict(seg_map=seg_map)
                     img_infos.append(img_info)
         else:
-            for img in mmcv.scandir(img_dir, img_suffix, recursive=True):
+            if self.index_cache_dir is not None:
+                imgs = scandir_cached(img_dir, img_suffix,
+                                      self.index_cache_dir)
+            else:
+                imgs = mmcv.scandir(img_dir, img_suffix, recursive=True)
+            for img in imgs:
                 img_info = dict(filename=img)
                 if ann_dir is not None:
                     seg_map = img.replace(img_suffix, seg_map_suffix)
@@ -230,6 +252,21 @@ class CustomDataset(Dataset):
         self.pre_pipeline(results)
         return self.pipeline(results)
 
+    def get_img_shapes(self):
+        """Get the (h, w) shape of each image by reading the image headers.
+
+        Returns:
+            list[tuple[int]]: Image shapes in dataset order.
+        """
+        if self._img_shapes is None:
+            self._img_shapes = []
+            for img_info in self.img_infos:
+                with Image.open(osp.join(self.img_dir,
+                                         img_info['filename'])) as img:
+                    w, h = img.size
+                self._img_shapes.append((h, w))
+        return self._img_shapes
+
     def format_results(self, results, **kwargs):
         """Place holder to format result to dataset specific output."""
 
@@ -246,6 +283,95 @@ class CustomDataset(Dataset):
             gt_seg_maps.append(gt_seg_map)
         return gt_seg_maps
 
+    def get_gt_seg_map_store(self, nproc=4, cache_dir=None):
+        """Get the ground truth segmentation maps as a :obj:`SegMapStore`.
+
+        The label images are decoded in parallel and mapped by
+        ``label_map`` and ``reduce_zero_label`` into a packed uint8 memmap,
+        which is reused by later evaluations.
+
+        Args:
+            nproc (int): Number of decoding threads. Default: 4.
+            cache_dir (str, optional): If specified, the store is kept in
+                this directory and shared with other datasets and runs using
+                the same annotations. The files are checked for modifications
+                on every call. Otherwise, a temporary store is built on the
+                first call. Default: None.
+
+        Returns:
+            :obj:`SegMapStore` | None: The store or None if the label images
+                are not 8 bit.
+        """
+        seg_maps = [img_info['ann']['seg_map'] for img_info in self.img_infos]
+        if cache_dir is not None:
+            self._gt_seg_map_store = SegMapStore.load_or_build(
+                self.ann_dir,
+                seg_maps,
+                cache_dir,
+                label_map=self.label_map,
+                reduce_zero_label=self.reduce_zero_label,
+                nproc=nproc)
+        elif self._gt_seg_map_store is None:
+            self._gt_seg_map_store = SegMapStore.build(
+                [osp.join(self.ann_dir, seg_map) for seg_map in seg_maps],
+                label_map=self.label_map,
+                reduce_zero_label=self.reduce_zero_label,
+                nproc=nproc)
+        return self._gt_seg_map_store
+
+    def get_class_pixels(self, nproc=4):
+        """Count the pixels of each class in each ground truth map, as in the
+        sample class statistics of rare class sampling.
+
+        Args:
+            nproc (int): Number of decoding threads. Default: 4.
+
+        Returns:
+            ndarray: Pixel counts with shape (num_images, num_classes).
+        """
+        num_classes = len(self.CLASSES)
+        store = self.get_gt_seg_map_store(nproc)
+        class_pixels = np.zeros((len(self), num_classes), dtype=np.int64)
+        for idx in range(len(self)):
+            if store is not None:
+                # the store contains the mapped labels
+                class_pixels[idx] = np.bincount(
+                    store[idx].ravel(), minlength=256)[:num_classes]
+            else:
+                gt_seg_map = self.get_gt_seg_map(idx)
+                # the ground truth area of a dummy prediction
+                class_pixels[idx] = intersect_and_union(
+                    np.zeros_like(gt_seg_map, dtype=np.int64), gt_seg_map,
+                    num_classes, self.ignore_index, self.label_map,
+                    self.reduce_zero_label)[3].numpy()
+        return class_pixels
+
+    def get_gt_seg_map(self, idx):
+        """Get the ground truth segmentation map of one image."""
+        seg_map = self.img_infos[idx]['ann']['seg_map']
+        seg_map = osp.join(self.ann_dir, seg_map)
+        return mmcv.imread(seg_map, flag='unchanged', backend='pillow')
+
+    def get_streaming_evaluator(self, calibration_bins=0):
+        """Get a :obj:`StreamingEvaluator` for online evaluation.
+
+        The evaluator can be passed to ``single_gpu_test``/``multi_gpu_test``
+        and the returned evaluator to :meth:`evaluate` instead of the
+        results.
+
+        Args:
+            calibration_bins (int): Number of confidence bins of the
+                calibration statistics. 0 disables them. Default: 0.
+        """
+        assert self.CLASSES is not None, \
+            'streaming evaluation requires known CLASSES'
+        return StreamingEvaluator(
+            len(self.CLASSES),
+            self.ignore_index,
+            label_map=self.label_map,
+            reduce_zero_label=self.reduce_zero_label,
+            calibration_bins=calibration_bins)
+
     def get_classes_and_palette(self, classes=None, palette=None):
         """Get class names of current dataset.
 
@@ -314,15 +440,24 @@ class CustomDataset(Dataset):
                  metric='mIoU',
                  logger=None,
                  efficient_test=False,
+                 nproc=4,
+                 gt_cache=False,
                  **kwargs):
         """Evaluate the dataset.
 
         Args:
-            results (list): Testing results of the dataset.
+            results (list | :obj:`StreamingEvaluator`): Testing results of
+                the dataset or the evaluator that accumulated them.
             metric (str | list[str]): Metrics to be evaluated. 'mIoU',
                 'mDice' and 'mFscore' are supported.
             logger (logging.Logger | None | str): Logger used for printing
                 related information during evaluation. Default: None.
+            nproc (int): Number of threads that load the ground truth and
+                compute the metrics. Default: 4.
+            gt_cache (bool): Whether to keep the decoded ground truth in a
+                packed uint8 memmap for later evaluations, which the eval
+                hooks enable. A store that was already built, e.g. in a
+                ``gt_cache_dir``, is used in any case. Default: False.
 
         Returns:
             dict[str, float]: Default metrics.
@@ -334,20 +469,44 @@ class CustomDataset(Dataset):
         if not set(metric).issubset(set(allowed_metrics)):
             raise KeyError('metric {} is not supported'.format(metric))
         eval_results = {}
-        gt_seg_maps = self.get_gt_seg_maps(efficient_test)
-        if self.CLASSES is None:
-            num_classes = len(
-                reduce(np.union1d, [np.unique(_) for _ in gt_seg_maps]))
+        if isinstance(results, StreamingEvaluator):
+            num_classes = results.num_classes
+            ret_metrics = results.evaluate(metric)
         else:
-            num_classes = len(self.CLASSES)
-        ret_metrics = eval_metrics(
-            results,
-            gt_seg_maps,
-            num_classes,
-            self.ignore_index,
-            metric,
-            label_map=self.label_map,
-            reduce_zero_label=self.reduce_zero_label)
+            gt_seg_maps = None
+            label_map = self.label_map
+            reduce_zero_label = self.reduce_zero_label
+            if gt_cache or self._gt_seg_map_store is not None:
+                gt_seg_maps = self.get_gt_seg_map_store(nproc)
+            if gt_seg_maps is None:
+                # the label files are decoded by the evaluation threads
+                gt_seg_maps = self.get_gt_seg_maps(efficient_test=True)
+            else:
+                # the store already contains the mapped labels
+                label_map, reduce_zero_label = None, False
+            if self.CLASSES is None:
+                if isinstance(gt_seg_maps, SegMapStore) and \
+                        not self.reduce_zero_label:
+                    num_classes = np.count_nonzero(
+                        np.bincount(gt_seg_maps.data, minlength=256))
+                else:
+                    gt_seg_maps = self.get_gt_seg_maps()
+                    label_map = self.label_map
+                    reduce_zero_label = self.reduce_zero_label
+                    num_classes = len(
+                        reduce(np.union1d,
+                               [np.unique(_) for _ in gt_seg_maps]))
+            else:
+                num_classes = len(self.CLASSES)
+            ret_metrics = eval_metrics(
+                results,
+                gt_seg_maps,
+                num_classes,
+                self.ignore_index,
+                metric,
+                label_map=label_map,
+                reduce_zero_label=reduce_zero_label,
+                nproc=nproc)
 
         if self.CLASSES is None:
             class_names = tuple(range(num_classes))
@@ -403,4 +562,6 @@ class CustomDataset(Dataset):
         if mmcv.is_list_of(results, str):
             for file_name in results:
                 os.remove(file_name)
+        elif isinstance(results, SpilledResults):
+            results.cleanup()
         return eval_results
@@ -0,0 +1,74 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import os.path as osp
+
+import mmcv
+
+
+def _scandir(root, suffix):
+    """Files in ``root`` in the same order as ``mmcv.scandir`` with
+    ``recursive=True`` and the modification times of the visited
+    directories."""
+    files, dir_mtimes = [], {}
+
+    def _scan(dir_path):
+        dir_mtimes[osp.relpath(dir_path, root)] = os.stat(
+            dir_path).st_mtime_ns
+        for entry in os.scandir(dir_path):
+            if not entry.name.startswith('.') and entry.is_file():
+                rel_path = osp.relpath(entry.path, root)
+                if rel_path.endswith(suffix):
+                    files.append(rel_path)
+            elif osp.isdir(entry.path):
+                _scan(entry.path)
+
+    _scan(root)
+    return files, dir_mtimes
+
+
+def scandir_cached(root, suffix, cache_dir):
+    """Recursively list the files with ``suffix`` in ``root`` with a cache.
+
+    The cache records the modification time of every directory below
+    ``root``. Adding, removing or renaming a file or directory changes the
+    modification time of its parent, so a cached listing is valid if all
+    recorded directories are unchanged. This only needs one ``stat`` per
+    directory instead of listing all files, which is shared by all runs
+    using ``cache_dir``.
+
+    Args:
+        root (str): Directory to scan.
+        suffix (str): Suffix of the listed files.
+        cache_dir (str): Directory of the cache files.
+
+    Returns:
+        list[str]: Paths relative to ``root``.
+    """
+    key = hashlib.sha1(
+        json.dumps([osp.abspath(root), suffix]).encode('utf-8')).hexdigest()
+    index_file = osp.join(cache_dir, f'file_index_{key[:16]}.json')
+    if osp.isfile(index_file):
+        index = mmcv.load(index_file)
+        try:
+            valid = all(
+                os.stat(osp.join(root, d)).st_mtime_ns == mtime
+                for d, mtime in index['dir_mtimes'].items())
+        except FileNotFoundError:
+            valid = False
+        if valid:
+            return index['files']
+
+    files, dir_mtimes = _scandir(root, suffix)
+    mmcv.mkdir_or_exist(cache_dir)
+    # concurrent runs sharing the cache never read a partial index
+    tmp_file = f'{index_file}.{os.getpid()}.tmp'
+    mmcv.dump(
+        dict(files=files, dir_mtimes=dir_mtimes), tmp_file, file_format='json')
+    os.replace(tmp_file, index_file)
+    return files
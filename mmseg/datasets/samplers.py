@@ -0,0 +1,100 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import math
+from collections import OrderedDict
+
+from torch.utils.data import Sampler
+
+
+class GroupByShapeBatchSampler(Sampler):
+    """Batch sampler that only batches images with the same shape.
+
+    The samples are split between the ranks in the same way as a
+    non-shuffling :obj:`DistributedSampler`. On each rank, they are grouped
+    into buckets by image shape and each bucket is batched in dataset order.
+    As the batch order differs from the dataset order, the per-sample results
+    have to be put back with :meth:`restore_order`.
+
+    Args:
+        dataset (Dataset): Dataset providing ``get_img_shapes()``.
+        samples_per_gpu (int): Number of images per batch.
+        num_replicas (int): Number of ranks. Default: 1.
+        rank (int): Rank of the current process. Default: 0.
+    """
+
+    def __init__(self, dataset, samples_per_gpu, num_replicas=1, rank=0):
+        if not hasattr(dataset, 'get_img_shapes'):
+            raise TypeError(f'{type(dataset).__name__} does not provide '
+                            'get_img_shapes() for grouping by shape.')
+        self.samples_per_gpu = samples_per_gpu
+        num_samples = int(math.ceil(len(dataset) / num_replicas))
+        total_size = num_samples * num_replicas
+        indices = list(range(len(dataset)))
+        indices += indices[:(total_size - len(indices))]
+        self.indices = indices[rank:total_size:num_replicas]
+
+        shapes = dataset.get_img_shapes()
+        buckets = OrderedDict()
+        for idx in self.indices:
+            buckets.setdefault(shapes[idx], []).append(idx)
+        self.batches = []
+        for bucket in buckets.values():
+            for i in range(0, len(bucket), samples_per_gpu):
+                self.batches.append(bucket[i:i + samples_per_gpu])
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def restore_order(self, results):
+        """Reorder per-sample results from batch order to the order of
+        ``self.indices``, i.e. the order of a :obj:`DistributedSampler`."""
+        batch_indices = [idx for batch in self.batches for idx in batch]
+        assert len(batch_indices) == len(results)
+        result_by_idx = dict(zip(batch_indices, results))
+        return [result_by_idx[idx] for idx in self.indices]
+
+
+class RareClassSampler(Sampler):
+    """Sampler of resumable sample numbers for rare class sampling.
+
+    With rare class sampling, :obj:`UDADataset` draws the samples itself and
+    ignores the sampled index. Instead of dataset indices, this sampler
+    yields ``(seed, number)`` pairs with consecutive sample numbers, which
+    are interleaved over the ranks. The dataset seeds the random number
+    generators of the loading worker with this pair, so that the drawn
+    samples and their augmentations do not depend on the worker that loads
+    them, and the sampling can be resumed by setting :attr:`start`. It is
+    used if ``resumable_sampling=True`` is set for the :obj:`UDADataset`.
+
+    Args:
+        dataset (Dataset): The dataset.
+        num_replicas (int): Number of ranks. Default: 1.
+        rank (int): Rank of the current process. Default: 0.
+        seed (int): Random seed of the sampling. Default: 0.
+    """
+
+    def __init__(self, dataset, num_replicas=1, rank=0, seed=0):
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.num_samples = int(math.ceil(len(dataset) / num_replicas))
+        # number of samples of this rank that were drawn before
+        self.start = 0
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        first = self.start + self.epoch * self.num_samples
+        for i in range(first, first + self.num_samples):
+            yield self.seed, i * self.num_replicas + self.rank
+
+    def __len__(self):
+        return self.num_samples
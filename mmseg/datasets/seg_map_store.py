@@ -0,0 +1,227 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import os.path as osp
+import tempfile
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import mmcv
+import numpy as np
+from PIL import Image
+
+
+def _label_lut(label_map=None, reduce_zero_label=False):
+    """Lookup table that applies ``label_map`` and ``reduce_zero_label`` to
+    uint8 labels in the same way as the evaluation metrics."""
+    lut = np.arange(256, dtype=np.int64)
+    for old_id, new_id in (label_map or {}).items():
+        lut[lut == old_id] = new_id % 256
+    if reduce_zero_label:
+        reduced = lut - 1
+        reduced[(lut == 0) | (lut == 255)] = 255
+        lut = reduced
+    return lut.astype(np.uint8)
+
+
+class SegMapStore(Sequence):
+    """Packed store of uint8 segmentation maps in a single memmap.
+
+    All maps are decoded once, mapped by ``label_map`` and
+    ``reduce_zero_label`` and written back to back into one flat uint8
+    file. Indexing returns a copy-on-write (h, w) view into the memmap, so
+    repeated evaluations neither decode nor map the label images again.
+
+    Args:
+        filename (str): Path of the packed file.
+        shapes (list[tuple[int]]): (h, w) shape of each map.
+        label_map (dict | None): Label mapping that was applied to the maps.
+            Default: None.
+        reduce_zero_label (bool): Whether the zero label was reduced.
+            Default: False.
+    """
+
+    def __init__(self,
+                 filename,
+                 shapes,
+                 label_map=None,
+                 reduce_zero_label=False):
+        self.filename = filename
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.label_map = label_map
+        self.reduce_zero_label = reduce_zero_label
+        sizes = [h * w for h, w in self.shapes]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.data = np.memmap(
+            filename,
+            dtype=np.uint8,
+            mode='c',
+            shape=(max(int(self.offsets[-1]), 1), ))
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.data[start:end].reshape(self.shapes[idx])
+
+    @staticmethod
+    def read_shapes(seg_maps):
+        """Read the (h, w) shapes of label images from their headers.
+
+        Returns:
+            list[tuple[int]] | None: The shapes or None if any of the images
+                is not stored with 8 bits per pixel.
+        """
+        shapes = []
+        for seg_map in seg_maps:
+            with Image.open(seg_map) as img:
+                if img.mode not in ('L', 'P'):
+                    return None
+                w, h = img.size
+            shapes.append((h, w))
+        return shapes
+
+    @classmethod
+    def build(cls,
+              seg_maps,
+              filename=None,
+              shapes=None,
+              label_map=None,
+              reduce_zero_label=False,
+              nproc=4):
+        """Decode label images into a new store.
+
+        Args:
+            seg_maps (list[str]): Paths of the label images.
+            filename (str, optional): Path of the packed file. If not
+                specified, an anonymous temporary file is used, which is
+                removed as soon as the store is released. Default: None.
+            shapes (list[tuple[int]], optional): Shapes from
+                :meth:`read_shapes`. Default: None.
+            label_map (dict | None): Mapping old labels to new labels.
+                Default: None.
+            reduce_zero_label (bool): Wether ignore zero label.
+                Default: False.
+            nproc (int): Number of decoding threads. Default: 4.
+
+        Returns:
+            :obj:`SegMapStore` | None: The store or None if the label images
+                are not 8 bit.
+        """
+        if shapes is None:
+            shapes = cls.read_shapes(seg_maps)
+        if shapes is None:
+            return None
+        temporary = filename is None
+        if temporary:
+            fd, filename = tempfile.mkstemp(suffix='.seg_maps')
+            os.close(fd)
+        offsets = np.concatenate([[0], np.cumsum([h * w for h, w in shapes])])
+        total_size = max(int(offsets[-1]), 1)
+        data = np.memmap(
+            filename, dtype=np.uint8, mode='w+', shape=(total_size, ))
+        lut = None
+        if label_map or reduce_zero_label:
+            lut = _label_lut(label_map, reduce_zero_label)
+
+        def _decode(data, idx):
+            seg_map = mmcv.imread(
+                seg_maps[idx], flag='unchanged', backend='pillow')
+            assert seg_map.shape == shapes[idx] and seg_map.dtype == np.uint8
+            if lut is not None:
+                seg_map = lut[seg_map]
+            data[offsets[idx]:offsets[idx + 1]] = seg_map.reshape(-1)
+
+        # each task holds at most one decoded map, which bounds the memory
+        with ThreadPoolExecutor(max(nproc, 1)) as executor:
+            for _ in executor.map(
+                    partial(_decode, data), range(len(seg_maps))):
+                pass
+        data.flush()
+        # release the writable mapping before the store maps the file
+        del data
+        store = cls(filename, shapes, label_map, reduce_zero_label)
+        if temporary:
+            # the mapping stays valid until the store is released
+            os.remove(filename)
+        return store
+
+    @classmethod
+    def load_or_build(cls,
+                      ann_dir,
+                      seg_maps,
+                      cache_dir,
+                      label_map=None,
+                      reduce_zero_label=False,
+                      nproc=4):
+        """Open the cached store of label images or build it.
+
+        The cache is keyed by ``ann_dir``, the label files, ``label_map`` and
+        ``reduce_zero_label``. Its index records the size and modification
+        time of every label file, so it is rebuilt if any of them changed.
+
+        Args:
+            ann_dir (str): Annotation directory of ``seg_maps``.
+            seg_maps (list[str]): Label file names relative to ``ann_dir``.
+            cache_dir (str): Directory of the cache files.
+            label_map (dict | None): Mapping old labels to new labels.
+                Default: None.
+            reduce_zero_label (bool): Wether ignore zero label.
+                Default: False.
+            nproc (int): Number of decoding threads. Default: 4.
+
+        Returns:
+            :obj:`SegMapStore` | None: The store or None if the label images
+                are not 8 bit.
+        """
+        label_map_items = [[int(k), int(v)]
+                           for k, v in (label_map or {}).items()]
+        key = hashlib.sha1(
+            json.dumps(
+                dict(
+                    ann_dir=osp.abspath(ann_dir),
+                    seg_maps=list(seg_maps),
+                    label_map=label_map_items,
+                    reduce_zero_label=bool(reduce_zero_label))).encode(
+                        'utf-8')).hexdigest()[:16]
+        filename = osp.join(cache_dir, f'seg_maps_{key}.bin')
+        index_file = osp.join(cache_dir, f'seg_maps_{key}.json')
+        paths = [osp.join(ann_dir, seg_map) for seg_map in seg_maps]
+        stats = []
+        for path in paths:
+            stat = os.stat(path)
+            stats.append([stat.st_size, stat.st_mtime_ns])
+
+        if osp.isfile(index_file) and osp.isfile(filename):
+            index = mmcv.load(index_file)
+            if index['stats'] == stats:
+                return cls(filename, index['shapes'], label_map,
+                           reduce_zero_label)
+
+        shapes = cls.read_shapes(paths)
+        if shapes is None:
+            return None
+        mmcv.mkdir_or_exist(cache_dir)
+        # write to temporary files first, so that concurrent runs sharing
+        # the cache never open a partially written store
+        tmp_suffix = f'.{os.getpid()}.tmp'
+        cls.build(
+            paths,
+            filename + tmp_suffix,
+            shapes,
+            label_map,
+            reduce_zero_label,
+            nproc=nproc)
+        os.replace(filename + tmp_suffix, filename)
+        mmcv.dump(
+            dict(shapes=shapes, stats=stats), index_file + tmp_suffix,
+            file_format='json')
+        os.replace(index_file + tmp_suffix, index_file)
+        return cls(filename, shapes, label_map, reduce_zero_label)
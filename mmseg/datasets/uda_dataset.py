@@ -5,6 +5,7 @@
 
 import json
 import os.path as osp
+import random
 
 import mmcv
 import numpy as np
@@ -54,6 +55,10 @@ class UDADataset(object):
 
         rcs_cfg = cfg.get('rare_class_sampling')
         self.rcs_enabled = rcs_cfg is not None
+        # draw the rare class samples from the sample numbers of
+        # RareClassSampler, so that UDACheckpointHook can resume them
+        self.resumable_sampling = self.rcs_enabled and cfg.get(
+            'resumable_sampling', False)
         if self.rcs_enabled:
             self.rcs_class_temp = rcs_cfg['class_temp']
             self.rcs_min_crop_ratio = rcs_cfg['min_crop_ratio']
@@ -113,6 +118,12 @@ class UDADataset(object):
 
     def __getitem__(self, idx):
         if self.rcs_enabled:
+            if self.resumable_sampling:
+                # the (seed, sample number) of RareClassSampler determines
+                # the sample independently of the loading worker
+                seed, number = idx
+                np.random.seed([seed % 2**32, number % 2**32, number >> 32])
+                random.seed(seed * 2**64 + number)
             return self.get_rare_class_sample()
         else:
             s1 = self.source[idx // len(self.target)]
@@ -1,11 +1,17 @@
-from .backbones import *  # noqa: F401,F403
+# the packages only declare their exports, which are imported on first use
+from . import backbones, decode_heads, losses, necks, segmentors, uda
 from .builder import (BACKBONES, HEADS, LOSSES, SEGMENTORS, UDA,
                       build_backbone, build_head, build_loss, build_segmentor)
-from .decode_heads import *  # noqa: F401,F403
-from .losses import *  # noqa: F401,F403
-from .necks import *  # noqa: F401,F403
-from .segmentors import *  # noqa: F401,F403
-from .uda import *  # noqa: F401,F403
+
+_packages = (backbones, decode_heads, losses, necks, segmentors, uda)
+
+
+def __getattr__(name):
+    for package in _packages:
+        if name in package.__all__:
+            return getattr(package, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 __all__ = [
     'BACKBONES', 'HEADS', 'LOSSES', 'SEGMENTORS', 'UDA', 'build_backbone',
@@ -1,23 +1,22 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
-# Modifications: Add additional backbones
+# Modifications: Add additional backbones, lazy imports
 
-from .mix_transformer import (MixVisionTransformer, mit_b0, mit_b1, mit_b2,
-                              mit_b3, mit_b4, mit_b5)
-from .resnest import ResNeSt
-from .resnet import ResNet, ResNetV1c, ResNetV1d
-from .resnext import ResNeXt
+from ..builder import lazy_package
 
-__all__ = [
-    'ResNet',
-    'ResNetV1c',
-    'ResNetV1d',
-    'ResNeXt',
-    'ResNeSt',
-    'MixVisionTransformer',
-    'mit_b0',
-    'mit_b1',
-    'mit_b2',
-    'mit_b3',
-    'mit_b4',
-    'mit_b5',
-]
+_exports = {
+    'ResNet': 'resnet',
+    'ResNetV1c': 'resnet',
+    'ResNetV1d': 'resnet',
+    'ResNeXt': 'resnext',
+    'ResNeSt': 'resnest',
+    'MixVisionTransformer': 'mix_transformer',
+    'mit_b0': 'mix_transformer',
+    'mit_b1': 'mix_transformer',
+    'mit_b2': 'mix_transformer',
+    'mit_b3': 'mix_transformer',
+    'mit_b4': 'mix_transformer',
+    'mit_b5': 'mix_transformer',
+}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
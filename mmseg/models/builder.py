@@ -1,13 +1,60 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
-# Modifications: Support UDA models
+# Modifications: Support UDA models, lazy registration
 
+import importlib
+import sys
 import warnings
 
 from mmcv.cnn import MODELS as MMCV_MODELS
 from mmcv.cnn.bricks.registry import ATTENTION as MMCV_ATTENTION
 from mmcv.utils import Registry
 
-MODELS = Registry('models', parent=MMCV_MODELS)
+
+class LazyRegistry(Registry):
+    """Registry that imports the module of an entry when it is first used.
+
+    The model packages only declare the names they export, so importing
+    :mod:`mmseg.models` does not import all model modules and their
+    dependencies. A lazy entry is imported through its package by
+    :meth:`get`, e.g. in ``build_*``. Listing :attr:`module_dict` imports
+    all lazy entries.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LazyRegistry, self).__init__(*args, **kwargs)
+        self._lazy_modules = dict()
+
+    def add_lazy_modules(self, modules):
+        """Add lazy entries.
+
+        Args:
+            modules (dict[str, str]): Package exporting each name.
+        """
+        self._lazy_modules.update(modules)
+
+    def _import(self, name):
+        getattr(importlib.import_module(self._lazy_modules[name]), name)
+
+    def get(self, key):
+        scope, real_key = self.split_scope_key(key)
+        if (scope is None or scope == self._scope) and \
+                real_key in self._lazy_modules and \
+                real_key not in self._module_dict:
+            self._import(real_key)
+        return super(LazyRegistry, self).get(key)
+
+    def __len__(self):
+        return len(self.module_dict)
+
+    @property
+    def module_dict(self):
+        for name in self._lazy_modules:
+            if name not in self._module_dict:
+                self._import(name)
+        return self._module_dict
+
+
+MODELS = LazyRegistry('models', parent=MMCV_MODELS)
 ATTENTION = Registry('attention', parent=MMCV_ATTENTION)
 
 BACKBONES = MODELS
@@ -18,6 +65,40 @@ SEGMENTORS = MODELS
 UDA = MODELS
 
 
+def lazy_package(package, exports, registry=MODELS):
+    """Declare the lazy exports of a model package.
+
+    The returned function is the module ``__getattr__`` (PEP 562) of the
+    package, which imports the submodule of a name on first access.
+
+    Args:
+        package (str): Name of the package.
+        exports (dict[str, str]): Submodule of each exported name.
+        registry (:obj:`LazyRegistry`): Registry of the exported modules.
+            Default: MODELS.
+
+    Returns:
+        callable: The ``__getattr__`` of the package.
+    """
+    registry.add_lazy_modules({name: package for name in exports})
+
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(
+                f'module {package!r} has no attribute {name!r}')
+        submodule = exports[name]
+        module = importlib.import_module(f'{package}.{submodule}')
+        # the import binds the submodule to the package, which may shadow
+        # an export of the same name, e.g. losses.accuracy
+        namespace = vars(sys.modules[package])
+        for export, export_submodule in exports.items():
+            if export_submodule == submodule:
+                namespace[export] = getattr(module, export)
+        return namespace[name]
+
+    return __getattr__
+
+
 def build_backbone(cfg):
     """Build backbone."""
     return BACKBONES.build(cfg)
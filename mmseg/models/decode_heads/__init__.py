@@ -1,26 +1,20 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
-# Modifications: Add additional decode_heads
+# Modifications: Add additional decode_heads, lazy imports
 
-from .aspp_head import ASPPHead
-from .da_head import DAHead
-from .daformer_head import DAFormerHead
-from .dlv2_head import DLV2Head
-from .fcn_head import FCNHead
-from .isa_head import ISAHead
-from .psp_head import PSPHead
-from .segformer_head import SegFormerHead
-from .sep_aspp_head import DepthwiseSeparableASPPHead
-from .uper_head import UPerHead
+from ..builder import lazy_package
 
-__all__ = [
-    'FCNHead',
-    'PSPHead',
-    'ASPPHead',
-    'UPerHead',
-    'DepthwiseSeparableASPPHead',
-    'DAHead',
-    'DLV2Head',
-    'SegFormerHead',
-    'DAFormerHead',
-    'ISAHead'
-]
+_exports = {
+    'FCNHead': 'fcn_head',
+    'PSPHead': 'psp_head',
+    'ASPPHead': 'aspp_head',
+    'UPerHead': 'uper_head',
+    'DepthwiseSeparableASPPHead': 'sep_aspp_head',
+    'DAHead': 'da_head',
+    'DLV2Head': 'dlv2_head',
+    'SegFormerHead': 'segformer_head',
+    'DAFormerHead': 'daformer_head',
+    'ISAHead': 'isa_head',
+}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
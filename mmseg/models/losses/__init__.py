@@ -1,10 +1,17 @@
-from .accuracy import Accuracy, accuracy
-from .cross_entropy_loss import (CrossEntropyLoss, binary_cross_entropy,
-                                 cross_entropy, mask_cross_entropy)
-from .utils import reduce_loss, weight_reduce_loss, weighted_loss
+from ..builder import lazy_package
 
-__all__ = [
-    'accuracy', 'Accuracy', 'cross_entropy', 'binary_cross_entropy',
-    'mask_cross_entropy', 'CrossEntropyLoss', 'reduce_loss',
-    'weight_reduce_loss', 'weighted_loss'
-]
+_exports = {
+    'accuracy': 'accuracy',
+    'Accuracy': 'accuracy',
+    'cross_entropy': 'cross_entropy_loss',
+    'binary_cross_entropy': 'cross_entropy_loss',
+    'mask_cross_entropy': 'cross_entropy_loss',
+    'CrossEntropyLoss': 'cross_entropy_loss',
+    'ContrastiveLoss': 'contrastive_loss',
+    'reduce_loss': 'utils',
+    'weight_reduce_loss': 'utils',
+    'weighted_loss': 'utils',
+}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
@@ -1,3 +1,6 @@
-from .segformer_adapter import SegFormerAdapter
+from ..builder import lazy_package
 
-__all__ = ['SegFormerAdapter']
+_exports = {'SegFormerAdapter': 'segformer_adapter'}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
@@ -1,4 +1,6 @@
-from .base import BaseSegmentor
-from .encoder_decoder import EncoderDecoder
+from ..builder import lazy_package
 
-__all__ = ['BaseSegmentor', 'EncoderDecoder']
+_exports = {'BaseSegmentor': 'base', 'EncoderDecoder': 'encoder_decoder'}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
@@ -7,13 +7,19 @@ from collections import OrderedDict
 import mmcv
 import numpy as np
 import torch
-import torch.distributed as dist
 from mmcv.runner import BaseModule, auto_fp16
 
+from mmseg.core import reduce_log_vars
+from ..utils.visualization import blend_seg, render_seg
+
 
 class BaseSegmentor(BaseModule, metaclass=ABCMeta):
     """Base class for segmentors."""
 
+    # keep the log variables on the device until ``LogVarsReduceHook``
+    # reduces them on a logging iteration
+    defer_log_vars = False
+
     def __init__(self, init_cfg=None):
         super(BaseSegmentor, self).__init__(init_cfg)
         self.fp16_enabled = False
@@ -137,7 +143,8 @@ class BaseSegmentor(BaseModule, metaclass=ABCMeta):
                 averaging the logs.
         """
         losses = self(**data_batch)
-        loss, log_vars = self._parse_losses(losses)
+        loss, log_vars = self._parse_losses(
+            losses, reduce=not self.defer_log_vars)
 
         outputs = dict(
             loss=loss,
@@ -157,12 +164,17 @@ class BaseSegmentor(BaseModule, metaclass=ABCMeta):
         return output
 
     @staticmethod
-    def _parse_losses(losses):
+    def _parse_losses(losses, reduce=True):
         """Parse the raw outputs (losses) of the network.
 
         Args:
             losses (dict): Raw output of the network, which usually contain
                 losses and other necessary information.
+            reduce (bool): Whether to average the log variables over all
+                ranks and convert them to floats. This takes a single
+                all-reduce and host synchronization for all variables. If
+                False, the log variables are detached tensors, which can be
+                reduced later by :func:`reduce_log_vars`. Default: True.
 
         Returns:
             tuple[Tensor, dict]: (loss, log_vars), loss is the loss tensor
@@ -184,11 +196,9 @@ class BaseSegmentor(BaseModule, metaclass=ABCMeta):
 
         log_vars['loss'] = loss
         for loss_name, loss_value in log_vars.items():
-            # reduce loss when distributed training
-            if dist.is_available() and dist.is_initialized():
-                loss_value = loss_value.data.clone()
-                dist.all_reduce(loss_value.div_(dist.get_world_size()))
-            log_vars[loss_name] = loss_value.item()
+            log_vars[loss_name] = loss_value.detach()
+        if reduce:
+            reduce_log_vars(log_vars)
 
         return loss, log_vars
 
@@ -223,8 +233,7 @@ class BaseSegmentor(BaseModule, metaclass=ABCMeta):
         Returns:
             img (Tensor): Only if not `show` or `out_file`
         """
-        img = mmcv.imread(img)
-        img = img.copy()
+        img = mmcv.imread(img).astype(np.uint8)
         seg = result[0]
         if palette is None:
             if self.PALETTE is None:
@@ -237,14 +246,9 @@ class BaseSegmentor(BaseModule, metaclass=ABCMeta):
         assert palette.shape[1] == 3
         assert len(palette.shape) == 2
         assert 0 < opacity <= 1.0
-        color_seg = np.zeros((seg.shape[0], seg.shape[1], 3), dtype=np.uint8)
-        for label, color in enumerate(palette):
-            color_seg[seg == label, :] = color
         # convert to BGR
-        color_seg = color_seg[..., ::-1]
-
-        img = img * (1 - opacity) + color_seg * opacity
-        img = img.astype(np.uint8)
+        color_seg = render_seg(seg, palette)[..., ::-1]
+        img = blend_seg(img, color_seg, opacity)
         # if out_file specified, do not show image in window
         if out_file is not None:
             show = False
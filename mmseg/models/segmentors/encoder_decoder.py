@@ -1,6 +1,9 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 # Modifications: Support for seg_weight
 
+import math
+from collections import OrderedDict
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -21,6 +24,9 @@ class EncoderDecoder(BaseSegmentor):
     which could be dumped during inference.
     """
 
+    # number of cached sliding-window grids
+    slide_grid_cache_size = 8
+
     def __init__(self,
                  backbone,
                  decode_head,
@@ -43,6 +49,9 @@ class EncoderDecoder(BaseSegmentor):
 
         self.train_cfg = train_cfg
         self.test_cfg = test_cfg
+        # recently used sliding-window grids, keyed by image shape and
+        # test_cfg
+        self._slide_grid_cache = OrderedDict()
 
         assert self.with_decode_head
 
@@ -182,22 +191,31 @@ class EncoderDecoder(BaseSegmentor):
 
         return losses
 
-    # TODO refactor
-    def slide_inference(self, img, img_meta, rescale):
-        """Inference by sliding-window with overlap.
+    def _get_slide_grid(self, img):
+        """Get the sliding-window grid for the shape of ``img``.
 
-        If h_crop > h_img or w_crop > w_img, the small patch will be used to
-        decode without padding.
-        """
+        The window coordinates and the count matrix only depend on the image
+        shape and ``test_cfg``, so they are computed once per shape. The
+        ``slide_grid_cache_size`` most recently used grids are cached.
 
+        Returns:
+            tuple[list[tuple[int]], Tensor]: The windows as
+                ``(y1, y2, x1, x2)`` and the count matrix of shape
+                (1, 1, H, W).
+        """
         h_stride, w_stride = self.test_cfg.stride
         h_crop, w_crop = self.test_cfg.crop_size
-        batch_size, _, h_img, w_img = img.size()
-        num_classes = self.num_classes
+        h_img, w_img = img.shape[2:]
+        key = (h_img, w_img, h_crop, w_crop, h_stride, w_stride, img.device,
+               img.dtype)
+        if key in self._slide_grid_cache:
+            self._slide_grid_cache.move_to_end(key)
+            return self._slide_grid_cache[key]
+
         h_grids = max(h_img - h_crop + h_stride - 1, 0) // h_stride + 1
         w_grids = max(w_img - w_crop + w_stride - 1, 0) // w_stride + 1
-        preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
-        count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+        windows = []
+        count_mat = img.new_zeros((1, 1, h_img, w_img))
         for h_idx in range(h_grids):
             for w_idx in range(w_grids):
                 y1 = h_idx * h_stride
@@ -206,19 +224,57 @@ class EncoderDecoder(BaseSegmentor):
                 x2 = min(x1 + w_crop, w_img)
                 y1 = max(y2 - h_crop, 0)
                 x1 = max(x2 - w_crop, 0)
-                crop_img = img[:, :, y1:y2, x1:x2]
-                crop_seg_logit = self.encode_decode(crop_img, img_meta)
-                preds += F.pad(crop_seg_logit,
-                               (int(x1), int(preds.shape[3] - x2), int(y1),
-                                int(preds.shape[2] - y2)))
-
+                windows.append((y1, y2, x1, x2))
                 count_mat[:, :, y1:y2, x1:x2] += 1
         assert (count_mat == 0).sum() == 0
+        self._slide_grid_cache[key] = (windows, count_mat)
+        if len(self._slide_grid_cache) > self.slide_grid_cache_size:
+            self._slide_grid_cache.popitem(last=False)
+        return windows, count_mat
+
+    def _scale_input(self, img):
+        """Resize the input by ``test_cfg.input_scale`` (default: 1.0), e.g.
+        to evaluate at a reduced resolution."""
+        input_scale = self.test_cfg.get('input_scale', 1.0)
+        if input_scale == 1.0:
+            return img
+        return resize(
+            img,
+            scale_factor=input_scale,
+            mode='bilinear',
+            align_corners=self.align_corners,
+            warning=False)
+
+    def slide_inference(self, img, img_meta, rescale):
+        """Inference by sliding-window with overlap.
+
+        If h_crop > h_img or w_crop > w_img, the small patch will be used to
+        decode without padding. As all windows have the same size, they are
+        decoded in micro-batches of ``test_cfg.slide_batch_size`` windows
+        (default: 4) and accumulated with in-place slice adds.
+        """
+
+        img = self._scale_input(img)
+        batch_size, _, h_img, w_img = img.size()
+        num_classes = self.num_classes
+        windows, count_mat = self._get_slide_grid(img)
+        micro_batch = self.test_cfg.get('slide_batch_size', 4)
+        if not micro_batch:
+            micro_batch = len(windows)
+        preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
+        for start in range(0, len(windows), micro_batch):
+            chunk = windows[start:start + micro_batch]
+            crop_img = torch.cat(
+                [img[:, :, y1:y2, x1:x2] for y1, y2, x1, x2 in chunk])
+            crop_seg_logit = self.encode_decode(crop_img, img_meta)
+            for i, (y1, y2, x1, x2) in enumerate(chunk):
+                preds[:, :, y1:y2, x1:x2] += \
+                    crop_seg_logit[i * batch_size:(i + 1) * batch_size]
         if torch.onnx.is_in_onnx_export():
             # cast count_mat to constant while exporting to ONNX
             count_mat = torch.from_numpy(
                 count_mat.cpu().detach().numpy()).to(device=img.device)
-        preds = preds / count_mat
+        preds /= count_mat
         if rescale:
             preds = resize(
                 preds,
@@ -231,6 +287,7 @@ class EncoderDecoder(BaseSegmentor):
     def whole_inference(self, img, img_meta, rescale):
         """Inference with full image."""
 
+        img = self._scale_input(img)
         seg_logit = self.encode_decode(img, img_meta)
         if rescale:
             # support dynamic shape for onnx
@@ -247,6 +304,15 @@ class EncoderDecoder(BaseSegmentor):
 
         return seg_logit
 
+    def _inference_logits(self, img, img_meta):
+        """Slide/whole inference without rescaling to ``ori_shape``."""
+        assert self.test_cfg.mode in ['slide', 'whole']
+        ori_shape = img_meta[0]['ori_shape']
+        assert all(_['ori_shape'] == ori_shape for _ in img_meta)
+        if self.test_cfg.mode == 'slide':
+            return self.slide_inference(img, img_meta, rescale=False)
+        return self.whole_inference(img, img_meta, rescale=False)
+
     def inference(self, img, img_meta, rescale):
         """Inference with slide/whole style.
 
@@ -282,26 +348,278 @@ class EncoderDecoder(BaseSegmentor):
 
         return output
 
-    def simple_test(self, img, img_meta, rescale=True):
-        """Simple test with single image."""
+    def _resize_rows(self, seg_logit, size, row_start, row_end):
+        """Bilinearly resize ``seg_logit`` to ``size`` but only compute the
+        output rows ``[row_start, row_end)``.
+
+        The width is interpolated on the few source rows that are needed and
+        the height is interpolated with explicit weights, which reproduces
+        :func:`resize` up to float rounding.
+        """
+        in_h = seg_logit.shape[2]
+        out_h, out_w = size
+        rows = torch.arange(
+            row_start, row_end, device=seg_logit.device, dtype=torch.float32)
+        if self.align_corners:
+            scale = (in_h - 1) / (out_h - 1) if out_h > 1 else 0.
+            src = rows * scale
+        else:
+            src = ((rows + 0.5) * (in_h / out_h) - 0.5).clamp(min=0)
+        y0 = src.long()
+        y1 = (y0 + 1).clamp(max=in_h - 1)
+        lam = (src - y0.float()).view(1, 1, -1, 1).to(seg_logit.dtype)
+        top, bottom = int(y0[0]), int(y1[-1]) + 1
+        src_rows = resize(
+            seg_logit[:, :, top:bottom],
+            size=(bottom - top, out_w),
+            mode='bilinear',
+            align_corners=self.align_corners,
+            warning=False)
+        return src_rows[:, :, y0 - top] * (1 - lam) + \
+            src_rows[:, :, y1 - top] * lam
+
+    def _iter_resized_tiles(self, seg_logit, size, img_meta, softmax=False):
+        """Yield ``(row_start, row_end, tile)`` of ``seg_logit`` resized to
+        ``size`` and flipped back, using ``test_cfg.argmax_tile_rows`` rows
+        per tile."""
+        out_h, out_w = size
+        tile_rows = self.test_cfg.argmax_tile_rows
+        flip = img_meta[0]['flip']
+        flip_direction = img_meta[0].get('flip_direction')
+        if flip:
+            assert flip_direction in ['horizontal', 'vertical']
+        for row_start in range(0, out_h, tile_rows):
+            row_end = min(row_start + tile_rows, out_h)
+            if flip and flip_direction == 'vertical':
+                tile = self._resize_rows(seg_logit, size, out_h - row_end,
+                                         out_h - row_start)
+                tile = tile.flip(dims=(2, ))
+            else:
+                tile = self._resize_rows(seg_logit, size, row_start, row_end)
+                if flip:
+                    tile = tile.flip(dims=(3, ))
+            if softmax:
+                tile = F.softmax(tile, dim=1)
+            yield row_start, row_end, tile
+
+    def _new_label_map(self, ref, batch_size, size):
+        """Allocate a compact label map (uint8 if the classes fit)."""
+        dtype = torch.uint8 if self.num_classes <= 256 else torch.long
+        return ref.new_empty((batch_size, *size), dtype=dtype)
+
+    def _new_confidence_map(self, ref, batch_size, size, return_confidence):
+        """Allocate a float16 confidence map if ``return_confidence``."""
+        if not return_confidence:
+            return None
+        return ref.new_empty((batch_size, *size), dtype=torch.float16)
+
+    @staticmethod
+    def _format_results(seg_pred, seg_conf=None):
+        """Unravel the batch dim and pair the predictions with their
+        confidences if given."""
+        seg_pred = list(seg_pred.cpu().numpy())
+        if seg_conf is None:
+            return seg_pred
+        return list(zip(seg_pred, seg_conf.half().cpu().numpy()))
+
+    @property
+    def with_tiled_argmax(self):
+        """bool: whether low-memory row-tiled argmax inference is used"""
+        return bool(self.test_cfg.get('argmax_tile_rows')) and \
+            not torch.onnx.is_in_onnx_export()
+
+    def tiled_simple_test(self,
+                          img,
+                          img_meta,
+                          rescale=True,
+                          return_confidence=False):
+        """Low-memory simple test.
+
+        The logits are upsampled and reduced with argmax in row tiles of
+        ``test_cfg.argmax_tile_rows`` rows, so the full-resolution logits are
+        never materialized. The softmax is skipped as it is monotonic, unless
+        the confidences are requested.
+
+        Returns:
+            list[np.ndarray]: uint8 label maps (int64 for more than 256
+                classes).
+        """
+        seg_logit = self._inference_logits(img, img_meta)
+        if rescale:
+            size = tuple(img_meta[0]['ori_shape'][:2])
+        else:
+            size = tuple(seg_logit.shape[2:])
+        seg_pred = self._new_label_map(seg_logit, seg_logit.shape[0], size)
+        seg_conf = self._new_confidence_map(seg_logit, seg_logit.shape[0],
+                                            size, return_confidence)
+        for row_start, row_end, tile in self._iter_resized_tiles(
+                seg_logit, size, img_meta):
+            seg_pred[:, row_start:row_end] = tile.argmax(dim=1)
+            if seg_conf is not None:
+                seg_conf[:, row_start:row_end] = \
+                    F.softmax(tile, dim=1).max(dim=1)[0]
+        return self._format_results(seg_pred, seg_conf)
+
+    def tiled_aug_test(self,
+                       imgs,
+                       img_metas,
+                       rescale=True,
+                       return_confidence=False):
+        """Low-memory test with augmentations.
+
+        The softmax of each augmentation is upsampled and accumulated in row
+        tiles, so only the accumulator is kept at full resolution.
+        """
+        assert rescale
+        size = tuple(img_metas[0][0]['ori_shape'][:2])
+        seg_prob = None
+        for img, img_meta in zip(imgs, img_metas):
+            seg_logit = self._inference_logits(img, img_meta)
+            if seg_prob is None:
+                seg_prob = seg_logit.new_zeros(
+                    (seg_logit.shape[0], seg_logit.shape[1], *size))
+            for row_start, row_end, tile in self._iter_resized_tiles(
+                    seg_logit, size, img_meta, softmax=True):
+                seg_prob[:, :, row_start:row_end] += tile
+            del seg_logit
+        seg_pred = self._new_label_map(seg_prob, seg_prob.shape[0], size)
+        seg_conf = self._new_confidence_map(seg_prob, seg_prob.shape[0], size,
+                                            return_confidence)
+        tile_rows = self.test_cfg.argmax_tile_rows
+        for row_start in range(0, size[0], tile_rows):
+            row_end = row_start + tile_rows
+            tile = seg_prob[:, :, row_start:row_end]
+            seg_pred[:, row_start:row_end] = tile.argmax(dim=1)
+            if seg_conf is not None:
+                seg_conf[:, row_start:row_end] = \
+                    tile.max(dim=1)[0] / len(imgs)
+        return self._format_results(seg_pred, seg_conf)
+
+    def simple_test(self, img, img_meta, rescale=True,
+                    return_confidence=False):
+        """Simple test with single image.
+
+        If ``return_confidence`` is True, each prediction is returned as a
+        tuple with its float16 confidence map, i.e. the maximum softmax
+        probability of each pixel.
+        """
+        if self.with_tiled_argmax:
+            return self.tiled_simple_test(img, img_meta, rescale,
+                                          return_confidence)
         seg_logit = self.inference(img, img_meta, rescale)
         seg_pred = seg_logit.argmax(dim=1)
         if torch.onnx.is_in_onnx_export():
             # our inference backend only support 4D output
             seg_pred = seg_pred.unsqueeze(0)
             return seg_pred
-        seg_pred = seg_pred.cpu().numpy()
-        # unravel batch dim
-        seg_pred = list(seg_pred)
-        return seg_pred
+        seg_conf = seg_logit.max(dim=1)[0] if return_confidence else None
+        return self._format_results(seg_pred, seg_conf)
+
+    def batched_aug_test(self,
+                         imgs,
+                         img_metas,
+                         rescale=True,
+                         return_confidence=False):
+        """Test with augmentations, batching all augmentations of the same
+        input shape (i.e. the flips of a scale) into one forward pass.
+
+        The softmax is accumulated at ``test_cfg.tta.acc_scale`` (default:
+        0.5) of the original resolution and upsampled once at the end. The
+        scales are processed from the middle of the scale pyramid outwards.
+        If ``test_cfg.tta.early_exit_thr`` is set, the remaining scales are
+        skipped once the averaged confidence of at least
+        ``test_cfg.tta.early_exit_ratio`` (default: 1.0) of the pixels
+        reaches the threshold.
+        """
+        assert rescale
+        tta_cfg = self.test_cfg.tta
+        ori_h, ori_w = img_metas[0][0]['ori_shape'][:2]
+        acc_scale = tta_cfg.get('acc_scale', 0.5)
+        acc_size = (max(int(ori_h * acc_scale + 0.5), 1),
+                    max(int(ori_w * acc_scale + 0.5), 1))
+        early_exit_thr = tta_cfg.get('early_exit_thr', None)
+        early_exit_ratio = tta_cfg.get('early_exit_ratio', 1.0)
+        batch_size = imgs[0].shape[0]
+
+        groups = OrderedDict()
+        for i, img in enumerate(imgs):
+            groups.setdefault(tuple(img.shape[2:]), []).append(i)
+        heights = sorted(shape[0] for shape in groups)
+        mid_h = heights[len(heights) // 2]
+        shapes = sorted(
+            groups, key=lambda shape: abs(math.log(shape[0] / mid_h)))
+
+        seg_prob = None
+        num_augs = 0
+        for shape in shapes:
+            aug_ids = groups[shape]
+            img = torch.cat([imgs[i] for i in aug_ids])
+            img_meta = [meta for i in aug_ids for meta in img_metas[i]]
+            seg_logit = self._inference_logits(img, img_meta)
+            seg_logit = resize(
+                seg_logit,
+                size=acc_size,
+                mode='bilinear',
+                align_corners=self.align_corners,
+                warning=False)
+            output = F.softmax(seg_logit, dim=1)
+            for j, i in enumerate(aug_ids):
+                prob = output[j * batch_size:(j + 1) * batch_size]
+                if img_metas[i][0]['flip']:
+                    flip_direction = img_metas[i][0]['flip_direction']
+                    assert flip_direction in ['horizontal', 'vertical']
+                    if flip_direction == 'horizontal':
+                        prob = prob.flip(dims=(3, ))
+                    else:
+                        prob = prob.flip(dims=(2, ))
+                if seg_prob is None:
+                    seg_prob = prob.clone()
+                else:
+                    seg_prob += prob
+                num_augs += 1
+            if early_exit_thr is not None and num_augs < len(imgs):
+                confidence = seg_prob.max(dim=1)[0] / num_augs
+                confident = (confidence >= early_exit_thr).float().mean()
+                if confident >= early_exit_ratio:
+                    break
+        seg_prob /= num_augs
+
+        size = (ori_h, ori_w)
+        if self.with_tiled_argmax:
+            seg_pred = self._new_label_map(seg_prob, batch_size, size)
+            seg_conf = self._new_confidence_map(seg_prob, batch_size, size,
+                                                return_confidence)
+            for row_start, row_end, tile in self._iter_resized_tiles(
+                    seg_prob, size, [dict(flip=False)]):
+                seg_pred[:, row_start:row_end] = tile.argmax(dim=1)
+                if seg_conf is not None:
+                    seg_conf[:, row_start:row_end] = tile.max(dim=1)[0]
+        else:
+            seg_prob = resize(
+                seg_prob,
+                size=size,
+                mode='bilinear',
+                align_corners=self.align_corners,
+                warning=False)
+            seg_pred = seg_prob.argmax(dim=1)
+            seg_conf = seg_prob.max(dim=1)[0] if return_confidence else None
+        return self._format_results(seg_pred, seg_conf)
 
-    def aug_test(self, imgs, img_metas, rescale=True):
+    def aug_test(self, imgs, img_metas, rescale=True,
+                 return_confidence=False):
         """Test with augmentations.
 
-        Only rescale=True is supported.
+        Only rescale=True is supported. See :meth:`simple_test` for
+        ``return_confidence``.
         """
         # aug_test rescale all imgs back to ori_shape for now
         assert rescale
+        if self.test_cfg.get('tta', None) is not None:
+            return self.batched_aug_test(imgs, img_metas, rescale,
+                                         return_confidence)
+        if self.with_tiled_argmax:
+            return self.tiled_aug_test(imgs, img_metas, rescale,
+                                       return_confidence)
         # to save memory, we get augmented seg logit inplace
         seg_logit = self.inference(imgs[0], img_metas[0], rescale)
         for i in range(1, len(imgs)):
@@ -309,7 +627,5 @@ class EncoderDecoder(BaseSegmentor):
             seg_logit += cur_seg_logit
         seg_logit /= len(imgs)
         seg_pred = seg_logit.argmax(dim=1)
-        seg_pred = seg_pred.cpu().numpy()
-        # unravel batch dim
-        seg_pred = list(seg_pred)
-        return seg_pred
+        seg_conf = seg_logit.max(dim=1)[0] if return_confidence else None
+        return self._format_results(seg_pred, seg_conf)
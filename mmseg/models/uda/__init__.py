@@ -3,6 +3,9 @@
 # Licensed under the Apache License, Version 2.0
 # ---------------------------------------------------------------
 
-from mmseg.models.uda.dacs import DACS
+from ..builder import lazy_package
 
-__all__ = ['DACS']
+_exports = {'DACS': 'dacs'}
+__getattr__ = lazy_package(__name__, _exports)
+
+__all__ = list(_exports)
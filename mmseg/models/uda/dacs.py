@@ -14,22 +14,20 @@ import random
 from copy import deepcopy
 
 import mmcv
-import numpy as np
 import torch
-from matplotlib import pyplot as plt
-from timm.models.layers import DropPath
 from torch.nn.modules.dropout import _DropoutNd
 import torch.nn.functional as F
 from torch import nn
 
-from mmseg.core import add_prefix
+from mmseg.core import add_prefix, reduce_log_vars
 from mmseg.models import UDA, build_segmentor
 from mmseg.models.uda.uda_decorator import UDADecorator, get_module
 from mmseg.models.utils.dacs_transforms import (denorm, get_class_masks,
                                                 get_mean_std, strong_transform,target_strong_transform)
-from mmseg.models.utils.visualization import subplotimg
+from mmseg.models.utils.visualization import ImageWriterPool, subplotimg
 from mmseg.utils.utils import downscale_label_ratio
 from mmcv.runner import  load_checkpoint
+from mmseg.models.utils.ema_teacher import EMATeacher
 from mmseg.models.utils.proto_estimator import ProtoEstimator
 from mmseg.models.losses.contrastive_loss import contrast_preparations,bank_contrastive
 import time
@@ -55,6 +53,61 @@ def calc_grad_magnitude(grads, norm_type=2.0):
     return norm
 
 
+def write_debug_images(out_dir, local_iter, batch_size, vis):
+    """Plot the class mix debug images of a training iteration.
+
+    The figures do not use the global state of pyplot, so that they can be
+    rendered in a writer thread.
+    """
+    from matplotlib.figure import Figure
+    for j in range(batch_size):
+        rows, cols = 2, 5
+        fig = Figure(figsize=(3 * cols, 3 * rows))
+        axs = fig.subplots(
+            rows,
+            cols,
+            gridspec_kw={
+                'hspace': 0.1,
+                'wspace': 0,
+                'top': 0.95,
+                'bottom': 0,
+                'right': 1,
+                'left': 0
+            },
+        )
+        subplotimg(axs[0][0], vis['img'][j], 'Source Image')
+        subplotimg(axs[1][0], vis['trg_img'][j], 'Target Image')
+        subplotimg(
+            axs[0][1],
+            vis['gt_semantic_seg'][j],
+            'Source Seg GT',
+            cmap='cityscapes')
+        subplotimg(
+            axs[1][1],
+            vis['pseudo_label'][j],
+            'Target Seg (Pseudo) GT',
+            cmap='cityscapes')
+        subplotimg(axs[0][2], vis['mixed_img'][j], 'Mixed target Image')
+        subplotimg(
+            axs[1][2], vis['target_masks'][j], 'target Mask', cmap='gray')
+        subplotimg(
+            axs[1][3], vis['mixed_lbl'][j], 'Seg Targ', cmap='cityscapes')
+        subplotimg(
+            axs[0][3], vis['pseudo_weight'][j], 'Pseudo W.', vmin=0, vmax=1)
+        if vis['fdist_mask'] is not None:
+            subplotimg(
+                axs[0][4], vis['fdist_mask'][j][0], 'FDist Mask', cmap='gray')
+        if vis['gt_rescale'] is not None:
+            subplotimg(
+                axs[1][4],
+                vis['gt_rescale'][j],
+                'Scaled GT',
+                cmap='cityscapes')
+        for ax in axs.flat:
+            ax.axis('off')
+        fig.savefig(os.path.join(out_dir, f'{local_iter:06d}_{j}.png'))
+
+
 @UDA.register_module()
 class DACS(UDADecorator):
 
@@ -80,6 +133,7 @@ class DACS(UDADecorator):
 
         self.debug_fdist_mask = None
         self.debug_gt_rescale = None
+        self.debug_img_writer = None
 
         self.class_probs = {}
 
@@ -111,17 +165,47 @@ class DACS(UDADecorator):
         else:
             self.imnet_model = None
 
-        self.feat_distributions = ProtoEstimator(dim=512, class_num=19,memory_length=200)
+        # the fixed teacher is loaded once in the first training step
+        self.tea_model = None
+        # optional EMA teacher of the student for the pseudo-labels, e.g.
+        # ema_teacher=dict(update_interval=1)
+        ema_cfg = cfg.get('ema_teacher')
+        if ema_cfg is not None:
+            self.ema_model = EMATeacher(
+                self.get_model(), alpha=self.alpha, **ema_cfg)
+        else:
+            self.ema_model = None
+
+        # the bank is identical on all ranks and can be updated every
+        # `proto_update_interval` steps to reduce the communication
+        self.feat_distributions = ProtoEstimator(
+            dim=512,
+            class_num=19,
+            memory_length=200,
+            update_interval=cfg.get('proto_update_interval', 1))
 
     def get_teacher_model(self):
         return get_module(self.tea_model)
 
+    def get_ema_model(self):
+        return get_module(self.ema_model).model
+
     def get_imnet_model(self):
         return get_module(self.imnet_model)
 
+    def uda_state_dict(self):
+        return dict(
+            local_iter=self.local_iter,
+            feat_distributions=self.feat_distributions.state_dict())
+
+    def load_uda_state_dict(self, state_dict):
+        self.local_iter = state_dict['local_iter']
+        self.feat_distributions.load_state_dict(
+            state_dict['feat_distributions'])
 
 
-    def train_step(self, data_batch, optimizer, **kwargs):
+
+    def train_step(self, data_batch, optimizer, reduce_grads=None, **kwargs):
 
         """The iteration step during training.
 
@@ -136,6 +220,9 @@ class DACS(UDADecorator):
             optimizer (:obj:`torch.optim.Optimizer` | dict): The optimizer of
                 runner is passed to ``train_step()``. This argument is unused
                 and reserved.
+            reduce_grads (callable, optional): Averages the gradients of the
+                student over all ranks before the optimizer step, see
+                ``StudentDistributedDataParallel``. Default: None.
 
         Returns:
             dict: It should contain at least 3 keys: ``loss``, ``log_vars``,
@@ -151,9 +238,14 @@ class DACS(UDADecorator):
 
         optimizer.zero_grad()
         log_vars = self(**data_batch)
+        if reduce_grads is not None:
+            reduce_grads()
         optimizer.step()
 
         log_vars.pop('loss', None)  # remove the unnecessary 'loss'
+        # the losses of the step are reduced together at its end
+        if not self.defer_log_vars:
+            reduce_log_vars(log_vars)
         outputs = dict(
             log_vars=log_vars, num_samples=len(data_batch['img_metas']))
         return outputs
@@ -192,7 +284,7 @@ class DACS(UDADecorator):
             feat_dist = self.masked_feat_dist(feat[lay], feat_imnet[lay])
         feat_dist = self.fdist_lambda * feat_dist
         feat_loss, feat_log = self._parse_losses(
-            {'loss_imnet_feat_dist': feat_dist})
+            {'loss_imnet_feat_dist': feat_dist}, reduce=False)
         feat_log.pop('loss', None)
         return feat_loss, feat_log
 
@@ -216,15 +308,19 @@ class DACS(UDADecorator):
             dict[str, Tensor]: a dictionary of loss components
 
         """
-        self.tea_model = build_segmentor(self.teacher_cfg, test_cfg=None)
-        checkpoint_pth = 'work_dirs/211108_1622_gta2cs_daformer_s0_7f24c/latest.pth'
-        checkpoint = load_checkpoint(
-            self.tea_model,
-            checkpoint_pth,
-            map_location='cpu',
-            revise_keys=[(r'^module\.', ''), ('model.', '')])
+        if self.tea_model is None:
+            self.tea_model = build_segmentor(self.teacher_cfg, test_cfg=None)
+            checkpoint_pth = 'work_dirs/211108_1622_gta2cs_daformer_s0_7f24c/latest.pth'
+            checkpoint = load_checkpoint(
+                self.tea_model,
+                checkpoint_pth,
+                map_location='cpu',
+                revise_keys=[(r'^module\.', ''), ('model.', '')])
 
-        self.tea_model.to("cuda")
+            self.tea_model.to("cuda")
+            # the teacher is not optimized, so no gradients are computed
+            # for it
+            self.tea_model.requires_grad_(False)
 
 
         log_vars = {}
@@ -232,7 +328,8 @@ class DACS(UDADecorator):
         dev = img.device
 
         # Init/update ema model
-
+        if self.ema_model is not None:
+            self.ema_model.update(self.get_model(), self.local_iter)
 
         means, stds = get_mean_std(img_metas, dev)
         strong_parameters = {
@@ -250,7 +347,8 @@ class DACS(UDADecorator):
         clean_losses = self.get_model().forward_train(
             img, img_metas, gt_semantic_seg, return_feat=True)
         src_feat = clean_losses.pop('features')
-        clean_loss, clean_log_vars = self._parse_losses(clean_losses)
+        clean_loss, clean_log_vars = self._parse_losses(
+            clean_losses, reduce=False)
         log_vars.update(clean_log_vars)
         clean_loss.backward(retain_graph=self.enable_fdist)
 
@@ -278,20 +376,24 @@ class DACS(UDADecorator):
                 mmcv.print_log(f'Fdist Grad.: {grad_mag}', 'mmseg')
 
         # Generate pseudo-label
-        for m in self.get_teacher_model().modules():
+        pseudo_model = self.get_teacher_model()
+        if self.ema_model is not None:
+            pseudo_model = self.get_ema_model()
+        from timm.models.layers import DropPath
+        for m in pseudo_model.modules():
 
             if isinstance(m, _DropoutNd):
                 m.training = False
             if isinstance(m, DropPath):
                 m.training = False
         #with torch.no_grad():
-        ema_logits = self.get_teacher_model().encode_decode(target_img, target_img_metas)
+        ema_logits = pseudo_model.encode_decode(target_img, target_img_metas)
 
         ema_softmax = torch.softmax(ema_logits.detach(), dim=1)
         pseudo_prob, pseudo_label = torch.max(ema_softmax, dim=1)
         ps_large_p = pseudo_prob.ge(self.pseudo_threshold).long() == 1
-        ps_size = np.size(np.array(pseudo_label.cpu()))
-        pseudo_weight_= torch.sum(ps_large_p).item() / ps_size
+        # the weight stays on the device to avoid a host synchronization
+        pseudo_weight_ = torch.sum(ps_large_p) / pseudo_label.numel()
         pseudo_weight = pseudo_weight_ * torch.ones(
             pseudo_prob.shape, device=dev)
 
@@ -326,7 +428,7 @@ class DACS(UDADecorator):
             mixed_img, img_metas, mixed_lbl, pseudo_weight, return_feat=True,return_context = False)
         mix_losses.pop('features')
         mix_losses = add_prefix(mix_losses, 'mix')
-        mix_loss, mix_log_vars = self._parse_losses(mix_losses)
+        mix_loss, mix_log_vars = self._parse_losses(mix_losses, reduce=False)
         log_vars.update(mix_log_vars)
         mix_loss.backward(retain_graph=True)
 
@@ -375,7 +477,8 @@ class DACS(UDADecorator):
         #contrastive loss
         if self.local_iter >= self.start_distribution_iter:
             cl_loss = bank_contrastive(student_trg_feat,pseudo_label_cl,bank)
-            cl_loss, _ = self._parse_losses({'contrastive loss': cl_loss})
+            cl_loss, _ = self._parse_losses({'contrastive loss': cl_loss},
+                                         reduce=False)
             cl_loss.backward(retain_graph=True )
 
             if self.print_grad_magnitude:
@@ -394,7 +497,8 @@ class DACS(UDADecorator):
         p_t_trg = F.softmax(scale_soft_trg,dim = 1)
         kl_loss_trg = F.kl_div(p_s_trg,p_t_trg,reduction='batchmean')
         kl_loss_trg = pseudo_weight_ * kl_loss_trg
-        kl_loss_trg,_ = self._parse_losses({'KL_div_loss_trg': kl_loss_trg})
+        kl_loss_trg,_ = self._parse_losses({'KL_div_loss_trg': kl_loss_trg},
+                                          reduce=False)
         kl_loss_trg.backward()
 
         if self.print_grad_magnitude:
@@ -420,60 +524,28 @@ class DACS(UDADecorator):
             vis_img = torch.clamp(denorm(img, means, stds), 0, 1)
             vis_trg_img = torch.clamp(denorm(target_img, means, stds), 0, 1)
             vis_mixed_img = torch.clamp(denorm(aug_target_img, means, stds), 0, 1)
-            for j in range(batch_size):
-                rows, cols = 2, 5
-                fig, axs = plt.subplots(
-                    rows,
-                    cols,
-                    figsize=(3 * cols, 3 * rows),
-                    gridspec_kw={
-                        'hspace': 0.1,
-                        'wspace': 0,
-                        'top': 0.95,
-                        'bottom': 0,
-                        'right': 1,
-                        'left': 0
-                    },
-                )
-                subplotimg(axs[0][0], vis_img[j], 'Source Image')
-                subplotimg(axs[1][0], vis_trg_img[j], 'Target Image')
-                subplotimg(
-                    axs[0][1],
-                    gt_semantic_seg[j],
-                    'Source Seg GT',
-                    cmap='cityscapes')
-                subplotimg(
-                    axs[1][1],
-                    pseudo_label[j],
-                    'Target Seg (Pseudo) GT',
-                    cmap='cityscapes')
-                subplotimg(axs[0][2], vis_mixed_img[j], 'Mixed target Image')
-                subplotimg(
-                    axs[1][2], target_masks[j][0], 'target Mask', cmap='gray')
-                # subplotimg(axs[0][3], pred_u_s[j], "Seg Pred",
-                #            cmap="cityscapes")
-                subplotimg(
-                    axs[1][3], mixed_lbl[j], 'Seg Targ', cmap='cityscapes')
-                subplotimg(
-                    axs[0][3], pseudo_weight[j], 'Pseudo W.', vmin=0, vmax=1)
-                if self.debug_fdist_mask is not None:
-                    subplotimg(
-                        axs[0][4],
-                        self.debug_fdist_mask[j][0],
-                        'FDist Mask',
-                        cmap='gray')
-                if self.debug_gt_rescale is not None:
-                    subplotimg(
-                        axs[1][4],
-                        self.debug_gt_rescale[j],
-                        'Scaled GT',
-                        cmap='cityscapes')
-                for ax in axs.flat:
-                    ax.axis('off')
-                plt.savefig(
-                    os.path.join(out_dir,
-                                 f'{(self.local_iter + 1):06d}_{j}.png'))
-                plt.close()
+            # the figures are rendered from CPU copies in a writer thread,
+            # so that training continues meanwhile
+            vis = dict(
+                img=vis_img,
+                trg_img=vis_trg_img,
+                gt_semantic_seg=gt_semantic_seg,
+                pseudo_label=pseudo_label,
+                mixed_img=vis_mixed_img,
+                target_masks=[mask[0] for mask in target_masks],
+                mixed_lbl=mixed_lbl,
+                pseudo_weight=pseudo_weight,
+                fdist_mask=self.debug_fdist_mask,
+                gt_rescale=self.debug_gt_rescale)
+            vis = {
+                k: None if v is None else [x.detach().cpu() for x in v]
+                for k, v in vis.items()
+            }
+            if self.debug_img_writer is None:
+                self.debug_img_writer = ImageWriterPool(nproc=1)
+            self.debug_img_writer.submit(write_debug_images, out_dir,
+                                         self.local_iter + 1, batch_size,
+                                         vis)
         self.local_iter += 1
 
         return log_vars
\ No newline at end of file
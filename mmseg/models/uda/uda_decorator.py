@@ -39,6 +39,18 @@ class UDADecorator(BaseSegmentor):
     def get_model(self):
         return get_module(self.model)
 
+    def uda_state_dict(self):
+        """State of the UDA method that is not part of the model weights.
+
+        It is saved and restored by ``UDACheckpointHook`` to resume the
+        training exactly.
+        """
+        return dict()
+
+    def load_uda_state_dict(self, state_dict):
+        """Restore the state of :meth:`uda_state_dict`."""
+        pass
+
     def extract_feat(self, img):
         """Extract features from images."""
         return self.get_model().extract_feat(img)
@@ -91,13 +103,17 @@ class UDADecorator(BaseSegmentor):
         """
         return self.get_model().inference(img, img_meta, rescale)
 
-    def simple_test(self, img, img_meta, rescale=True):
+    def simple_test(self, img, img_meta, rescale=True,
+                    return_confidence=False):
         """Simple test with single image."""
-        return self.get_model().simple_test(img, img_meta, rescale)
+        return self.get_model().simple_test(img, img_meta, rescale,
+                                            return_confidence)
 
-    def aug_test(self, imgs, img_metas, rescale=True):
+    def aug_test(self, imgs, img_metas, rescale=True,
+                 return_confidence=False):
         """Test with augmentations.
 
         Only rescale=True is supported.
         """
-        return self.get_model().aug_test(imgs, img_metas, rescale)
+        return self.get_model().aug_test(imgs, img_metas, rescale,
+                                         return_confidence)
@@ -2,7 +2,6 @@
 # Copyright (c) 2020 vikolss. Licensed under the MIT License
 # A copy of the license is available at resources/license_dacs
 
-import kornia
 import numpy as np
 import torch
 import torch.nn as nn
@@ -70,6 +69,7 @@ def color_jitter(color_jitter, mean, std, data=None, target=None, s=.25, p=.2):
     if not (data is None):
         if data.shape[1] == 3:
             if color_jitter > p:
+                import kornia
                 if isinstance(s, dict):
                     seq = nn.Sequential(kornia.augmentation.ColorJitter(**s))
                 else:
@@ -86,6 +86,7 @@ def gaussian_blur(blur, data=None, target=None):
     if not (data is None):
         if data.shape[1] == 3:
             if blur > 0.5:
+                import kornia
                 sigma = np.random.uniform(0.15, 1.15)
                 kernel_size_y = int(
                     np.floor(
@@ -0,0 +1,111 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+from collections import OrderedDict
+from copy import deepcopy
+
+import torch
+from torch import nn
+
+
+class EMATeacher(nn.Module):
+    """Exponential moving average of a model in flat buffers.
+
+    The floating point parameters and buffers of the teacher are views into
+    one contiguous buffer per dtype. An update scales each buffer with a
+    single kernel and adds the weights of the student with one
+    ``torch._foreach_add_`` call. Integer buffers, such as
+    ``num_batches_tracked``, are copied.
+
+    The teacher is updated every ``update_interval`` iterations with
+
+        alpha_n = min(1 - 1 / (n + 1), alpha ** update_interval),
+
+    where n is the number of previous updates. Early on, the teacher is the
+    average of all student weights so far, and the first update copies the
+    student. Afterwards, the decay per iteration is ``alpha`` regardless of
+    the interval.
+
+    Args:
+        model (nn.Module): The student, whose architecture is copied.
+        alpha (float): EMA decay per iteration. Default: 0.999.
+        update_interval (int): Number of iterations between two updates.
+            Default: 1.
+    """
+
+    def __init__(self, model, alpha=0.999, update_interval=1):
+        super(EMATeacher, self).__init__()
+        self.model = deepcopy(model)
+        self.model.requires_grad_(False)
+        self.alpha = alpha
+        self.update_interval = update_interval
+        self._groups = None
+
+    def _tensors(self, model):
+        return list(model.parameters()) + list(model.buffers())
+
+    def _flatten(self):
+        """Move the floating point tensors of the teacher into flat buffers.
+
+        This is done before the first update, i.e. after the model was moved
+        to its device, as the conversion replaces the tensor storages.
+        """
+        groups = OrderedDict()
+        for i, tensor in enumerate(self._tensors(self.model)):
+            if tensor.is_floating_point():
+                groups.setdefault((tensor.dtype, tensor.device), []).append(i)
+        tensors = self._tensors(self.model)
+        self._groups = []
+        for indices in groups.values():
+            flat = torch.cat(
+                [tensors[i].detach().reshape(-1) for i in indices])
+            offset = 0
+            for i in indices:
+                numel = tensors[i].numel()
+                tensors[i].data = flat[offset:offset + numel].view_as(
+                    tensors[i])
+                offset += numel
+            self._groups.append((flat, indices))
+        self._other = [
+            i for i, tensor in enumerate(tensors)
+            if not tensor.is_floating_point()
+        ]
+
+    def _is_flat(self):
+        if self._groups is None:
+            return False
+        tensors = self._tensors(self.model)
+        return all(tensors[indices[0]].data_ptr() == flat.data_ptr()
+                   for flat, indices in self._groups)
+
+    def get_alpha(self, num_updates):
+        return min(1 - 1 / (num_updates + 1),
+                   self.alpha**self.update_interval)
+
+    @torch.no_grad()
+    def update(self, model, it):
+        """Update the teacher with the weights of ``model`` at iteration
+        ``it``, if it is an update iteration."""
+        if it % self.update_interval != 0:
+            return
+        if not self._is_flat():
+            self._flatten()
+        alpha = self.get_alpha(it // self.update_interval)
+        teacher = self._tensors(self.model)
+        student = [t.detach() for t in self._tensors(model)]
+        for flat, indices in self._groups:
+            flat.mul_(alpha)
+            views = [teacher[i] for i in indices]
+            sources = [student[i] for i in indices]
+            if hasattr(torch, '_foreach_add_'):
+                torch._foreach_add_(views, sources, alpha=1 - alpha)
+            else:
+                for view, source in zip(views, sources):
+                    view.add_(source, alpha=1 - alpha)
+        for i in self._other:
+            teacher[i].copy_(student[i])
+
+    def forward(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
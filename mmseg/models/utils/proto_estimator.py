@@ -11,56 +11,102 @@ from collections import deque
 
 
 class ProtoEstimator:
-    def __init__(self, dim, class_num, memory_length=100, resume=""):
+    """Memory bank of class prototypes.
+
+    Each update appends the mean feature of every present class to the bank
+    of the class. Under distributed training, the per-class feature sums and
+    counts of all ranks are packed into one tensor and summed with a single
+    all-reduce, so that all ranks append the same global means and hold
+    identical banks.
+
+    Args:
+        dim (int): Feature dimension.
+        class_num (int): Number of classes.
+        memory_length (int): Maximum number of prototypes per class.
+            Default: 100.
+        resume (str): Checkpoint to load the statistics from. Default: "".
+        update_interval (int): Number of :meth:`update_proto` calls, whose
+            features are accumulated into one bank entry. The collective
+            communication only takes place once per interval. Default: 1.
+        device (str | torch.device): Device of the statistics.
+            Default: 'cuda'.
+    """
+
+    def __init__(self,
+                 dim,
+                 class_num,
+                 memory_length=100,
+                 resume="",
+                 update_interval=1,
+                 device='cuda'):
         super(ProtoEstimator, self).__init__()
         self.dim = dim
         self.class_num = class_num
+        self.memory_length = memory_length
+        self.update_interval = update_interval
+        self.device = device
+        self.num_pending = 0
+        # per-class feature sums and counts (last column) since the last
+        # bank update
+        self.pending = torch.zeros(class_num, dim + 1, device=device)
 
         # init mean and covariance
         if resume:
             print("Loading checkpoint from {}".format(resume))
             checkpoint = torch.load(resume, map_location=torch.device('cpu'))
-            self.CoVariance = checkpoint['CoVariance'].cuda()
-            self.Ave = checkpoint['Ave'].cuda()
-            self.Amount = checkpoint['Amount'].cuda()
+            self.CoVariance = checkpoint['CoVariance'].to(device)
+            self.Ave = checkpoint['Ave'].to(device)
+            self.Amount = checkpoint['Amount'].to(device)
             if 'MemoryBank' in checkpoint:
-                self.MemoryBank = checkpoint['MemoryBank'].cuda()
+                self.MemoryBank = checkpoint['MemoryBank'].to(device)
         else:
-            self.CoVariance = torch.zeros(self.class_num, self.dim).cuda()
-            self.Ave = torch.zeros(self.class_num, self.dim).cuda()
-            self.Amount = torch.zeros(self.class_num).cuda()
+            self.CoVariance = torch.zeros(self.class_num, self.dim,
+                                          device=device)
+            self.Ave = torch.zeros(self.class_num, self.dim, device=device)
+            self.Amount = torch.zeros(self.class_num, device=device)
             self.MemoryBank = [deque([self.Ave[cls].unsqueeze(0).detach()], maxlen=memory_length)
                                for cls in range(self.class_num)]
 
     def update_proto(self, features, labels):
-        """Update variance and mean
+        """Update the memory bank with the class means of the features.
 
         Args:
-            features (Tensor): feature map, shape [B, A, H, W]  N = B*H*W
-            labels (Tensor): shape [B, 1, H, W]
+            features (Tensor): Features of shape [N, A].
+            labels (Tensor): Class of each feature of shape [N].
         """
+        features = features.detach().to(self.pending)
+        labels = labels.view(-1).to(self.pending.device)
+        # the count of each class is accumulated in the last column
+        ones = features.new_ones(features.size(0), 1)
+        self.pending.index_add_(0, labels, torch.cat([features, ones], 1))
+        self.num_pending += 1
+        if self.num_pending < self.update_interval:
+            return
 
-        N, A = features.size()
-        C = self.class_num
-
-        NxCxA_Features = features.view(
-            N, 1, A
-        ).expand(
-            N, C, A
-        )
-
-        onehot = torch.zeros(N, C).cuda()
-        onehot.scatter_(1, labels.view(-1, 1), 1)
-        NxCxA_onehot = onehot.view(N, C, 1).expand(N, C, A)
-
-        features_by_sort = NxCxA_Features.mul(NxCxA_onehot)
-
-        Amount_CxA = NxCxA_onehot.sum(0)
-        Amount_CxA[Amount_CxA == 0] = 1
-
-        ave_CxA = features_by_sort.sum(0) / Amount_CxA
+        # one packed collective for the sums and counts of all classes
+        stats = self.pending
+        if torch.distributed.is_available() and \
+                torch.distributed.is_initialized():
+            torch.distributed.all_reduce(stats)
+        counts = stats[:, -1]
+        means = stats[:, :-1] / counts.clamp(min=1).unsqueeze(1)
+        for cls in torch.nonzero(counts > 0).view(-1).tolist():
+            self.MemoryBank[cls].append(means[cls].unsqueeze(0).clone())
+        self.pending.zero_()
+        self.num_pending = 0
 
-        # update memory bank
-        for cls in torch.unique(labels):
-            self.MemoryBank[cls].append(ave_CxA[cls].unsqueeze(0).detach())
+    def state_dict(self):
+        """The memory bank and the pending statistics of the estimator."""
+        return dict(
+            memory_bank=[torch.cat(list(bank)) for bank in self.MemoryBank],
+            pending=self.pending,
+            num_pending=self.num_pending)
 
+    def load_state_dict(self, state_dict):
+        self.MemoryBank = [
+            deque(
+                bank.to(self.device).split(1), maxlen=self.memory_length)
+            for bank in state_dict['memory_bank']
+        ]
+        self.pending = state_dict['pending'].to(self.device)
+        self.num_pending = state_dict['num_pending']
@@ -1,8 +1,10 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import torch
-from matplotlib import pyplot as plt
 from PIL import Image
 
 Cityscapes_palette = [
@@ -54,19 +56,105 @@ Cityscapes_palette = [
 ]
 
 
+def get_palette_lut(palette):
+    """Get a lookup table of RGB colors from a palette.
+
+    Args:
+        palette (list[int] | list[list[int]] | ndarray): Flat or (N, 3)
+            palette.
+
+    Returns:
+        ndarray: uint8 table with shape (max(N + 1, 256), 3), where labels
+            without a palette entry are black.
+    """
+    palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    lut = np.zeros((max(len(palette) + 1, 256), 3), dtype=np.uint8)
+    lut[:len(palette)] = palette
+    return lut
+
+
+def render_seg(seg, palette):
+    """Color a segmentation map by a gather from the palette lookup table.
+
+    Args:
+        seg (ndarray): Segmentation map with shape (H, W).
+        palette (list | ndarray): Flat or (N, 3) palette.
+
+    Returns:
+        ndarray: uint8 RGB image with shape (H, W, 3).
+    """
+    lut = get_palette_lut(palette)
+    seg = np.asarray(seg).astype(np.intp, copy=False)
+    return np.take(lut, seg, axis=0, mode='clip')
+
+
+def blend_seg(img, color_seg, opacity=0.5):
+    """Blend a colored segmentation map into a uint8 image in place.
+
+    The blending uses 8 bit fixed point weights instead of float images.
+
+    Args:
+        img (ndarray): uint8 image with shape (H, W, 3), which is updated.
+        color_seg (ndarray): uint8 colored segmentation map of the same
+            shape and channel order.
+        opacity (float): Opacity of the segmentation map in (0, 1].
+            Default: 0.5.
+
+    Returns:
+        ndarray: The blended ``img``.
+    """
+    weight = int(round(opacity * 256))
+    blended = np.multiply(img, 256 - weight, dtype=np.uint16)
+    blended += np.multiply(color_seg, weight, dtype=np.uint16)
+    np.right_shift(blended, 8, out=img, casting='unsafe')
+    return img
+
+
 def colorize_mask(mask, palette):
-    zero_pad = 256 * 3 - len(palette)
-    for i in range(zero_pad):
-        palette.append(0)
+    palette = list(palette) + [0] * (256 * 3 - len(palette))
     new_mask = Image.fromarray(mask.astype(np.uint8)).convert('P')
     new_mask.putpalette(palette)
     return new_mask
 
 
+class ImageWriterPool(object):
+    """Run rendering and writing jobs in background threads.
+
+    At most ``max_pending`` jobs are queued, so that the caller is
+    throttled instead of accumulating images in memory. Errors of the jobs
+    are raised by :meth:`submit` or :meth:`close`.
+
+    Args:
+        nproc (int): Number of writer threads. Default: 4.
+        max_pending (int, optional): Maximum number of queued jobs. Defaults
+            to ``2 * nproc``.
+    """
+
+    def __init__(self, nproc=4, max_pending=None):
+        self.executor = ThreadPoolExecutor(max(nproc, 1))
+        self.max_pending = max_pending or 2 * max(nproc, 1)
+        self.pending = deque()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)``."""
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(fn, *args, **kwargs))
+
+    def close(self):
+        """Wait for all queued jobs and stop the threads."""
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+
+
 def _colorize(img, cmap, mask_zero=False):
     vmin = np.min(img)
     vmax = np.max(img)
     mask = (img <= 0).squeeze()
+    from matplotlib import pyplot as plt
     cm = plt.get_cmap(cmap)
     colored_image = cm(np.clip(img.squeeze(), vmin, vmax) / vmax)[:, :, :3]
     # Use white if no depth is available (<= 0)
@@ -101,7 +189,7 @@ def subplotimg(ax,
             kwargs.pop('cmap')
             if torch.is_tensor(img):
                 img = img.numpy()
-            img = colorize_mask(img, palette)
+            img = render_seg(img, palette)
 
     if range_in_title:
         vmin = np.min(img)
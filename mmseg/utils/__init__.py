@@ -1,4 +1,8 @@
 from .collect_env import collect_env
+from .config_compiler import CompiledConfig, ConfigCompiler, load_config
 from .logger import get_root_logger
 
-__all__ = ['get_root_logger', 'collect_env']
+__all__ = [
+    'get_root_logger', 'collect_env', 'CompiledConfig', 'ConfigCompiler',
+    'load_config'
+]
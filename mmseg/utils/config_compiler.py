@@ -0,0 +1,246 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+import types
+
+from mmcv import Config
+from mmcv.utils import import_modules_from_strings
+
+BASE_KEY = '_base_'
+
+
+def _sha1(*parts):
+    sha1 = hashlib.sha1()
+    for part in parts:
+        sha1.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+    return sha1.hexdigest()
+
+
+class CompiledConfig(object):
+    """A config resolved with all its bases.
+
+    The resolved dict is kept pickled, so that the compiled config cannot
+    be modified and each :obj:`mmcv.Config` created from it is independent.
+
+    Args:
+        key (str): Hash of the config file and all its bases.
+        data (bytes): The pickled dict.
+        text (str): The text of the config and its bases as in
+            :meth:`mmcv.Config.fromfile`.
+        filename (str, optional): The config file. Default: None.
+    """
+
+    def __init__(self, key, data, text, filename=None):
+        self.key = key
+        self.data = data
+        self.text = text
+        self.filename = filename
+
+    def to_dict(self):
+        return pickle.loads(self.data)
+
+    def to_config(self):
+        return Config(
+            self.to_dict(), cfg_text=self.text, filename=self.filename)
+
+
+class ConfigCompiler(object):
+    """Resolve configs and their ``_base_`` trees with caching.
+
+    :meth:`mmcv.Config.fromfile` parses every base file again for each
+    config. The compiler parses each file once and keys it by the hash of
+    its path and content. The resolved tree of a file is keyed by the hashes
+    of the file and of all its bases, so that a modified file invalidates
+    exactly the configs that inherit from it. Both caches are kept in memory
+    and, if ``cache_dir`` is specified, on disk to be shared by processes.
+    The merging follows ``mmcv.Config._file2dict``.
+
+    Args:
+        cache_dir (str, optional): Directory of the disk cache.
+            Default: None.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._digests = {}
+        self._parsed = {}
+        self._compiled = {}
+
+    def _cache_file(self, prefix, key):
+        return osp.join(self.cache_dir, f'{prefix}_{key}.pkl')
+
+    def _load_cached(self, prefix, key):
+        if self.cache_dir is None:
+            return None
+        cache_file = self._cache_file(prefix, key)
+        if not osp.isfile(cache_file):
+            return None
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+
+    def _dump_cached(self, prefix, key, obj):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = self._cache_file(prefix, key)
+        # concurrent processes never read a partially written file
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    def _read(self, filename):
+        """Content and hash of a file, which is reread if its size or
+        modification time changed."""
+        stat = os.stat(filename)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = self._digests.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1], cached[2]
+        with open(filename, 'rb') as f:
+            content = f.read()
+        digest = _sha1(filename, content)
+        self._digests[filename] = (stamp, content, digest)
+        return content, digest
+
+    def _parse(self, filename):
+        """Parse a config file without resolving its bases.
+
+        Returns:
+            tuple: The hash of the file, its dict without ``_base_``, its
+                text and the paths of its bases.
+        """
+        content, digest = self._read(filename)
+        parsed = self._parsed.get(digest)
+        if parsed is None:
+            parsed = self._load_cached('file', digest)
+        if parsed is None:
+            parsed = self._parse_content(filename, content)
+            self._dump_cached('file', digest, parsed)
+        self._parsed[digest] = parsed
+        return (digest, ) + parsed
+
+    @staticmethod
+    def _parse_content(filename, content):
+        text = filename + '\n' + content.decode('utf-8')
+        if filename.endswith('.py') and b'{{' in content:
+            # predefined variables are substituted by mmcv, which also
+            # resolves the bases of this file
+            cfg_dict, text = Config._file2dict(filename)
+            return pickle.dumps(cfg_dict), text, []
+        if filename.endswith('.py'):
+            namespace = dict(__file__=filename, __name__='__config__')
+            exec(compile(content, filename, 'exec'), namespace)
+            cfg_dict = {
+                k: v
+                for k, v in namespace.items()
+                if not k.startswith('__') and not isinstance(
+                    v, (types.ModuleType, types.FunctionType))
+            }
+        elif filename.endswith('.json'):
+            cfg_dict = json.loads(content)
+        else:
+            # yaml and other formats are parsed by mmcv
+            cfg_dict, text = Config._file2dict(filename)
+            return pickle.dumps(cfg_dict), text, []
+        bases = cfg_dict.pop(BASE_KEY, [])
+        if not isinstance(bases, list):
+            bases = [bases]
+        cfg_dir = osp.dirname(filename)
+        bases = [osp.abspath(osp.join(cfg_dir, base)) for base in bases]
+        return pickle.dumps(cfg_dict), text, bases
+
+    def _merge(self, cfg_dict, text, bases):
+        """Merge a parsed dict into its compiled bases."""
+        base_dict = dict()
+        base_texts = []
+        for base in bases:
+            compiled = self.compile(base)
+            base_cfg = compiled.to_dict()
+            if len(base_dict.keys() & base_cfg.keys()) > 0:
+                raise KeyError('Duplicate key is not allowed among bases')
+            base_dict.update(base_cfg)
+            base_texts.append(compiled.text)
+        if bases:
+            cfg_dict = Config._merge_a_into_b(cfg_dict, base_dict)
+            text = '\n'.join(base_texts + [text])
+        return cfg_dict, text
+
+    def compile(self, filename):
+        """Compile a config file.
+
+        Args:
+            filename (str): Path of the config file.
+
+        Returns:
+            :obj:`CompiledConfig`: The config with all its bases.
+        """
+        filename = osp.abspath(osp.expanduser(filename))
+        digest, data, text, bases = self._parse(filename)
+        key = _sha1(digest, *[self.compile(base).key for base in bases])
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            cached = self._load_cached('tree', key)
+            if cached is not None:
+                compiled = CompiledConfig(key, *cached, filename=filename)
+            else:
+                cfg_dict, text = self._merge(pickle.loads(data), text, bases)
+                data = pickle.dumps(
+                    cfg_dict, protocol=pickle.HIGHEST_PROTOCOL)
+                compiled = CompiledConfig(key, data, text, filename)
+                self._dump_cached('tree', key, (data, text))
+            self._compiled[key] = compiled
+        return compiled
+
+    def compile_dict(self, cfg_dict, base_dir='configs'):
+        """Compile a config dict, e.g. from ``generate_experiment_cfgs``.
+
+        Args:
+            cfg_dict (dict): The config. Its ``_base_`` paths are relative to
+                ``base_dir``.
+            base_dir (str): Directory of the bases. Default: 'configs'.
+
+        Returns:
+            :obj:`mmcv.Config`: The config with all its bases.
+        """
+        cfg_dict = pickle.loads(pickle.dumps(cfg_dict))
+        bases = cfg_dict.pop(BASE_KEY, [])
+        if not isinstance(bases, list):
+            bases = [bases]
+        bases = [osp.abspath(osp.join(base_dir, base)) for base in bases]
+        text = json.dumps(cfg_dict, default=str)
+        cfg_dict, text = self._merge(cfg_dict, text, bases)
+        return Config(cfg_dict, cfg_text=text)
+
+
+_compilers = {}
+
+
+def load_config(filename, cache_dir=None):
+    """Drop-in replacement of :meth:`mmcv.Config.fromfile` that compiles
+    the config with a :obj:`ConfigCompiler` shared by the process.
+
+    Args:
+        filename (str): Path of the config file.
+        cache_dir (str, optional): Directory of the disk cache.
+            Default: None.
+
+    Returns:
+        :obj:`mmcv.Config`: The config.
+    """
+    if cache_dir not in _compilers:
+        _compilers[cache_dir] = ConfigCompiler(cache_dir)
+    cfg = _compilers[cache_dir].compile(filename).to_config()
+    if cfg.get('custom_imports', None):
+        import_modules_from_strings(**cfg['custom_imports'])
+    return cfg
@@ -7,13 +7,17 @@ import argparse
 import json
 import os
 import subprocess
+import time
 import uuid
 from datetime import datetime
 
 import torch
 from experiments import generate_experiment_cfgs
-from mmcv import Config, get_git_hash
+from mmcv import get_git_hash
 from tools import train
+from tools.job_scheduler import JobQueue, JobScheduler
+
+from mmseg.utils import ConfigCompiler, load_config
 
 
 def run_command(command):
@@ -23,6 +27,23 @@ def run_command(command):
         print(line.decode('utf-8'), end='')
 
 
+def dry_run(config, exp, cache_dir):
+    """Resolve the configs without generating or running them."""
+    start_time = time.perf_counter()
+    if config is not None:
+        cfgs = [load_config(config, cache_dir)]
+    else:
+        compiler = ConfigCompiler(cache_dir)
+        cfgs = [
+            compiler.compile_dict(cfg)
+            for cfg in generate_experiment_cfgs(exp)
+        ]
+    for cfg in cfgs:
+        print(cfg['name'])
+    print(f'Resolved {len(cfgs)} configs in '
+          f'{time.perf_counter() - start_time:.3f}s')
+
+
 def rsync(src, dst):
     rsync_cmd = f'rsync -a {src} {dst}'
     print(rsync_cmd)
@@ -46,17 +67,30 @@ if __name__ == '__main__':
     parser.add_argument(
         '--machine', type=str, choices=['local'], default='local')
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument(
+        '--schedule',
+        action='store_true',
+        help='Run the jobs concurrently with tools/job_scheduler.py')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only resolve the configs of the experiment or config')
     args = parser.parse_args()
     assert (args.config is None) != (args.exp is None), \
         'Either config or exp has to be defined.'
 
     GEN_CONFIG_DIR = 'configs/generated/'
     JOB_DIR = 'jobs'
+    CONFIG_CACHE_DIR = os.path.join(JOB_DIR, 'cache', 'configs')
+    if args.dry_run:
+        dry_run(args.config, args.exp, CONFIG_CACHE_DIR)
+        raise SystemExit(0)
     cfgs, config_files = [], []
+    git_rev = get_git_hash()
 
     # Training with Predefined Config
     if args.config is not None:
-        cfg = Config.fromfile(args.config)
+        cfg = load_config(args.config, CONFIG_CACHE_DIR)
         # Specify Name and Work Directory
         exp_name = f'{args.machine}-{cfg["exp"]}'
         unique_name = f'{datetime.now().strftime("%y%m%d_%H%M")}_' \
@@ -65,7 +99,7 @@ if __name__ == '__main__':
             '_base_': args.config.replace('configs', '../..'),
             'name': unique_name,
             'work_dir': os.path.join('work_dirs', exp_name, unique_name),
-            'git_rev': get_git_hash()
+            'git_rev': git_rev
         }
         cfg_out_file = f"{GEN_CONFIG_DIR}/{exp_name}/{child_cfg['name']}.json"
         os.makedirs(os.path.dirname(cfg_out_file), exist_ok=True)
@@ -91,7 +125,7 @@ if __name__ == '__main__':
             cfg['name'] = f'{datetime.now().strftime("%y%m%d_%H%M")}_' \
                           f'{cfg["name"]}_{str(uuid.uuid4())[:5]}'
             cfg['work_dir'] = os.path.join('work_dirs', exp_name, cfg['name'])
-            cfg['git_rev'] = get_git_hash()
+            cfg['git_rev'] = git_rev
             cfg['_base_'] = ['../../' + e for e in cfg['_base_']]
             cfg_out_file = f"{GEN_CONFIG_DIR}/{exp_name}/{cfg['name']}.json"
             os.makedirs(os.path.dirname(cfg_out_file), exist_ok=True)
@@ -100,7 +134,19 @@ if __name__ == '__main__':
                 json.dump(cfg, of, indent=4)
             config_files.append(cfg_out_file)
 
-    if args.machine == 'local':
+    if args.schedule:
+        queue = JobQueue(JOB_DIR)
+        with queue.update():
+            for config_file in config_files:
+                queue.add(config_file)
+        try:
+            queue.lock()
+        except RuntimeError:
+            print(f'Added {len(config_files)} jobs to the scheduler '
+                  f'running on {JOB_DIR}')
+        else:
+            JobScheduler(queue).run()
+    elif args.machine == 'local':
         for i, cfg in enumerate(cfgs):
             print('Run job {}'.format(cfg['name']))
             train.main([config_files[i]])
@@ -0,0 +1,87 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Compare the resolution of the generated configs of an experiment with
+# mmcv.Config.fromfile, which parses all bases of every config, and with
+# the ConfigCompiler with an empty and a warm disk cache. The configs are
+# repeated to simulate large sweeps.
+# Run: python -m tools.benchmark_config --exp 1 --repeat 20
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from experiments import generate_experiment_cfgs
+from mmcv import Config
+from prettytable import PrettyTable
+
+from mmseg.utils import ConfigCompiler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the resolution of experiment configs')
+    parser.add_argument('--exp', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    start_time = time.perf_counter()
+    cfgs = generate_experiment_cfgs(args.exp) * args.repeat
+    generate_time = time.perf_counter() - start_time
+
+    tmp_dir = tempfile.mkdtemp(dir='configs')
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # mmcv needs files, which are written before the measurement
+        files = []
+        for i, cfg in enumerate(cfgs):
+            cfg = dict(cfg, _base_=['../' + e for e in cfg['_base_']])
+            files.append(os.path.join(tmp_dir, f'{i}.json'))
+            with open(files[-1], 'w') as f:
+                json.dump(cfg, f)
+        start_time = time.perf_counter()
+        mmcv_cfgs = [Config.fromfile(f) for f in files]
+        mmcv_time = time.perf_counter() - start_time
+
+        times = {}
+        for name in ['compiler (cold)', 'compiler (warm)']:
+            compiler = ConfigCompiler(cache_dir)
+            start_time = time.perf_counter()
+            compiled = [compiler.compile_dict(cfg) for cfg in cfgs]
+            times[name] = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(tmp_dir)
+        shutil.rmtree(cache_dir)
+    identical = all(a._cfg_dict == b._cfg_dict
+                    for a, b in zip(mmcv_cfgs, compiled))
+
+    table = PrettyTable()
+    table.field_names = ['resolution', 'configs', 'total s', 'ms / config']
+    table.add_row([
+        'generate_experiment_cfgs',
+        len(cfgs), f'{generate_time:.3f}',
+        f'{generate_time / len(cfgs) * 1000:.3f}'
+    ])
+    table.add_row([
+        'Config.fromfile',
+        len(cfgs), f'{mmcv_time:.3f}', f'{mmcv_time / len(cfgs) * 1000:.3f}'
+    ])
+    for name, elapsed in times.items():
+        table.add_row([
+            name,
+            len(cfgs), f'{elapsed:.3f}', f'{elapsed / len(cfgs) * 1000:.3f}'
+        ])
+    print(table)
+    print(f'identical to Config.fromfile: {identical}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Measure the weak scaling efficiency of StudentDistributedDataParallel on
+# 1 to N CPU processes with the gloo backend. Each process trains a small
+# UDA-like model with a frozen teacher and ImageNet model and several
+# backward passes per step, as DACS does. Before the benchmark, the
+# averaged gradients of the first step are compared with the gradients of
+# a single process on the batches of all ranks. The check fails if they
+# differ by more than the tolerance. Only the gradient check runs as a
+# pre-commit hook on changes of the DDP wrapper.
+# Run: python -m tools.benchmark_ddp_scaling --max-procs 4 --steps 20
+#      python -m tools.benchmark_ddp_scaling --max-procs 2 --check-only
+
+import argparse
+import copy
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+from prettytable import PrettyTable
+
+from mmseg.core.ddp_wrapper import StudentDistributedDataParallel
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scaling of the student DDP wrapper')
+    parser.add_argument('--max-procs', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument(
+        '--threads', type=int, default=1, help='threads of each process')
+    parser.add_argument('--port', type=int, default=29512)
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1e-5,
+        help='maximum difference of the gradients to a single process')
+    parser.add_argument(
+        '--check-only',
+        action='store_true',
+        help='only compare the gradients without the benchmark')
+    return parser.parse_args()
+
+
+def _conv_net(width, num_classes=19):
+    return nn.Sequential(
+        nn.Conv2d(3, width, 3, padding=1), nn.ReLU(),
+        nn.Conv2d(width, width, 3, padding=1), nn.ReLU(),
+        nn.Conv2d(width, num_classes, 1))
+
+
+class ToyUDA(nn.Module):
+    """Student with a frozen teacher and ImageNet model.
+
+    A step has three backward passes, two of which share the graph of the
+    source forward pass, as the source, feature distance and target losses
+    of DACS.
+    """
+
+    def __init__(self, width):
+        super().__init__()
+        self.model = _conv_net(width)
+        self.teacher = _conv_net(width).requires_grad_(False)
+        self.imnet_model = _conv_net(width).requires_grad_(False)
+
+    def get_model(self):
+        return self.model
+
+    def forward(self, img, target_img, gt):
+        src_logits = self.model(img)
+        F.cross_entropy(src_logits, gt).backward(retain_graph=True)
+        with torch.no_grad():
+            imnet_logits = self.imnet_model(img)
+        (0.1 * F.mse_loss(src_logits, imnet_logits)).backward()
+        with torch.no_grad():
+            pseudo_label = self.teacher(target_img).argmax(1)
+        F.cross_entropy(self.model(target_img), pseudo_label).backward()
+
+    def train_step(self, data_batch, optimizer, reduce_grads=None):
+        optimizer.zero_grad()
+        self(**data_batch)
+        if reduce_grads is not None:
+            reduce_grads()
+        optimizer.step()
+        return dict(num_samples=len(data_batch['img']))
+
+
+def make_batch(args, step, rank):
+    generator = torch.Generator().manual_seed(step * 1000 + rank)
+    shape = (args.batch_size, 3, args.size, args.size)
+    return dict(
+        img=torch.randn(shape, generator=generator),
+        target_img=torch.randn(shape, generator=generator),
+        gt=torch.randint(
+            0, 19, (args.batch_size, args.size, args.size),
+            generator=generator))
+
+
+def check_grads(args, wrapped, reference, world_size):
+    """Maximum difference of the averaged gradients to a single process."""
+    rank = dist.get_rank()
+    optimizer = torch.optim.SGD(wrapped.module.parameters(), lr=0)
+    optimizer.zero_grad()
+    wrapped.module(**make_batch(args, 0, rank))
+    wrapped.reduce_grads()
+    reference.zero_grad()
+    for r in range(world_size):
+        reference(**make_batch(args, 0, r))
+    max_diff = 0.
+    for p, p_ref in zip(wrapped.module.get_model().parameters(),
+                        reference.get_model().parameters()):
+        max_diff = max(max_diff,
+                       (p.grad - p_ref.grad / world_size).abs().max().item())
+    return max_diff
+
+
+def worker(rank, world_size, args, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(args.port + world_size)
+    torch.set_num_threads(args.threads)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.manual_seed(rank)
+    model = ToyUDA(args.width)
+    wrapped = StudentDistributedDataParallel(model, device_ids=None)
+    # the weights of rank 0 are replicated to all ranks
+    reference = copy.deepcopy(model)
+    max_diff = check_grads(args, wrapped, reference, world_size)
+    if args.check_only:
+        if rank == 0:
+            results[world_size] = (None, max_diff)
+        dist.destroy_process_group()
+        return
+
+    optimizer = torch.optim.SGD(model.get_model().parameters(), lr=0.01)
+    wrapped.train_step(make_batch(args, 1, rank), optimizer)
+    dist.barrier()
+    start_time = time.perf_counter()
+    for step in range(args.steps):
+        wrapped.train_step(make_batch(args, step + 2, rank), optimizer)
+    dist.barrier()
+    elapsed = time.perf_counter() - start_time
+    if rank == 0:
+        results[world_size] = (elapsed, max_diff)
+    dist.destroy_process_group()
+
+
+def main():
+    args = parse_args()
+    manager = mp.Manager()
+    results = manager.dict()
+    for world_size in range(1, args.max_procs + 1):
+        mp.spawn(
+            worker, args=(world_size, args, results), nprocs=world_size)
+
+    failed = False
+    table = PrettyTable()
+    table.field_names = [
+        'procs', 'images / s', 'efficiency', 'max grad diff', 'ok'
+    ]
+    base_throughput = None
+    for world_size in sorted(results.keys()):
+        elapsed, max_diff = results[world_size]
+        ok = max_diff <= args.tolerance
+        failed |= not ok
+        throughput = efficiency = '-'
+        if elapsed is not None:
+            images_per_s = world_size * args.batch_size * args.steps / elapsed
+            if base_throughput is None:
+                base_throughput = images_per_s
+            throughput = f'{images_per_s:.2f}'
+            efficiency = f'{images_per_s / (world_size * base_throughput):.1%}'
+        table.add_row([
+            world_size, throughput, efficiency, f'{max_diff:.2e}',
+            'yes' if ok else 'NO'
+        ])
+    print(table)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
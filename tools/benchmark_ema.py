@@ -0,0 +1,91 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Compare the update time of the former per-parameter EMA loop of DACS with
+# the flat buffer EMATeacher on a DAFormer MiT-B5 segmentor.
+# Run: python -m tools.benchmark_ema --repeats 50
+
+import argparse
+import time
+
+import torch
+from mmcv import Config
+from prettytable import PrettyTable
+
+from mmseg.models import build_segmentor
+from mmseg.models.utils.ema_teacher import EMATeacher
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the EMA teacher update')
+    parser.add_argument(
+        '--config',
+        default='configs/_base_/models/daformer_sepaspp_mitb5.py',
+        help='model config')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--device', default=None)
+    return parser.parse_args()
+
+
+def legacy_update_ema(ema_model, model, it, alpha):
+    alpha_teacher = min(1 - 1 / (it + 1), alpha)
+    for ema_param, param in zip(ema_model.parameters(), model.parameters()):
+        if not param.data.shape:  # scalar tensor
+            ema_param.data = \
+                alpha_teacher * ema_param.data + \
+                (1 - alpha_teacher) * param.data
+        else:
+            ema_param.data[:] = \
+                alpha_teacher * ema_param[:].data[:] + \
+                (1 - alpha_teacher) * param[:].data[:]
+
+
+def measure(fn, repeats, device):
+    fn(1)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for it in range(2, repeats + 2):
+        fn(it)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device or (
+        'cuda' if torch.cuda.is_available() else 'cpu'))
+    cfg = Config.fromfile(args.config)
+    cfg.model.pretrained = None
+    cfg.model.backbone.pop('init_cfg', None)
+    model = build_segmentor(cfg.model).to(device)
+    num_params = sum(p.numel() for p in model.parameters())
+
+    legacy_teacher = build_segmentor(cfg.model).to(device)
+    legacy_teacher.requires_grad_(False)
+    teacher = EMATeacher(model, alpha=0.999).to(device)
+    interval_teacher = EMATeacher(
+        model, alpha=0.999, update_interval=4).to(device)
+
+    runs = [
+        ('per-parameter loop',
+         lambda it: legacy_update_ema(legacy_teacher, model, it, 0.999)),
+        ('flat buffer foreach', lambda it: teacher.update(model, it)),
+        ('flat buffer foreach, interval 4',
+         lambda it: interval_teacher.update(model, it)),
+    ]
+    table = PrettyTable()
+    table.field_names = ['update', 'ms / step']
+    for name, fn in runs:
+        table.add_row(
+            [name, f'{measure(fn, args.repeats, device) * 1000:.3f}'])
+    print(f'{num_params / 1e6:.1f}M parameters on {device}')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
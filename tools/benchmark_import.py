@@ -0,0 +1,126 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Measure the import time of mmseg packages with `python -X importtime` in
+# fresh interpreters and list the slowest imported modules. The check fails
+# if the median import time of a package exceeds its budget or if it imports
+# one of the deferred dependencies, which are only needed by some models.
+# The budgets include torch and mmcv and leave room for slower machines. The
+# check runs as a pre-commit hook on changes of mmseg.
+# Run: python -m tools.benchmark_import
+#      python -m tools.benchmark_import mmseg.apis --budget 3000 --repeat 5
+
+import argparse
+import re
+import subprocess
+import sys
+
+import numpy as np
+from prettytable import PrettyTable
+
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+# import time budgets in ms
+BUDGETS = {
+    'mmseg': 1500,
+    'mmseg.models': 2500,
+    'mmseg.datasets': 2500,
+    'mmseg.apis': 3500,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the import time of mmseg packages')
+    parser.add_argument(
+        'modules',
+        nargs='*',
+        default=list(BUDGETS),
+        help='imported modules')
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=None,
+        help='maximum import time of each module in ms, which overrides '
+        'the default budgets')
+    parser.add_argument(
+        '--deferred',
+        nargs='*',
+        default=['matplotlib', 'kornia', 'timm'],
+        help='packages that must not be imported')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    if args.budget is None and not set(args.modules) <= set(BUDGETS):
+        parser.error('--budget is required for modules without a default '
+                     'budget')
+    return args
+
+
+def import_times(module):
+    """Run ``import module`` in a new interpreter.
+
+    Returns:
+        tuple[float, dict]: The total import time and the cumulative import
+            time of each imported module in ms.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr}')
+    total, times = 0., {}
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match is None:
+            continue
+        name, cumulative = match.group(4), int(match.group(2)) / 1000
+        times[name] = cumulative
+        # the module and its parent packages, not the startup imports
+        if not match.group(3) and (module == name
+                                   or module.startswith(name + '.')):
+            total += cumulative
+    return total, times
+
+
+def main():
+    args = parse_args()
+    failed = False
+    summary = PrettyTable()
+    summary.field_names = [
+        'module', 'median ms', 'min ms', 'budget ms', 'deferred', 'ok'
+    ]
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        totals = [total for total, _ in runs]
+        # the last run has warm file caches like most real imports
+        times = runs[-1][1]
+        deferred = sorted({name.split('.')[0]
+                           for name in times} & set(args.deferred))
+        budget = args.budget or BUDGETS[module]
+        over_budget = np.median(totals) > budget
+        ok = not over_budget and not deferred
+        failed |= not ok
+        summary.add_row([
+            module, f'{np.median(totals):.1f}', f'{min(totals):.1f}',
+            f'{budget:.0f}', ', '.join(deferred) or '-', 'yes' if ok else 'NO'
+        ])
+
+        table = PrettyTable()
+        table.field_names = ['imported by ' + module, 'cumulative ms']
+        table.align['imported by ' + module] = 'l'
+        slowest = sorted(times.items(), key=lambda kv: -kv[1])
+        for name, cumulative in slowest[:args.top]:
+            table.add_row([name, f'{cumulative:.1f}'])
+        print(table)
+    print(summary)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
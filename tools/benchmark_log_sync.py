@@ -0,0 +1,186 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Count the all-reduce calls and host synchronizations per training step
+# caused by the log variables of a DACS step (source, feature distance,
+# mixed, contrastive and KL losses) for the former per-entry reduction, the
+# coalesced reduction at the end of the step and the reduction on logging
+# iterations by LogVarsReduceHook. The host synchronizations are counted
+# with the CUDA sync debug mode and are only reported on a GPU.
+# Run: python -m tools.benchmark_log_sync --steps 200 --log-interval 50
+
+import argparse
+import os
+import time
+import warnings
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import torch
+import torch.distributed as dist
+from mmcv.runner import LogBuffer
+from prettytable import PrettyTable
+
+from mmseg.core import LogVarsReduceHook, reduce_log_vars
+from mmseg.models.segmentors.base import BaseSegmentor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Count the synchronizations of the log variables')
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--log-interval', type=int, default=50)
+    parser.add_argument('--port', type=int, default=29511)
+    return parser.parse_args()
+
+
+def legacy_parse_losses(losses):
+    log_vars = OrderedDict()
+    for loss_name, loss_value in losses.items():
+        log_vars[loss_name] = loss_value.mean()
+    loss = sum(_value for _key, _value in log_vars.items()
+               if 'loss' in _key)
+    log_vars['loss'] = loss
+    for loss_name, loss_value in log_vars.items():
+        if dist.is_available() and dist.is_initialized():
+            loss_value = loss_value.data.clone()
+            dist.all_reduce(loss_value.div_(dist.get_world_size()))
+        log_vars[loss_name] = loss_value.item()
+    return loss, log_vars
+
+
+def step_losses(device):
+    """Loss dicts of the ``_parse_losses`` calls of one DACS step."""
+
+    def _rand():
+        return torch.rand((), device=device)
+
+    return [
+        {
+            'decode.loss_seg': _rand(),
+            'decode.acc_seg': _rand()
+        },
+        {
+            'loss_imnet_feat_dist': _rand()
+        },
+        {
+            'mix.decode.loss_seg': _rand(),
+            'mix.decode.acc_seg': _rand()
+        },
+        {
+            'contrastive loss': _rand()
+        },
+        {
+            'KL_div_loss_trg': _rand()
+        },
+    ]
+
+
+def legacy_step(device, pseudo_label):
+    log_vars = {}
+    for losses in step_losses(device):
+        log_vars.update(legacy_parse_losses(losses)[1])
+    # former computation of the pseudo weight
+    pseudo_label.cpu()
+    torch.rand((), device=device).item()
+    log_vars.pop('loss', None)
+    return log_vars
+
+
+def coalesced_step(device, pseudo_label, reduce=True):
+    log_vars = {}
+    for losses in step_losses(device):
+        log_vars.update(BaseSegmentor._parse_losses(losses, reduce=False)[1])
+    log_vars.pop('loss', None)
+    if reduce:
+        reduce_log_vars(log_vars)
+    return log_vars
+
+
+class SyncCounter(object):
+    """Count the all-reduce calls and host synchronizations in a block."""
+
+    def __init__(self, device):
+        self.device = device
+        self.all_reduce = 0
+        self.host_syncs = 0
+
+    def __enter__(self):
+        self._all_reduce = dist.all_reduce
+
+        def _counted(*args, **kwargs):
+            self.all_reduce += 1
+            return self._all_reduce(*args, **kwargs)
+
+        dist.all_reduce = _counted
+        self._warnings = warnings.catch_warnings(record=True)
+        self._records = self._warnings.__enter__()
+        warnings.simplefilter('always')
+        if self.device.type == 'cuda':
+            torch.cuda.set_sync_debug_mode('warn')
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.set_sync_debug_mode('default')
+        self.time = time.perf_counter() - self.start_time
+        dist.all_reduce = self._all_reduce
+        self.host_syncs = sum('synchroniz' in str(record.message)
+                              for record in self._records)
+        self._warnings.__exit__(*args)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(args.port))
+    if torch.cuda.is_available():
+        device = torch.device('cuda', 0)
+        dist.init_process_group('nccl', rank=0, world_size=1)
+    else:
+        device = torch.device('cpu')
+        dist.init_process_group('gloo', rank=0, world_size=1)
+    pseudo_label = torch.zeros((2, 512, 512), dtype=torch.long, device=device)
+
+    runs = OrderedDict()
+    for name in ['legacy', 'coalesced', 'deferred']:
+        log_buffer = LogBuffer()
+        runner = SimpleNamespace(log_buffer=log_buffer)
+        hook = LogVarsReduceHook(args.log_interval)
+        # warm up the kernels and the process group
+        coalesced_step(device, pseudo_label)
+        with SyncCounter(device) as counter:
+            for i in range(args.steps):
+                if name == 'legacy':
+                    log_vars = legacy_step(device, pseudo_label)
+                else:
+                    log_vars = coalesced_step(
+                        device, pseudo_label, reduce=name == 'coalesced')
+                log_buffer.update(log_vars)
+                if (i + 1) % args.log_interval == 0:
+                    hook.reduce(runner)
+                    log_buffer.average(args.log_interval)
+        runs[name] = counter
+
+    table = PrettyTable()
+    table.field_names = [
+        'reduction', 'all-reduce / step', 'host syncs / step', 'ms / step'
+    ]
+    for name, counter in runs.items():
+        host_syncs = 'n/a'
+        if device.type == 'cuda':
+            host_syncs = f'{counter.host_syncs / args.steps:.2f}'
+        table.add_row([
+            name, f'{counter.all_reduce / args.steps:.2f}', host_syncs,
+            f'{counter.time / args.steps * 1000:.3f}'
+        ])
+    print(table)
+    dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    main()
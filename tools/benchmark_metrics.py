@@ -0,0 +1,109 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Compare the former masked histc implementation of intersect_and_union
+# with the single bincount kernel on random Cityscapes-sized maps.
+# Run: python -m tools.benchmark_metrics --repeats 10
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from prettytable import PrettyTable
+
+from mmseg.core.evaluation.metrics import intersect_and_union
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the intersect_and_union kernel')
+    parser.add_argument(
+        '--shape',
+        type=int,
+        nargs=2,
+        default=[1024, 2048],
+        help='height and width of the segmentation maps')
+    parser.add_argument('--num-classes', type=int, default=19)
+    parser.add_argument('--repeats', type=int, default=10)
+    return parser.parse_args()
+
+
+def legacy_intersect_and_union(pred_label,
+                               label,
+                               num_classes,
+                               ignore_index,
+                               label_map=dict(),
+                               reduce_zero_label=False):
+    pred_label = torch.from_numpy(pred_label)
+    label = torch.from_numpy(label.copy())
+    if label_map is not None:
+        for old_id, new_id in label_map.items():
+            label[label == old_id] = new_id
+    if reduce_zero_label:
+        label[label == 0] = 255
+        label = label - 1
+        label[label == 254] = 255
+    mask = (label != ignore_index)
+    pred_label = pred_label[mask]
+    label = label[mask]
+    intersect = pred_label[pred_label == label]
+    area_intersect = torch.histc(
+        intersect.float(), bins=(num_classes), min=0, max=num_classes - 1)
+    area_pred_label = torch.histc(
+        pred_label.float(), bins=(num_classes), min=0, max=num_classes - 1)
+    area_label = torch.histc(
+        label.float(), bins=(num_classes), min=0, max=num_classes - 1)
+    area_union = area_pred_label + area_label - area_intersect
+    return area_intersect, area_union, area_pred_label, area_label
+
+
+def measure(fn, repeats, *args):
+    fn(*args)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        out = fn(*args)
+    return (time.perf_counter() - start_time) / repeats, out
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(0)
+    num_classes = args.num_classes
+    pred = rng.randint(0, num_classes, args.shape).astype(np.int64)
+    # labels outside of the classes and the ignore index are included
+    label = rng.randint(0, num_classes + 3, args.shape).astype(np.uint8)
+    label[rng.rand(*args.shape) < 0.1] = 255
+    settings = [
+        ('plain', dict()),
+        ('label_map', dict(label_map={1: 3, 5: 255})),
+        ('reduce_zero_label', dict(reduce_zero_label=True)),
+    ]
+
+    table = PrettyTable()
+    table.field_names = ['Setting', 'Legacy [ms]', 'Bincount [ms]', 'Speedup',
+                         'Identical']
+    for name, kwargs in settings:
+        legacy_time, legacy_out = measure(legacy_intersect_and_union,
+                                          args.repeats, pred, label,
+                                          num_classes, 255,
+                                          kwargs.get('label_map', dict()),
+                                          kwargs.get('reduce_zero_label',
+                                                     False))
+        new_time, new_out = measure(intersect_and_union, args.repeats, pred,
+                                    label, num_classes, 255,
+                                    kwargs.get('label_map', dict()),
+                                    kwargs.get('reduce_zero_label', False))
+        identical = all(torch.equal(a, b) for a, b in zip(legacy_out,
+                                                          new_out))
+        table.add_row([
+            name, f'{legacy_time * 1000:.1f}', f'{new_time * 1000:.1f}',
+            f'{legacy_time / new_time:.1f}x', identical
+        ])
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
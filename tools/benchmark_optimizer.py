@@ -0,0 +1,136 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Measure the optimizer step time of AdamW and FlatAdamW with the paramwise
+# config of DAFormer (head lr_mult 10, norm and pos_block decay_mult 0) on
+# the CPU and, if available, the GPU. Both optimizers see the same random
+# gradients. The maximum parameter difference to AdamW is reported and the
+# state_dict of FlatAdamW is loaded into AdamW to check the compatibility.
+# Run: python -m tools.benchmark_optimizer --steps 20
+#      python -m tools.benchmark_optimizer --devices cuda --steps 100
+
+import argparse
+import copy
+import time
+
+import torch
+from mmcv import Config
+from mmcv.runner import build_optimizer
+from prettytable import PrettyTable
+
+from mmseg.core import FlatAdamW  # noqa: F401
+from mmseg.models import build_segmentor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the optimizer step of AdamW and FlatAdamW')
+    parser.add_argument(
+        '--config',
+        default='configs/_base_/models/daformer_sepaspp_mitb5.py',
+        help='model config')
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument(
+        '--devices',
+        nargs='+',
+        default=['cpu', 'cuda'],
+        help='devices, unavailable ones are skipped')
+    return parser.parse_args()
+
+
+def optimizer_cfg(opt_type):
+    return dict(
+        type=opt_type,
+        lr=6e-05,
+        betas=(0.9, 0.999),
+        weight_decay=0.01,
+        paramwise_cfg=dict(
+            custom_keys=dict(
+                head=dict(lr_mult=10.0),
+                pos_block=dict(decay_mult=0.0),
+                norm=dict(decay_mult=0.0))))
+
+
+def set_grads(model, step):
+    generator = torch.Generator().manual_seed(step)
+    for p in model.parameters():
+        p.grad = torch.randn(p.shape, generator=generator).to(p.device)
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def run(model, opt_type, args, device):
+    model = copy.deepcopy(model)
+    optimizer = build_optimizer(model, optimizer_cfg(opt_type))
+    elapsed = 0.
+    for step in range(args.warmup + args.steps):
+        set_grads(model, step)
+        synchronize(device)
+        start_time = time.perf_counter()
+        optimizer.step()
+        synchronize(device)
+        if step >= args.warmup:
+            elapsed += time.perf_counter() - start_time
+    return model, optimizer, elapsed / args.steps
+
+
+def max_diff(tensors, others):
+    return max((a.float() - b.float()).abs().max().item()
+               for a, b in zip(tensors, others))
+
+
+def main():
+    args = parse_args()
+    cfg = Config.fromfile(args.config)
+    cfg.model.pretrained = None
+    base_model = build_segmentor(cfg.model)
+
+    table = PrettyTable()
+    table.field_names = [
+        'device', 'optimizer', 'param groups', 'ms / step', 'speedup',
+        'max param diff', 'state_dict to AdamW'
+    ]
+    for name in args.devices:
+        if name == 'cuda' and not torch.cuda.is_available():
+            continue
+        device = torch.device(name)
+        model = copy.deepcopy(base_model).to(device)
+        ref_model, ref_optimizer, ref_time = run(model, 'AdamW', args,
+                                                 device)
+        flat_model, flat_optimizer, flat_time = run(model, 'FlatAdamW',
+                                                    args, device)
+
+        # checkpoints of FlatAdamW can be loaded by AdamW
+        loaded = build_optimizer(ref_model, optimizer_cfg('AdamW'))
+        loaded.load_state_dict(flat_optimizer.state_dict())
+        moments = [
+            loaded.state[p]['exp_avg'] for p in ref_model.parameters()
+        ]
+        ref_moments = [
+            ref_optimizer.state[p]['exp_avg'] for p in ref_model.parameters()
+        ]
+        moment_diff = max_diff(moments, ref_moments)
+
+        param_diff = max_diff(
+            list(flat_model.parameters()), list(ref_model.parameters()))
+        num_groups = len(ref_optimizer.param_groups)
+        table.add_row([
+            name, 'AdamW', num_groups, f'{ref_time * 1000:.2f}', '1.00',
+            '-', '-'
+        ])
+        table.add_row([
+            name, 'FlatAdamW', num_groups, f'{flat_time * 1000:.2f}',
+            f'{ref_time / flat_time:.2f}', f'{param_diff:.2e}',
+            f'exp_avg diff {moment_diff:.2e}'
+        ])
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
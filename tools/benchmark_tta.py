@@ -0,0 +1,117 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Compare throughput and mIoU of the sequential and the batched multi-scale
+# flip test-time augmentation.
+# Run: python -m tools.benchmark_tta CONFIG CHECKPOINT --num-images 100
+
+import argparse
+import time
+
+import mmcv
+import numpy as np
+import torch
+from mmcv.parallel import MMDataParallel
+from prettytable import PrettyTable
+from torch.utils.data import Subset
+
+from mmseg.apis import init_segmentor, single_gpu_test
+from mmseg.core import eval_metrics
+from mmseg.datasets import build_dataloader, build_dataset
+from tools.test import update_legacy_cfg
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark multi-scale flip test-time augmentation')
+    parser.add_argument('config', help='test config file path')
+    parser.add_argument('checkpoint', help='checkpoint file')
+    parser.add_argument(
+        '--num-images',
+        type=int,
+        default=None,
+        help='number of test images (default: all)')
+    parser.add_argument(
+        '--acc-scale',
+        type=float,
+        default=0.5,
+        help='accumulation resolution of the batched TTA relative to the '
+        'original image')
+    parser.add_argument(
+        '--early-exit-thr',
+        type=float,
+        default=None,
+        help='confidence threshold for the early exit of the batched TTA')
+    parser.add_argument(
+        '--early-exit-ratio',
+        type=float,
+        default=1.0,
+        help='ratio of confident pixels required for the early exit')
+    return parser.parse_args()
+
+
+def run(model, data_loader, dataset, gt_seg_maps):
+    torch.cuda.synchronize()
+    start_time = time.time()
+    results = single_gpu_test(model, data_loader)
+    torch.cuda.synchronize()
+    elapsed = time.time() - start_time
+    ret_metrics = eval_metrics(
+        results,
+        gt_seg_maps,
+        len(dataset.CLASSES),
+        dataset.ignore_index,
+        'mIoU',
+        label_map=dataset.label_map,
+        reduce_zero_label=dataset.reduce_zero_label)
+    return len(results) / elapsed, np.nanmean(ret_metrics['IoU']) * 100
+
+
+def main():
+    args = parse_args()
+
+    cfg = mmcv.Config.fromfile(args.config)
+    cfg = update_legacy_cfg(cfg)
+    cfg.data.test.pipeline[1].img_ratios = [0.5, 0.75, 1.0, 1.25, 1.5, 1.75]
+    cfg.data.test.pipeline[1].flip = True
+    cfg.data.test.test_mode = True
+
+    dataset = build_dataset(cfg.data.test)
+    gt_seg_maps = dataset.get_gt_seg_maps()
+    test_set = dataset
+    if args.num_images is not None:
+        test_set = Subset(dataset, range(args.num_images))
+        gt_seg_maps = gt_seg_maps[:args.num_images]
+    data_loader = build_dataloader(
+        test_set,
+        samples_per_gpu=1,
+        workers_per_gpu=cfg.data.workers_per_gpu,
+        dist=False,
+        shuffle=False)
+
+    model = init_segmentor(
+        cfg,
+        args.checkpoint,
+        revise_checkpoint=[(r'^module\.', ''), ('model.', '')])
+    model = MMDataParallel(model, device_ids=[0])
+
+    table = PrettyTable(['TTA', 'img/s', 'mIoU'])
+    tta_modes = [
+        ('sequential', None),
+        ('batched',
+         dict(
+             acc_scale=args.acc_scale,
+             early_exit_thr=args.early_exit_thr,
+             early_exit_ratio=args.early_exit_ratio)),
+    ]
+    for name, tta_cfg in tta_modes:
+        model.module.test_cfg.tta = tta_cfg
+        throughput, miou = run(model, data_loader, dataset, gt_seg_maps)
+        table.add_row([name, f'{throughput:.2f}', f'{miou:.2f}'])
+    print('\n' + table.get_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Check that the ProtoEstimator memory banks are identical on all ranks and
+# equal to the bank of a single process that sees the features of all
+# ranks. The ranks are CPU processes with the gloo backend. The check runs
+# as a pre-commit hook on changes of the ProtoEstimator.
+# Run: python -m tools.check_dist_proto_bank --procs 3 --update-interval 2
+
+import argparse
+import os
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from prettytable import PrettyTable
+
+from mmseg.models.utils.proto_estimator import ProtoEstimator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the distributed prototype memory bank')
+    parser.add_argument('--procs', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=12)
+    parser.add_argument('--update-interval', type=int, default=1)
+    parser.add_argument('--num-classes', type=int, default=19)
+    parser.add_argument('--dim', type=int, default=64)
+    parser.add_argument('--port', type=int, default=29513)
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1e-5,
+        help='maximum difference of the banks to a single process')
+    return parser.parse_args()
+
+
+def make_features(args, step, rank):
+    generator = torch.Generator().manual_seed(step * 1000 + rank)
+    num = int(torch.randint(50, 500, (1, ), generator=generator))
+    features = torch.randn(num, args.dim, generator=generator)
+    # each rank only sees a part of the classes
+    labels = torch.randint(
+        0, args.num_classes // 2 + rank, (num, ), generator=generator)
+    return features, labels
+
+
+def build_estimator(args):
+    return ProtoEstimator(
+        args.dim,
+        args.num_classes,
+        memory_length=args.steps,
+        update_interval=args.update_interval,
+        device='cpu')
+
+
+def stack_bank(estimator):
+    return torch.cat([torch.cat(list(bank)) for bank in estimator.MemoryBank])
+
+
+def worker(rank, args, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(args.port)
+    dist.init_process_group('gloo', rank=rank, world_size=args.procs)
+    estimator = build_estimator(args)
+    for step in range(args.steps):
+        estimator.update_proto(*make_features(args, step, rank))
+    results[rank] = stack_bank(estimator)
+    dist.destroy_process_group()
+
+
+def main():
+    args = parse_args()
+    manager = mp.Manager()
+    results = manager.dict()
+    mp.spawn(worker, args=(args, results), nprocs=args.procs)
+
+    reference = build_estimator(args)
+    for step in range(args.steps):
+        features, labels = zip(
+            *[make_features(args, step, rank) for rank in range(args.procs)])
+        reference.update_proto(torch.cat(features), torch.cat(labels))
+    expected = stack_bank(reference)
+
+    identical = all(
+        torch.equal(results[0], results[rank]) for rank in range(args.procs))
+    max_diff = (results[0] - expected).abs().max().item() \
+        if results[0].shape == expected.shape else float('inf')
+    ok = identical and max_diff <= args.tolerance
+    table = PrettyTable()
+    table.field_names = [
+        'procs', 'identical on all ranks', 'max diff to single process', 'ok'
+    ]
+    table.add_row([
+        args.procs, 'yes' if identical else 'NO', f'{max_diff:.2e}',
+        'yes' if ok else 'NO'
+    ])
+    print(table)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
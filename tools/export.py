@@ -0,0 +1,158 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Export a segmentor as TorchScript (and optionally ONNX) with a fixed input
+# shape. The exported model can be run with
+# mmseg.apis.init_exported_segmentor and inference_segmentor.
+# Run: python -m tools.export CONFIG CHECKPOINT --onnx --benchmark 20
+
+import argparse
+import json
+import os.path as osp
+import time
+
+import mmcv
+import numpy as np
+import torch
+import torch.nn as nn
+from prettytable import PrettyTable
+
+from mmseg.apis import init_segmentor
+from tools.test import update_legacy_cfg
+
+
+class ExportWrapper(nn.Module):
+    """Expose ``encode_decode`` of a segmentor as a single-tensor forward."""
+
+    def __init__(self, model):
+        super(ExportWrapper, self).__init__()
+        self.model = model
+
+    def forward(self, img):
+        return self.model.encode_decode(img, None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Export a segmentor to TorchScript/ONNX')
+    parser.add_argument('config', help='config file path')
+    parser.add_argument('checkpoint', help='checkpoint file')
+    parser.add_argument(
+        '--out',
+        default='work_dirs/export/model.pt',
+        help='output TorchScript file. The ONNX file is written next to it.')
+    parser.add_argument(
+        '--shape',
+        type=int,
+        nargs=2,
+        default=[512, 1024],
+        help='fixed input shape (h w)')
+    parser.add_argument(
+        '--onnx', action='store_true', help='additionally export to ONNX')
+    parser.add_argument('--opset', type=int, default=11, help='ONNX opset')
+    parser.add_argument(
+        '--benchmark',
+        type=int,
+        default=0,
+        help='number of timed CPU runs comparing eager, TorchScript and '
+        'ONNX Runtime (0 disables the benchmark)')
+    return parser.parse_args()
+
+
+def save_meta(artifact, model, shape):
+    meta = dict(
+        input_shape=shape,
+        align_corners=model.align_corners,
+        CLASSES=list(model.CLASSES),
+        PALETTE=[list(c) for c in model.PALETTE])
+    with open(artifact + '.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+def measure(fn, img, num_runs, num_warmup=3):
+    for _ in range(num_warmup):
+        fn(img)
+    times = []
+    for _ in range(num_runs):
+        start_time = time.perf_counter()
+        fn(img)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return np.mean(times), np.median(times)
+
+
+def benchmark(wrapper, script_file, onnx_file, shape, num_runs):
+    img = torch.randn(1, 3, *shape)
+    scripted = torch.jit.load(script_file, map_location='cpu')
+    runners = [('eager', wrapper), ('TorchScript', scripted)]
+    if onnx_file is not None:
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError('Please run "pip install onnxruntime" to '
+                              'install onnxruntime first.')
+        session = ort.InferenceSession(
+            onnx_file, providers=['CPUExecutionProvider'])
+        runners.append(('ONNX Runtime',
+                        lambda x: session.run(None, {'input': x.numpy()})))
+
+    table = PrettyTable(['Runtime', 'mean [ms]', 'median [ms]'])
+    with torch.no_grad():
+        for name, fn in runners:
+            mean, median = measure(fn, img, num_runs)
+            table.add_row([name, f'{mean:.1f}', f'{median:.1f}'])
+    print(f'CPU latency for input shape {shape} '
+          f'({torch.get_num_threads()} threads):')
+    print(table.get_string())
+
+
+def main():
+    args = parse_args()
+
+    cfg = mmcv.Config.fromfile(args.config)
+    cfg = update_legacy_cfg(cfg)
+    model = init_segmentor(
+        cfg,
+        args.checkpoint,
+        device='cpu',
+        revise_checkpoint=[(r'^module\.', ''), ('model.', '')])
+    wrapper = ExportWrapper(model).eval()
+    shape = list(args.shape)
+    dummy = torch.randn(1, 3, *shape)
+
+    mmcv.mkdir_or_exist(osp.dirname(osp.abspath(args.out)))
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, dummy)
+    traced.save(args.out)
+    save_meta(args.out, model, shape)
+    print(f'Saved TorchScript model to {args.out}')
+
+    onnx_file = None
+    if args.onnx:
+        onnx_file = osp.splitext(args.out)[0] + '.onnx'
+        with torch.no_grad():
+            torch.onnx.export(
+                wrapper,
+                dummy,
+                onnx_file,
+                input_names=['input'],
+                output_names=['output'],
+                dynamic_axes={
+                    'input': {
+                        0: 'batch'
+                    },
+                    'output': {
+                        0: 'batch'
+                    }
+                },
+                opset_version=args.opset)
+        save_meta(onnx_file, model, shape)
+        print(f'Saved ONNX model to {onnx_file}')
+
+    if args.benchmark > 0:
+        benchmark(wrapper, args.out, onnx_file, shape, args.benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,15 @@
 # Obtained from: https://github.com/open-mmlab/mmsegmentation/tree/v0.16.0
 
 import argparse
-import json
 import logging
 from copy import deepcopy
 
 from experiments import generate_experiment_cfgs
-from mmcv import Config, get_logger
+from mmcv import get_logger
 from prettytable import PrettyTable
 
 from mmseg.models import build_segmentor
+from mmseg.utils import ConfigCompiler
 
 
 def human_format(num):
@@ -48,10 +48,9 @@ if __name__ == '__main__':
     args = parser.parse_args()
     get_logger('mmseg', log_level=logging.ERROR)
     cfgs = generate_experiment_cfgs(args.exp)
+    compiler = ConfigCompiler()
     for cfg in cfgs:
-        with open('configs/tmp_param.json', 'w') as f:
-            json.dump(cfg, f)
-        cfg = Config.fromfile('configs/tmp_param.json')
+        cfg = compiler.compile_dict(cfg)
 
         model = build_segmentor(deepcopy(cfg['model']))
         # model.init_weights()
@@ -0,0 +1,639 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Run the generated configs of run_experiments.py concurrently on the local
+# GPUs and CPU cores. The jobs are kept in a persistent queue, so that the
+# scheduler can be stopped and restarted. Jobs are placed first-fit in
+# queue order onto GPUs with enough unreserved memory according to an
+# estimate from the parameter count, batch and crop size, which is replaced
+# by the logged peak memory once a job with the same model, batch and crop
+# has finished. Failed jobs are retried and resume from their latest
+# checkpoint. All jobs share the file index and ground truth caches, which
+# are warmed up once before the first job is launched.
+# Run: python run_experiments.py --exp 1 --schedule
+#      python -m tools.job_scheduler add configs/generated/local-exp1/*.json
+#      python -m tools.job_scheduler run --gpus 0 1 --max-retries 2
+#      python -m tools.job_scheduler status
+
+import argparse
+import contextlib
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import os.path as osp
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+from prettytable import PrettyTable
+
+from mmseg.utils import load_config
+from tools.log_index import LogIndex
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def _dump_json(obj, filename):
+    tmp_file = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_file, filename)
+
+
+def _hash(obj):
+    return hashlib.sha1(
+        json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _normalize(obj):
+    return json.loads(json.dumps(obj))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+class JobQueue(object):
+    """Persistent queue of training jobs.
+
+    The jobs are stored in ``{queue_dir}/queue.json`` in the order in which
+    they were added. Each job records its config, status, attempts, devices,
+    process id and runtime. Processes modify the queue only in
+    :meth:`update`, which merges the changes of other processes.
+
+    Args:
+        queue_dir (str): Directory of the queue, the job logs and the shared
+            caches.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        self.queue_file = osp.join(queue_dir, 'queue.json')
+        self.jobs = OrderedDict()
+        self._saved = {}
+        self.reload()
+        self._lock_file = None
+
+    def save(self):
+        os.makedirs(self.queue_dir, exist_ok=True)
+        _dump_json(self.jobs, self.queue_file)
+        self._saved = _normalize(self.jobs)
+
+    def reload(self):
+        """Merge the jobs added or changed by other processes since the last
+        load or save. A job changed by both keeps the changes of this
+        process."""
+        if not osp.isfile(self.queue_file):
+            return
+        with open(self.queue_file, 'r') as f:
+            jobs = json.load(f, object_pairs_hook=OrderedDict)
+        for name, job in jobs.items():
+            saved = self._saved.get(name)
+            if name not in self.jobs:
+                self.jobs[name] = job
+            elif job != saved and _normalize(self.jobs[name]) == saved:
+                # update in place, the scheduler holds references to jobs
+                self.jobs[name].clear()
+                self.jobs[name].update(job)
+        self._saved = jobs
+
+    @contextlib.contextmanager
+    def update(self):
+        """Reload, modify and save the queue while holding its file lock.
+
+        Blocks while another process updates the queue.
+        """
+        os.makedirs(self.queue_dir, exist_ok=True)
+        with open(osp.join(self.queue_dir, 'queue.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload()
+            yield self
+            if _normalize(self.jobs) != self._saved:
+                self.save()
+
+    def add(self, config, name=None):
+        """Add the job of a config file unless it is already queued."""
+        name = name or osp.splitext(osp.basename(config))[0]
+        if name not in self.jobs:
+            self.jobs[name] = dict(
+                name=name,
+                config=config,
+                status=PENDING,
+                attempts=0,
+                devices=[],
+                pid=None,
+                resources=None,
+                start=None,
+                runtime=0.,
+                returncode=None)
+        return self.jobs[name]
+
+    def with_status(self, *status):
+        return [job for job in self.jobs.values() if job['status'] in status]
+
+    def lock(self):
+        """Make sure that only one scheduler runs on the queue."""
+        if self._lock_file is not None:
+            return
+        os.makedirs(self.queue_dir, exist_ok=True)
+        lock_file = open(osp.join(self.queue_dir, 'scheduler.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(
+                f'Another scheduler is running on {self.queue_dir}')
+        self._lock_file = lock_file
+
+
+def find_crop_size(cfg, default=(512, 512)):
+    """Crop size of the first RandomCrop in a (nested) data config."""
+    if isinstance(cfg, dict):
+        if cfg.get('type') == 'RandomCrop':
+            return tuple(cfg['crop_size'])
+        items = cfg.values()
+    elif isinstance(cfg, (list, tuple)):
+        items = cfg
+    else:
+        return None
+    for item in items:
+        crop_size = find_crop_size(item, None)
+        if crop_size is not None:
+            return crop_size
+    return default
+
+
+class ResourceEstimator(object):
+    """Estimate the GPU memory and CPU cores of a job.
+
+    The GPU memory of a job is estimated as
+
+        params * (16 + 4 * frozen copies) B + act_gb_per_mpix * batch *
+        crop pixels / 1e6 + context_gb,
+
+    where 16 B per parameter are the weights, gradients and AdamW moments of
+    the student and the frozen copies are the teacher, EMA and ImageNet
+    models of UDA. The parameter counts are cached by the hash of the model
+    config. Once a job has finished, its logged peak memory replaces the
+    estimate of all jobs with the same model, batch and crop size. The
+    estimate can be overridden by ``job_resources=dict(gpu_mem=...)`` in a
+    config.
+
+    Args:
+        cache_file (str): JSON file with the parameter counts and measured
+            peak memory.
+        act_gb_per_mpix (float): Activation memory in GB per megapixel of a
+            training batch. Default: 12.
+        context_gb (float): Memory of the CUDA context. Default: 1.
+    """
+
+    def __init__(self, cache_file, act_gb_per_mpix=12., context_gb=1.):
+        self.cache_file = cache_file
+        self.act_gb_per_mpix = act_gb_per_mpix
+        self.context_gb = context_gb
+        self.cache = dict(params={}, peak_mem={})
+        if osp.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                self.cache = json.load(f)
+
+    def save(self):
+        _dump_json(self.cache, self.cache_file)
+
+    def count_params(self, model_cfg):
+        key = _hash(model_cfg)
+        if key not in self.cache['params']:
+            from mmseg.models import build_segmentor
+            from tools.get_param_count import count_parameters
+            model = build_segmentor(copy.deepcopy(model_cfg))
+            self.cache['params'][key] = count_parameters(model)
+            self.save()
+        return self.cache['params'][key]
+
+    def estimate(self, cfg):
+        batch = cfg.data.samples_per_gpu
+        crop_h, crop_w = find_crop_size(cfg.data.train)
+        key = _hash([cfg.model, batch, crop_h, crop_w])
+        if key in self.cache['peak_mem']:
+            gpu_mem = self.cache['peak_mem'][key]
+        else:
+            uda = cfg.get('uda', None) or {}
+            frozen_copies = 0
+            if uda:
+                frozen_copies += 1
+                if uda.get('imnet_feature_dist_lambda', 0) > 0:
+                    frozen_copies += 1
+                if uda.get('ema_teacher', None) is not None:
+                    frozen_copies += 1
+            params = self.count_params(cfg.model)
+            gpu_mem = params * (16 + 4 * frozen_copies) / 1024**3 + \
+                self.act_gb_per_mpix * batch * crop_h * crop_w / 1e6 + \
+                self.context_gb
+        resources = dict(
+            key=key,
+            gpus=cfg.get('n_gpus', 1),
+            gpu_mem=gpu_mem,
+            cpus=(cfg.data.workers_per_gpu + 1) * cfg.get('n_gpus', 1),
+            batch=batch * cfg.get('n_gpus', 1))
+        resources.update(cfg.get('job_resources', {}))
+        return resources
+
+    def record(self, key, peak_mem_gb):
+        self.cache['peak_mem'][key] = peak_mem_gb + self.context_gb
+        self.save()
+
+
+def cache_options(cfg, index_cache_dir, gt_cache_dir):
+    """Config options that point the datasets and evaluation of a job to
+    the shared caches."""
+    options = OrderedDict()
+
+    def _visit(node, path):
+        if isinstance(node, dict):
+            if 'img_dir' in node:
+                options[f'{path}.index_cache_dir'] = index_cache_dir
+            for k, v in node.items():
+                _visit(v, f'{path}.{k}')
+
+    _visit(cfg.data, 'data')
+    if cfg.get('evaluation', None) is not None:
+        options['evaluation.gt_cache_dir'] = gt_cache_dir
+    return options
+
+
+class JobScheduler(object):
+    """Run the jobs of a :obj:`JobQueue` on the local GPUs and CPU cores.
+
+    Args:
+        queue (:obj:`JobQueue`): The queue.
+        gpus (list[int], optional): GPU ids. Default: all visible GPUs.
+        gpu_mem (float, optional): Usable memory per GPU in GB. Default:
+            the memory of the GPU.
+        cpus (int, optional): Usable CPU cores. Default: all cores.
+        max_retries (int): Number of retries of a failed job. Default: 2.
+        poll_interval (float): Seconds between two polls. Default: 10.
+        warmup (bool): Whether to build the datasets of all jobs once
+            before launching the first job, which fills the shared caches.
+            Default: True.
+        act_gb_per_mpix (float): See :obj:`ResourceEstimator`.
+            Default: 12.
+    """
+
+    def __init__(self,
+                 queue,
+                 gpus=None,
+                 gpu_mem=None,
+                 cpus=None,
+                 max_retries=2,
+                 poll_interval=10,
+                 warmup=True,
+                 act_gb_per_mpix=12.):
+        import torch
+        self.queue = queue
+        if gpus is None:
+            gpus = list(range(torch.cuda.device_count()))
+        self.capacity = OrderedDict()
+        for gpu in gpus:
+            total = torch.cuda.get_device_properties(gpu).total_memory
+            self.capacity[gpu] = gpu_mem or total / 1024**3
+        self.cpus = cpus or os.cpu_count()
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.warmup = warmup
+        self.estimator = ResourceEstimator(
+            osp.join(queue.queue_dir, 'resources.json'), act_gb_per_mpix)
+        self.index_cache_dir = osp.join(queue.queue_dir, 'cache', 'index')
+        self.gt_cache_dir = osp.join(queue.queue_dir, 'cache', 'gt')
+        self.config_cache_dir = osp.join(queue.queue_dir, 'cache', 'configs')
+        self.log_index = LogIndex(osp.join(queue.queue_dir, 'log_index'))
+        self.procs = {}
+        self._cfgs = {}
+
+    def _cfg(self, job):
+        if job['name'] not in self._cfgs:
+            self._cfgs[job['name']] = load_config(job['config'],
+                                                  self.config_cache_dir)
+        return self._cfgs[job['name']]
+
+    def _prepare(self, job):
+        cfg = self._cfg(job)
+        job.setdefault('work_dir', cfg.get('work_dir', None))
+        job.setdefault('max_iters', cfg.runner.get('max_iters', None))
+        if job['resources'] is None:
+            job['resources'] = self.estimator.estimate(cfg)
+
+    def _recover(self):
+        """Recover the jobs of a scheduler that was stopped."""
+        for job in self.queue.with_status(RUNNING):
+            if _alive(job['pid']):
+                # the job is still running and is polled by its pid
+                self.procs[job['name']] = None
+            else:
+                job['status'] = PENDING
+
+    def _warmup(self):
+        from mmseg.datasets import build_dataset
+        seen = set()
+        for job in self.queue.with_status(PENDING):
+            cfg = load_config(job['config'], self.config_cache_dir)
+            cfg.merge_from_dict(
+                cache_options(cfg, self.index_cache_dir, self.gt_cache_dir))
+            key = _hash([cfg.data.train, cfg.data.val])
+            if key in seen:
+                continue
+            seen.add(key)
+            print(f'Warm up the dataset caches of {job["name"]}')
+            build_dataset(cfg.data.train)
+            val_dataset = build_dataset(cfg.data.val)
+            if hasattr(val_dataset, 'get_gt_seg_map_store'):
+                val_dataset.get_gt_seg_map_store(
+                    cfg.get('evaluation', {}).get('nproc', 4),
+                    cache_dir=self.gt_cache_dir)
+
+    def _free_resources(self):
+        free_mem = OrderedDict(self.capacity)
+        free_cpus = self.cpus
+        for name in self.procs:
+            job = self.queue.jobs[name]
+            for gpu in job['devices']:
+                free_mem[gpu] -= job['resources']['gpu_mem']
+            free_cpus -= job['resources']['cpus']
+        return free_mem, free_cpus
+
+    def _place(self, job, free_mem, free_cpus):
+        """GPUs for a job or None if it does not fit."""
+        resources = job['resources']
+        if resources['cpus'] > free_cpus and len(self.procs) > 0:
+            return None
+        if not self.capacity:
+            return []
+        # jobs larger than a GPU run alone
+        gpu_mem = min(resources['gpu_mem'], max(self.capacity.values()))
+        gpus = [
+            gpu for gpu in sorted(free_mem, key=lambda g: -free_mem[g])
+            if free_mem[gpu] >= gpu_mem
+        ]
+        if len(gpus) < resources['gpus']:
+            return None
+        return gpus[:resources['gpus']]
+
+    def _command(self, job):
+        cfg = self._cfg(job)
+        args = [job['config']]
+        latest = osp.join(job['work_dir'] or '', 'latest.pth')
+        if job['work_dir'] is not None and osp.exists(latest):
+            args += ['--resume-from', latest]
+        options = cache_options(cfg, self.index_cache_dir, self.gt_cache_dir)
+        args += ['--options'] + [f'{k}={v}' for k, v in options.items()]
+        num_gpus = job['resources']['gpus']
+        if num_gpus > 1:
+            port = 29500 + int(_hash(job['name']), 16) % 1000
+            return [
+                sys.executable, '-m', 'torch.distributed.launch',
+                f'--nproc_per_node={num_gpus}', f'--master_port={port}',
+                '--module', 'tools.train'
+            ] + args + ['--launcher', 'pytorch']
+        return [sys.executable, '-m', 'tools.train'] + args
+
+    def _launch(self, job, gpus):
+        env = dict(os.environ)
+        env['CUDA_VISIBLE_DEVICES'] = ','.join(str(gpu) for gpu in gpus)
+        env['OMP_NUM_THREADS'] = str(max(job['resources']['cpus'], 1))
+        log_file = osp.join(self.queue.queue_dir, 'logs', f'{job["name"]}.log')
+        os.makedirs(osp.dirname(log_file), exist_ok=True)
+        command = self._command(job)
+        with open(log_file, 'a') as f:
+            f.write(f'# attempt {job["attempts"] + 1} on GPUs {gpus}: '
+                    f'{" ".join(command)}\n')
+            f.flush()
+            proc = subprocess.Popen(
+                command, stdout=f, stderr=subprocess.STDOUT, env=env)
+        print(f'Launch {job["name"]} on GPUs {gpus} '
+              f'({job["resources"]["gpu_mem"]:.1f} GB estimated)')
+        job.update(
+            status=RUNNING,
+            devices=gpus,
+            pid=proc.pid,
+            log=log_file,
+            start=time.time())
+        self.procs[job['name']] = proc
+
+    def _finished(self, job):
+        """Whether a job reached its last iteration, which is used for jobs
+        that are not children of this scheduler."""
+        return job['work_dir'] is not None and job['max_iters'] is not None \
+            and osp.isfile(osp.join(job['work_dir'],
+                                    f'iter_{job["max_iters"]}.pth'))
+
+    def _peak_memory(self, job):
+        """Peak memory in GB logged by a job."""
+        if job['work_dir'] is None or not osp.isdir(job['work_dir']):
+            return None
+        self.log_index.refresh([job['work_dir']])
+        peak = None
+        for log, run in self.log_index.runs.items():
+            if not log.startswith(osp.abspath(job['work_dir']) + os.sep):
+                continue
+            memory = self.log_index.load(run, ['train:memory']).get(
+                'train:memory', np.zeros(0))
+            memory = memory[~np.isnan(memory)]
+            if len(memory):
+                mem = float(memory.max()) / 1024
+                peak = mem if peak is None else max(peak, mem)
+        return peak
+
+    def _complete(self, job, returncode):
+        job['runtime'] += time.time() - job['start']
+        job['returncode'] = returncode
+        job['pid'] = None
+        if returncode == 0:
+            job['status'] = DONE
+            peak = self._peak_memory(job)
+            if peak is not None:
+                self.estimator.record(job['resources']['key'], peak)
+            print(f'Finished {job["name"]}')
+            return
+        job['attempts'] += 1
+        log_tail = ''
+        if job.get('log') and osp.isfile(job['log']):
+            with open(job['log'], 'rb') as f:
+                f.seek(max(osp.getsize(job['log']) - 20000, 0))
+                log_tail = f.read().decode('utf-8', 'replace')
+        if 'out of memory' in log_tail:
+            job['resources']['gpu_mem'] *= 1.5
+        if job['attempts'] <= self.max_retries:
+            job['status'] = PENDING
+            print(f'Retry {job["name"]} (exit code {returncode})')
+        else:
+            job['status'] = FAILED
+            print(f'Failed {job["name"]} (exit code {returncode})')
+
+    def _poll(self):
+        for name, proc in list(self.procs.items()):
+            job = self.queue.jobs[name]
+            if proc is None:
+                if _alive(job['pid']):
+                    continue
+                returncode = 0 if self._finished(job) else -1
+            else:
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+            del self.procs[name]
+            self._complete(job, returncode)
+
+    def _launch_ready(self):
+        for job in self.queue.with_status(PENDING):
+            self._prepare(job)
+            free_mem, free_cpus = self._free_resources()
+            gpus = self._place(job, free_mem, free_cpus)
+            if gpus is not None:
+                self._launch(job, gpus)
+
+    def run(self):
+        self.queue.lock()
+        with self.queue.update():
+            self._recover()
+        if self.warmup and self.queue.with_status(PENDING):
+            self._warmup()
+        start_time = time.time()
+        try:
+            while True:
+                # jobs can be added or retried while the scheduler runs
+                with self.queue.update():
+                    if not (self.queue.with_status(PENDING) or self.procs):
+                        break
+                    self._poll()
+                    self._launch_ready()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            # the jobs resume from their latest checkpoint on the next run
+            with self.queue.update():
+                for name, proc in self.procs.items():
+                    if proc is not None:
+                        proc.terminate()
+                        proc.wait()
+                    job = self.queue.jobs[name]
+                    job['runtime'] += time.time() - job['start']
+                    job.update(status=PENDING, pid=None)
+            raise
+        print(self.report(time.time() - start_time))
+
+    def report(self, wall_time=None):
+        return report(self.queue, self.log_index, len(self.capacity),
+                      wall_time)
+
+
+def report(queue, log_index, num_gpus=None, wall_time=None):
+    """Table of the jobs with their training throughput and a summary of
+    the throughput of the queue."""
+    work_dirs = [
+        job['work_dir'] for job in queue.jobs.values()
+        if job.get('work_dir') and osp.isdir(job['work_dir'])
+    ]
+    log_index.refresh(work_dirs)
+    table = PrettyTable()
+    table.field_names = [
+        'job', 'status', 'attempts', 'GPUs', 'est. GB', 'runtime (h)',
+        's / iter', 'img / s'
+    ]
+    gpu_seconds = 0.
+    for job in queue.jobs.values():
+        resources = job['resources'] or {}
+        runtime = job['runtime']
+        if job['status'] == RUNNING and job['start'] is not None:
+            runtime += time.time() - job['start']
+        gpu_seconds += runtime * len(job['devices'])
+        s_iter = None
+        if job.get('work_dir'):
+            prefix = osp.abspath(job['work_dir']) + os.sep
+            times = [
+                log_index.load(run, ['train:time']).get('train:time')
+                for log, run in log_index.runs.items()
+                if log.startswith(prefix)
+            ]
+            times = [t[1:] for t in times if t is not None and len(t) > 1]
+            if times:
+                s_iter = float(sum(t.sum() for t in times) /
+                               sum(len(t) for t in times))
+        table.add_row([
+            job['name'], job['status'], job['attempts'],
+            ','.join(str(gpu) for gpu in job['devices']),
+            f'{resources["gpu_mem"]:.1f}' if resources else '-',
+            f'{runtime / 3600:.2f}', f'{s_iter:.3f}' if s_iter else '-',
+            f'{resources["batch"] / s_iter:.1f}'
+            if s_iter and resources else '-'
+        ])
+    summary = [
+        f'{len(queue.with_status(DONE))} done, '
+        f'{len(queue.with_status(RUNNING))} running, '
+        f'{len(queue.with_status(PENDING))} pending, '
+        f'{len(queue.with_status(FAILED))} failed'
+    ]
+    if wall_time:
+        summary.append(f'wall time {wall_time / 3600:.2f} h')
+        if num_gpus:
+            summary.append(
+                f'GPU utilization {gpu_seconds / (num_gpus * wall_time):.1%}')
+    return f'{table}\n' + ', '.join(summary)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Schedule training jobs on the local GPUs')
+    parser.add_argument(
+        'command', choices=['add', 'run', 'status', 'retry'], help='command')
+    parser.add_argument('configs', nargs='*', help='configs to add')
+    parser.add_argument('--queue-dir', default='jobs')
+    parser.add_argument('--gpus', type=int, nargs='+', default=None)
+    parser.add_argument(
+        '--gpu-mem', type=float, default=None, help='GB per GPU')
+    parser.add_argument('--cpus', type=int, default=None)
+    parser.add_argument('--max-retries', type=int, default=2)
+    parser.add_argument('--poll', type=float, default=10)
+    parser.add_argument('--no-warmup', action='store_true')
+    parser.add_argument(
+        '--act-gb-per-mpix',
+        type=float,
+        default=12.,
+        help='activation memory per megapixel of a batch')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    queue = JobQueue(args.queue_dir)
+    if args.command == 'add':
+        with queue.update():
+            for config in args.configs:
+                queue.add(config)
+    elif args.command == 'retry':
+        with queue.update():
+            for job in queue.with_status(FAILED):
+                job.update(status=PENDING, attempts=0)
+    elif args.command == 'status':
+        print(
+            report(queue, LogIndex(osp.join(args.queue_dir, 'log_index'))))
+    else:
+        JobScheduler(
+            queue,
+            gpus=args.gpus,
+            gpu_mem=args.gpu_mem,
+            cpus=args.cpus,
+            max_retries=args.max_retries,
+            poll_interval=args.poll,
+            warmup=not args.no_warmup,
+            act_gb_per_mpix=args.act_gb_per_mpix).run()
+
+
+if __name__ == '__main__':
+    main()
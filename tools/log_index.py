@@ -0,0 +1,411 @@
+# ---------------------------------------------------------------
+# Copyright (c) 2021-2022 ETH Zurich, Lukas Hoyer. All rights reserved.
+# Licensed under the Apache License, Version 2.0
+# ---------------------------------------------------------------
+
+# Index the json logs of many runs into a columnar store and query it.
+# Each run is stored as one .npz file with a float32 column per mode
+# (train/val) and log key. A refresh only parses the complete lines that
+# were appended to a log since the last refresh, so that the logs of
+# running jobs can be indexed repeatedly. Queries only load the columns
+# they need and refresh the index first, unless --no-refresh is given.
+# Run: python -m tools.log_index refresh work_dirs
+#      python -m tools.log_index runs work_dirs --filter daformer
+#      python -m tools.log_index best work_dirs --metric mIoU --by config
+#      python -m tools.log_index speed work_dirs --by config
+#      python -m tools.log_index stages work_dirs
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+from prettytable import PrettyTable
+
+INDEX_VERSION = 1
+MODES = ('train', 'val')
+META_KEYS = ('exp_name', 'seed')
+# run_experiments.py adds the date and a random suffix to the config name,
+# which ends with the seed
+_NAME_PREFIX = re.compile(r'^\d{6}_\d{4}_')
+_NAME_SUFFIX = re.compile(r'(_s\d+)?_[0-9a-f]{5}$')
+
+
+def config_name(run_name):
+    return _NAME_SUFFIX.sub('', _NAME_PREFIX.sub('', run_name))
+
+
+def find_logs(roots):
+    logs = []
+    for root in roots:
+        if os.path.isfile(root):
+            logs.append(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            # skip hidden directories such as the default store
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            logs.extend(
+                os.path.join(dirpath, f) for f in sorted(filenames)
+                if f.endswith('.log.json'))
+    return logs
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _read_head(log, size=256):
+    with open(log, 'rb') as f:
+        return f.read(size).decode('latin-1')
+
+
+class LogIndex(object):
+    """Columnar store of the json logs of many runs.
+
+    The store directory contains ``index.json`` with the read offset and
+    meta information of each log and one .npz file per log. The columns of
+    a log are named ``{mode}:{key}``, e.g. ``train:time`` or ``val:mIoU``,
+    and entries without a key are NaN.
+
+    Args:
+        store (str): Directory of the store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.index_file = os.path.join(store, 'index.json')
+        self.runs = OrderedDict()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                self.runs = OrderedDict(index['runs'])
+
+    def save(self):
+        os.makedirs(self.store, exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(dict(version=INDEX_VERSION, runs=self.runs), f)
+        os.replace(tmp_file, self.index_file)
+
+    def _new_run(self, log):
+        digest = hashlib.sha1(log.encode()).hexdigest()[:16]
+        return dict(
+            log=log,
+            name=os.path.basename(os.path.dirname(log)),
+            file=f'{digest}.npz',
+            offset=0,
+            head='',
+            mtime=0.,
+            rows={mode: 0
+                  for mode in MODES},
+            columns=[],
+            meta={})
+
+    def refresh(self, roots):
+        """Index the new lines of the logs under ``roots``.
+
+        Args:
+            roots (list[str]): Log files or directories, which are searched
+                recursively for ``*.log.json`` files.
+
+        Returns:
+            tuple[int]: The number of updated logs and parsed lines.
+        """
+        num_logs, num_lines = 0, 0
+        for log in find_logs(roots):
+            log = os.path.abspath(log)
+            stat = os.stat(log)
+            run = self.runs.get(log)
+            if run is not None and run['offset'] == stat.st_size:
+                continue
+            head = _read_head(log)
+            # the log was truncated or replaced, e.g. by a restarted job
+            if run is None or stat.st_size < run['offset'] or \
+                    not head.startswith(run['head']):
+                run = self._new_run(log)
+            run['head'] = head
+            run['mtime'] = stat.st_mtime
+            num_lines += self._update(run)
+            self.runs[log] = run
+            num_logs += 1
+        if num_logs > 0:
+            self.save()
+        return num_logs, num_lines
+
+    def _update(self, run):
+        entries = {mode: [] for mode in MODES}
+        num_lines = 0
+        with open(run['log'], 'rb') as f:
+            f.seek(run['offset'])
+            for line in iter(f.readline, b''):
+                # the last line of a running job may be incomplete
+                if not line.endswith(b'\n'):
+                    break
+                run['offset'] += len(line)
+                num_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                mode = entry.get('mode')
+                if mode in entries:
+                    entries[mode].append(entry)
+                elif mode is None:
+                    run['meta'].update(
+                        {k: entry[k]
+                         for k in META_KEYS if k in entry})
+        if any(entries.values()):
+            self._append(run, entries)
+        return num_lines
+
+    def _append(self, run, entries):
+        columns = self.load(run)
+        for mode, mode_entries in entries.items():
+            if not mode_entries:
+                continue
+            num_old = run['rows'][mode]
+            num_new = len(mode_entries)
+            keys = {f'{mode}:{k}'
+                    for entry in mode_entries
+                    for k, v in entry.items() if _is_number(v)}
+            keys.update(c for c in columns if c.startswith(f'{mode}:'))
+            for key in keys:
+                name = key[len(mode) + 1:]
+                new = np.full(num_new, np.nan, dtype=np.float32)
+                for i, entry in enumerate(mode_entries):
+                    value = entry.get(name)
+                    if _is_number(value):
+                        new[i] = value
+                old = columns.get(key)
+                if old is None:
+                    old = np.full(num_old, np.nan, dtype=np.float32)
+                columns[key] = np.concatenate([old, new])
+            run['rows'][mode] = num_old + num_new
+        run['columns'] = sorted(columns)
+        os.makedirs(self.store, exist_ok=True)
+        path = os.path.join(self.store, run['file'])
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(path + '.tmp', path)
+
+    def load(self, run, keys=None):
+        """Load columns of a run.
+
+        Args:
+            run (dict): Entry of ``self.runs``.
+            keys (list[str], optional): Column names. Columns that the run
+                does not have are omitted. Default: all columns.
+
+        Returns:
+            dict[str, np.ndarray]: The columns.
+        """
+        path = os.path.join(self.store, run['file'])
+        if not os.path.isfile(path):
+            return {}
+        if keys is None:
+            keys = run['columns']
+        with np.load(path) as data:
+            return {k: data[k] for k in keys if k in run['columns']}
+
+
+def group_runs(index, by='run', pattern=None):
+    groups = OrderedDict()
+    for run in sorted(index.runs.values(), key=lambda r: r['name']):
+        if pattern is not None and re.search(pattern, run['name']) is None:
+            continue
+        key = run['name'] if by == 'run' else config_name(run['name'])
+        groups.setdefault(key, []).append(run)
+    return groups
+
+
+def _valid(values):
+    return values[~np.isnan(values)]
+
+
+def query_runs(index, groups, args):
+    table = PrettyTable()
+    table.field_names = [
+        'run', 'last iter', 'train rows', 'val rows', 'updated (min ago)'
+    ]
+    now = time.time()
+    for runs in groups.values():
+        for run in runs:
+            iters = _valid(index.load(run, ['train:iter']).get(
+                'train:iter', np.zeros(0)))
+            last_iter = int(iters.max()) if len(iters) else 0
+            table.add_row([
+                run['name'], last_iter, run['rows']['train'],
+                run['rows']['val'], f"{(now - run['mtime']) / 60:.1f}"
+            ])
+    return table
+
+
+def query_best(index, groups, args):
+    select = np.nanargmin if args.lower_is_better else np.nanargmax
+    key = f'val:{args.metric}'
+    table = PrettyTable()
+    table.field_names = [
+        args.by, 'runs', f'best {args.metric}', 'iter', 'best run',
+        'mean of runs', 'std of runs'
+    ]
+    rows = []
+    for group, runs in groups.items():
+        results = []
+        for run in runs:
+            columns = index.load(run, [key, 'val:iter'])
+            values = columns.get(key)
+            if values is None or np.isnan(values).all():
+                continue
+            i = select(values)
+            results.append((float(values[i]), int(columns['val:iter'][i]),
+                            run['name']))
+        if not results:
+            continue
+        bests = np.array([r[0] for r in results])
+        value, it, name = results[int(select(bests))]
+        rows.append((group, len(results), value, it, name, bests.mean(),
+                     bests.std()))
+    rows.sort(key=lambda r: r[2], reverse=not args.lower_is_better)
+    for group, num, value, it, name, mean, std in rows[:args.top]:
+        table.add_row([
+            group, num, f'{value:.4f}', it, name, f'{mean:.4f}', f'{std:.4f}'
+        ])
+    return table
+
+
+def _train_times(index, runs, keys, skip_first):
+    """Concatenated train columns of runs without the first rows of each
+    run, which include the warm-up iterations."""
+    columns = {k: [] for k in keys}
+    for run in runs:
+        data = index.load(run, keys)
+        num = run['rows']['train']
+        for k in keys:
+            values = data.get(k, np.full(num, np.nan, dtype=np.float32))
+            columns[k].append(values[skip_first:])
+    return {
+        k: np.concatenate(v) if v else np.zeros(0)
+        for k, v in columns.items()
+    }
+
+
+def query_speed(index, groups, args):
+    table = PrettyTable()
+    table.field_names = [
+        args.by, 'logged iters', 'mean s/iter', 'p50', 'p90', 'p99'
+    ]
+    for group, runs in groups.items():
+        times = _valid(
+            _train_times(index, runs, ['train:time'],
+                         args.skip_first)['train:time'])
+        if not len(times):
+            continue
+        p50, p90, p99 = np.percentile(times, [50, 90, 99])
+        table.add_row([
+            group,
+            len(times), f'{times.mean():.4f}', f'{p50:.4f}', f'{p90:.4f}',
+            f'{p99:.4f}'
+        ])
+    return table
+
+
+def query_stages(index, groups, args):
+    """Mean time per iteration of the logged ``*_time`` keys. The remainder
+    of the iteration time is reported as compute."""
+    table = PrettyTable()
+    table.field_names = [args.by, 'stage', 'ms / iter', 'share']
+    for group, runs in groups.items():
+        stage_keys = sorted({
+            c
+            for run in runs for c in run['columns']
+            if c.startswith('train:') and c.endswith('_time')
+        })
+        columns = _train_times(index, runs, ['train:time'] + stage_keys,
+                               args.skip_first)
+        valid = ~np.isnan(columns['train:time'])
+        if not valid.any():
+            continue
+        total = columns['train:time'][valid].mean()
+        stages = OrderedDict()
+        for key in stage_keys:
+            stages[key[len('train:'):-len('_time')]] = np.nan_to_num(
+                columns[key][valid]).mean()
+        stages['compute'] = total - sum(stages.values())
+        for stage, value in stages.items():
+            table.add_row([
+                group, stage, f'{value * 1000:.1f}', f'{value / total:.1%}'
+            ])
+        table.add_row([group, 'total', f'{total * 1000:.1f}', '100.0%'])
+    return table
+
+
+QUERIES = OrderedDict(
+    runs=query_runs, best=query_best, speed=query_speed, stages=query_stages)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Index json logs and query them across runs')
+    parser.add_argument(
+        'command', choices=['refresh'] + list(QUERIES), help='query')
+    parser.add_argument(
+        'roots',
+        nargs='*',
+        default=['work_dirs'],
+        help='log files or directories with logs')
+    parser.add_argument(
+        '--store',
+        default=None,
+        help='directory of the index, default: {first root}/.log_index')
+    parser.add_argument(
+        '--no-refresh',
+        action='store_true',
+        help='query the index without indexing new log lines')
+    parser.add_argument('--filter', default=None, help='regex of run names')
+    parser.add_argument(
+        '--by',
+        choices=['run', 'config'],
+        default='run',
+        help='group runs by config name without date, seed and suffix')
+    parser.add_argument('--metric', default='mIoU', help='val metric')
+    parser.add_argument('--lower-is-better', action='store_true')
+    parser.add_argument('--top', type=int, default=None)
+    parser.add_argument(
+        '--skip-first',
+        type=int,
+        default=1,
+        help='logged train rows per run that are skipped for timings')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    store = args.store
+    if store is None:
+        root = args.roots[0]
+        if os.path.isfile(root):
+            root = os.path.dirname(root)
+        store = os.path.join(root, '.log_index')
+    index = LogIndex(store)
+    if args.command == 'refresh' or not args.no_refresh:
+        start_time = time.perf_counter()
+        num_logs, num_lines = index.refresh(args.roots)
+        print(f'indexed {num_lines} lines of {num_logs} logs in '
+              f'{time.perf_counter() - start_time:.2f}s '
+              f'({len(index.runs)} logs in {store})')
+    if args.command == 'refresh':
+        return
+    start_time = time.perf_counter()
+    groups = group_runs(index, args.by, args.filter)
+    table = QUERIES[args.command](index, groups, args)
+    print(table)
+    print(f'query took {time.perf_counter() - start_time:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
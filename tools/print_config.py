@@ -2,9 +2,10 @@
 
 import argparse
 
-from mmcv import Config, DictAction
+from mmcv import DictAction
 
 from mmseg.apis import init_segmentor
+from mmseg.utils import load_config
 
 
 def parse_args():
@@ -22,7 +23,7 @@ def parse_args():
 def main():
     args = parse_args()
 
-    cfg = Config.fromfile(args.config)
+    cfg = load_config(args.config)
     if args.options is not None:
         cfg.merge_from_dict(args.options)
     print(f'Config:\n{cfg.pretty_text}')
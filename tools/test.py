@@ -55,6 +55,21 @@ def parse_args():
         nargs='+',
         help='evaluation metrics, which depends on the dataset, e.g., "mIoU"'
         ' for generic datasets, and "cityscapes" for Cityscapes')
+    parser.add_argument(
+        '--streaming-eval',
+        action='store_true',
+        help='accumulate a confusion matrix while testing instead of keeping '
+        'the predictions in memory, only valid with "--eval"')
+    parser.add_argument(
+        '--calibration-bins',
+        type=int,
+        default=0,
+        help='number of confidence bins of the per-class calibration '
+        'statistics accumulated by "--streaming-eval"')
+    parser.add_argument(
+        '--calibration-out',
+        help='json file of the calibration statistics (default: '
+        'calibration.json next to the checkpoint)')
     parser.add_argument('--show', action='store_true', help='show results')
     parser.add_argument(
         '--show-dir', help='directory where painted images will be saved')
@@ -78,6 +93,12 @@ def parse_args():
         choices=['none', 'pytorch', 'slurm', 'mpi'],
         default='none',
         help='job launcher')
+    parser.add_argument(
+        '--samples-per-gpu',
+        type=int,
+        default=1,
+        help='number of test images per forward pass. With more than one '
+        'image, the images are batched by shape.')
     parser.add_argument(
         '--opacity',
         type=float,
@@ -102,6 +123,13 @@ def main():
     if args.eval and args.format_only:
         raise ValueError('--eval and --format_only cannot be both specified')
 
+    if args.streaming_eval and (not args.eval or args.out):
+        raise ValueError('--streaming-eval requires --eval and cannot be '
+                         'used with --out')
+
+    if args.calibration_bins and not args.streaming_eval:
+        raise ValueError('--calibration-bins requires --streaming-eval')
+
     if args.out is not None and not args.out.endswith(('.pkl', '.pickle')):
         raise ValueError('The output file must be a pkl file.')
 
@@ -134,14 +162,14 @@ def main():
         init_dist(args.launcher, **cfg.dist_params)
 
     # build the dataloader
-    # TODO: support multiple images per gpu (only minor changes are needed)
     dataset = build_dataset(cfg.data.test)
     data_loader = build_dataloader(
         dataset,
-        samples_per_gpu=1,
+        samples_per_gpu=args.samples_per_gpu,
         workers_per_gpu=cfg.data.workers_per_gpu,
         dist=distributed,
-        shuffle=False)
+        shuffle=False,
+        group_by_shape=args.samples_per_gpu > 1)
 
     # build the model and load checkpoint
     cfg.model.train_cfg = None
@@ -170,22 +198,28 @@ def main():
     efficient_test = False
     if args.eval_options is not None:
         efficient_test = args.eval_options.get('efficient_test', False)
+    evaluator = None
+    if args.streaming_eval:
+        evaluator = dataset.get_streaming_evaluator(args.calibration_bins)
+    start_time = time.time()
     if not distributed:
         model = MMDataParallel(model, device_ids=[0])
         outputs = single_gpu_test(model, data_loader, args.show, args.show_dir,
-                                  efficient_test, args.opacity)
+                                  efficient_test, args.opacity, evaluator)
     else:
         model = MMDistributedDataParallel(
             model.cuda(),
             device_ids=[torch.cuda.current_device()],
             broadcast_buffers=False)
-        print(model.parameters())
-        time.sleep(100)
         outputs = multi_gpu_test(model, data_loader, args.tmpdir,
-                                 args.gpu_collect, efficient_test)
+                                 args.gpu_collect, efficient_test, evaluator)
 
     rank, _ = get_dist_info()
     if rank == 0:
+        elapsed = time.time() - start_time
+        print(f'\nTested {len(dataset)} images in {elapsed:.1f} s '
+              f'({len(dataset) / elapsed:.2f} img/s, '
+              f'{args.samples_per_gpu} images per GPU)')
         if args.out:
             print(f'\nwriting results to {args.out}')
             mmcv.dump(outputs, args.out)
@@ -194,6 +228,13 @@ def main():
             dataset.format_results(outputs, **kwargs)
         if args.eval:
             dataset.evaluate(outputs, args.eval, **kwargs)
+        if args.calibration_bins:
+            calibration_out = args.calibration_out
+            if calibration_out is None:
+                calibration_out = os.path.join(
+                    os.path.dirname(args.checkpoint), 'calibration.json')
+            outputs.dump_calibration(calibration_out, dataset.CLASSES)
+            print(f'\nwriting calibration statistics to {calibration_out}')
 
 
 if __name__ == '__main__':
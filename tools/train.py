@@ -14,13 +14,13 @@ import time
 import mmcv
 import torch
 from mmcv.runner import init_dist
-from mmcv.utils import Config, DictAction, get_git_hash
+from mmcv.utils import DictAction, get_git_hash
 
 from mmseg import __version__
 from mmseg.apis import set_random_seed, train_segmentor
 from mmseg.datasets import build_dataset
 from mmseg.models.builder import build_train_model
-from mmseg.utils import collect_env, get_root_logger
+from mmseg.utils import collect_env, get_root_logger, load_config
 from mmseg.utils.collect_env import gen_code_archive
 
 
@@ -71,7 +71,7 @@ def parse_args(args):
 def main(args):
     args = parse_args(args)
 
-    cfg = Config.fromfile(args.config)
+    cfg = load_config(args.config)
     if args.options is not None:
         cfg.merge_from_dict(args.options)
     # set cudnn_benchmark